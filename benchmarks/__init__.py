@@ -0,0 +1 @@
+"""Offline benchmark suite: replays recorded LLMSherpa and LLM responses through local stub servers"""
@@ -0,0 +1,80 @@
+"""Compare two benchmark result files.
+
+    python -m benchmarks.compare BASE.json HEAD.json [--threshold 0.10]
+
+Prints the relative change of every latency, throughput, memory and accuracy
+figure and exits with status 1 when a metric regressed by more than the threshold.
+Runs with failed throughput requests are refused: their latencies are not comparable.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+# Metric paths where a larger value is better; everything else is a cost
+_HIGHER_IS_BETTER = ("requests_per_second", "accuracy")
+
+
+def metrics(results: Dict) -> Dict[str, float]:
+    """Flatten the comparable numbers of a results file into {path: value}"""
+    flat: Dict[str, float] = {}
+    for stage, stats in results.get("stages", {}).items():
+        for key in ("p50", "p95", "p99"):
+            if key in stats:
+                flat[f"stage.{stage}.{key}_ms"] = stats[key]
+    for level in results.get("throughput", []):
+        prefix = f"throughput.c{level['concurrency']}"
+        flat[f"{prefix}.requests_per_second"] = level["requests_per_second"]
+        for key in ("p50", "p95"):
+            if key in level["latency_ms"]:
+                flat[f"{prefix}.{key}_ms"] = level["latency_ms"][key]
+    for fixture, peak in results.get("peak_memory_bytes", {}).items():
+        flat[f"memory.{fixture}.peak_bytes"] = peak
+    for fixture, stats in results.get("accuracy", {}).items():
+        flat[f"accuracy.{fixture}.accuracy"] = stats["accuracy"]
+    for case, variants in results.get("serialization", {}).items():
+        for variant, stats in variants.items():
+            flat[f"serialization.{case}.{variant}.cpu_ms"] = stats["cpu_ms"]
+            flat[f"serialization.{case}.{variant}.peak_bytes"] = stats["peak_bytes"]
+    return flat
+
+
+def change(path: str, base: float, head: float) -> Tuple[float, bool]:
+    """Relative change and whether it is a regression"""
+    delta = (head - base) / base if base else 0.0
+    regression = delta < 0 if path.endswith(_HIGHER_IS_BETTER) else delta > 0
+    return delta, regression
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base", type=Path)
+    parser.add_argument("head", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    runs = {path: json.loads(path.read_text(encoding="utf-8")) for path in (args.base, args.head)}
+    for path, results in runs.items():
+        failed = sum(level["errors"] for level in results.get("throughput", []))
+        if failed:
+            sys.exit(f"{path}: {failed} throughput request(s) failed, not comparable")
+    base, head = metrics(runs[args.base]), metrics(runs[args.head])
+    regressions = []
+    for path in sorted(base.keys() & head.keys()):
+        delta, regression = change(path, base[path], head[path])
+        flag = ""
+        if regression and abs(delta) > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(path)
+        print(f"{path:<48} {base[path]:>14.3f} -> {head[path]:>14.3f}  {delta:+7.1%}{flag}")
+    for path in sorted(base.keys() ^ head.keys()):
+        print(f"{path:<48} only in {'base' if path in base else 'head'}")
+
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
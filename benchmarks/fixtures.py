@@ -0,0 +1,299 @@
+"""Benchmark fixtures: recorded backend responses plus ground truth for one SLIK report.
+
+A fixture is a directory under benchmarks/fixtures/ containing
+
+- `llmsherpa.json`: the blocks returned by the LLMSherpa parser for the PDF
+- `extraction.json`: the structured output the extraction LLM returned
+- `analysis.json`: the structured output the analysis LLM returned
+- `expected.json`: the hand-checked ground truth `SLIKReport`
+- `meta.json`: recorded latencies (seconds) and token usage of each backend call
+- `report.pdf` (optional): the original PDF; a blank PDF with the same page count is used otherwise
+
+Fixtures are recorded with `python -m benchmarks.record` or generated with
+`python -m benchmarks.fixtures synthesize`. The fixtures in `GENERATED_FIXTURES` are
+not committed: the benchmark generates them, deterministically, when they are missing.
+"""
+import argparse
+import copy
+import io
+import json
+import random
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from src.models import CreditFacility, PaymentHistory, SLIKReport
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+# Large synthetic fixtures generated on demand instead of being committed (name: synthesize arguments)
+GENERATED_FIXTURES = {
+    "synthetic-large": {"facilities": 40, "months": 24, "seed": 2},
+}
+
+# Metadata keys written into every benchmark PDF; the LLMSherpa stub finds the fixture
+# by the id, and the nonce makes every request a cache miss
+FIXTURE_KEY = "/SlikFixture"
+NONCE_KEY = "/SlikNonce"
+
+
+class Fixture:
+    """One recorded report, loaded from a fixture directory"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.name = path.name
+        self.blocks: List[Dict[str, Any]] = _read_json(path / "llmsherpa.json")
+        self.extraction: Dict[str, Any] = _read_json(path / "extraction.json")
+        self.analysis: Dict[str, Any] = _read_json(path / "analysis.json")
+        self.expected = SLIKReport.model_validate(_read_json(path / "expected.json"))
+        self.meta: Dict[str, Any] = _read_json(path / "meta.json") if (path / "meta.json").exists() else {}
+        pdf_path = path / "report.pdf"
+        self.pdf = pdf_path.read_bytes() if pdf_path.exists() else None
+
+    @property
+    def match(self) -> str:
+        """String that identifies this fixture inside an LLM prompt"""
+        return self.extraction.get("report_number") or self.name
+
+    @property
+    def page_count(self) -> int:
+        return max((block.get("page_idx", 0) for block in self.blocks), default=0) + 1
+
+    def pdf_bytes(self, nonce: str = "") -> bytes:
+        """The fixture PDF tagged with its id and `nonce` in the document metadata"""
+        from pypdf import PdfReader, PdfWriter
+
+        writer = PdfWriter()
+        if self.pdf is not None:
+            writer.append(PdfReader(io.BytesIO(self.pdf)))
+        else:
+            for _ in range(self.page_count):
+                writer.add_blank_page(width=595, height=842)
+        writer.add_metadata({FIXTURE_KEY: self.name, NONCE_KEY: nonce})
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return buffer.getvalue()
+
+
+def _read_json(path: Path) -> Any:
+    with path.open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path: Path, data: Any) -> None:
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+        f.write("\n")
+
+
+def load_fixtures(names: Optional[Sequence[str]] = None, root: Path = FIXTURES_DIR) -> List[Fixture]:
+    """Load the named fixtures, or every fixture directory under `root`"""
+    if names:
+        return [Fixture(root / name) for name in names]
+    return [Fixture(path) for path in sorted(root.iterdir()) if (path / "expected.json").exists()]
+
+
+def write_fixture(
+    path: Path,
+    blocks: List[Dict[str, Any]],
+    extraction: Dict[str, Any],
+    analysis: Dict[str, Any],
+    expected: Dict[str, Any],
+    meta: Dict[str, Any],
+    pdf: Optional[bytes] = None,
+) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+    _write_json(path / "llmsherpa.json", blocks)
+    _write_json(path / "extraction.json", extraction)
+    _write_json(path / "analysis.json", analysis)
+    _write_json(path / "expected.json", expected)
+    _write_json(path / "meta.json", meta)
+    if pdf is not None:
+        (path / "report.pdf").write_bytes(pdf)
+
+
+def _rupiah(amount: float) -> str:
+    return "Rp " + f"{amount:,.0f}".replace(",", ".")
+
+
+def report_sections(report: SLIKReport) -> List[List[str]]:
+    """iDeb-style text lines of a report, one list per section (header, then each facility)"""
+    header = [
+        "Informasi Laporan",
+        f"Nomor Laporan : {report.report_number}",
+        f"Tanggal Laporan : {report.report_date.isoformat()}",
+        f"Nama Debitur : {report.debtor_name}",
+        f"NIK : {report.debtor_id}",
+        f"Pekerjaan : {report.occupation}",
+        f"Total Plafon Efektif : {_rupiah(report.total_plafond)}",
+        f"Total Baki Debet : {_rupiah(report.total_outstanding)}",
+        f"Kualitas Terburuk : {report.worst_quality}",
+    ]
+    sections = [header]
+    for number, facility in enumerate(report.facilities, start=1):
+        lines = [
+            f"{number}. Pelapor : {facility.reporter}",
+            f"Cabang : {facility.branch}",
+            f"No Rekening : {facility.agreement_number}",
+            f"Jenis Kredit : {facility.facility_type}",
+            f"Plafon : {_rupiah(facility.plafond)}",
+            f"Baki Debet : {_rupiah(facility.outstanding)}",
+            f"Tanggal Mulai : {facility.start_date.isoformat()}",
+            f"Tanggal Jatuh Tempo : {facility.due_date.isoformat()}",
+            f"Kualitas : {facility.quality}",
+            f"Jumlah Hari Tunggakan : {facility.days_past_due}",
+        ]
+        months = ["Jan", "Feb", "Mar", "Apr", "Mei", "Jun", "Jul", "Agu", "Sep", "Okt", "Nov", "Des"]
+        for entry in facility.payment_history:
+            year, month = entry.month.split("-")
+            lines.append(f"{months[int(month) - 1]} {year} {entry.quality} {entry.days_past_due}")
+        sections.append(lines)
+    return sections
+
+
+def sections_to_blocks(sections: List[List[str]], lines_per_page: int = 60) -> List[Dict[str, Any]]:
+    """LLMSherpa-style blocks: a header block per section followed by one paragraph per line"""
+    blocks = []
+    line_number = 0
+    for section in sections:
+        for position, line in enumerate(section):
+            blocks.append({
+                "tag": "header" if position == 0 else "para",
+                "level": 0 if position == 0 else 1,
+                "page_idx": line_number // lines_per_page,
+                "block_idx": len(blocks),
+                "sentences": [line],
+            })
+            line_number += 1
+    return blocks
+
+
+def synthetic_report(facilities: int, months: int, seed: int = 0) -> SLIKReport:
+    """A random but plausible report with `facilities` facilities of `months` history months each"""
+    rnd = random.Random(seed)
+    items = []
+    for index in range(facilities):
+        history = []
+        for offset in range(months):
+            year, month = 2024 - offset // 12, 12 - offset % 12
+            quality = rnd.choice("11111111112345")
+            history.append(PaymentHistory(
+                month=f"{year}-{month:02d}",
+                quality=quality,
+                days_past_due=0 if quality == "1" else rnd.randint(1, 180),
+            ))
+        plafond = float(rnd.randint(1, 500) * 1_000_000)
+        items.append(CreditFacility(
+            reporter=f"PT Bank Contoh {index % 7 + 1}",
+            branch=f"KC Kota {index % 11 + 1}",
+            agreement_number=f"AK{seed:03d}{index:05d}",
+            facility_type=rnd.choice(["Kredit Pemilikan Rumah", "Kartu Kredit", "Kredit Tanpa Agunan", "Modal Kerja"]),
+            plafond=plafond,
+            outstanding=float(round(plafond * rnd.random())),
+            start_date=date(2018 + index % 5, 1 + index % 12, 1),
+            due_date=date(2028 + index % 5, 1 + index % 12, 1),
+            quality=history[0].quality if history else "1",
+            days_past_due=history[0].days_past_due if history else 0,
+            payment_history=history,
+        ))
+    worst = max((f.quality for f in items), default=None)
+    return SLIKReport(
+        report_number=f"SYN/{seed:04d}/{facilities:05d}",
+        report_date=date(2024, 12, 31),
+        debtor_name=f"Debitur Sintetis {seed}",
+        debtor_id=f"{3170000000000000 + seed}",
+        occupation="Karyawan Swasta",
+        total_plafond=sum(f.plafond for f in items),
+        total_outstanding=sum(f.outstanding for f in items),
+        worst_quality=worst,
+        facilities=items,
+    )
+
+
+def simulate_extraction(expected: Dict[str, Any], error_rate: float, seed: int = 0) -> Dict[str, Any]:
+    """What an extraction LLM could have returned for a synthetic report: the ground truth
+    with seeded mistakes of the kinds seen on real iDeb text.
+
+    Each facility field is independently subject to one of: a dropped value, an amount
+    whose thousands separators were read as a decimal point, a date read with day and
+    month swapped, or (for the payment history) the oldest months cut off.
+    """
+    rnd = random.Random(f"extraction-{seed}")
+    extraction = copy.deepcopy(expected)
+
+    def mistake() -> bool:
+        return rnd.random() < error_rate
+
+    for field in ("total_outstanding", "occupation"):
+        if mistake():
+            extraction[field] = None
+    for facility in extraction["facilities"]:
+        for field in ("branch", "facility_type", "days_past_due"):
+            if mistake():
+                facility[field] = None
+        for field in ("plafond", "outstanding"):
+            if facility.get(field) and mistake():
+                facility[field] = facility[field] / 1000
+        for field in ("start_date", "due_date"):
+            if facility.get(field) and mistake():
+                year, month, day = facility[field].split("-")
+                if int(day) <= 12:
+                    facility[field] = f"{year}-{day}-{month}"
+        if len(facility["payment_history"]) > 3 and mistake():
+            del facility["payment_history"][-rnd.randint(1, 3):]
+    return extraction
+
+
+def synthesize(path: Path, facilities: int, months: int, seed: int = 0, error_rate: float = 0.05) -> None:
+    """Write a synthetic fixture; its recorded extraction is the ground truth with `error_rate` of mistakes"""
+    report = synthetic_report(facilities, months, seed)
+    expected = report.model_dump(mode="json")
+    extraction = simulate_extraction(expected, error_rate, seed)
+    analysis = {
+        "credit_score": 720,
+        "risk_level": "Low",
+        "key_strengths": [{"factor": "Payment History", "detail": "Mostly current facilities"}],
+        "key_concerns": [{"factor": "Synthetic Data", "detail": "Generated benchmark fixture"}],
+        "payment_behavior": {"history": "Synthetic", "trend": "Stable"},
+        "credit_utilization": {"current_utilization": "n/a", "trend": "Stable"},
+        "recommendations": [{"action": "None", "suggestion": "Benchmark fixture"}],
+        "summary": "Synthetic benchmark analysis.",
+    }
+    # Latencies in the order of magnitude of the real services, scaled with report size
+    meta = {
+        "synthetic": True,
+        "extraction_error_rate": error_rate,
+        "ocr_seconds": round(0.1 + 0.002 * facilities * months / 24, 3),
+        "extraction_seconds": round(0.3 + 0.01 * facilities * months / 24, 3),
+        "analysis_seconds": 0.5,
+    }
+    write_fixture(path, sections_to_blocks(report_sections(report)), extraction, analysis, expected, meta)
+
+
+def ensure_generated(root: Path = FIXTURES_DIR) -> None:
+    """Synthesize the fixtures of GENERATED_FIXTURES that are not in `root` yet"""
+    for name, options in GENERATED_FIXTURES.items():
+        if not (root / name / "expected.json").exists():
+            synthesize(root / name, **options)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage benchmark fixtures")
+    commands = parser.add_subparsers(dest="command", required=True)
+    synth = commands.add_parser("synthesize", help="Generate a synthetic fixture")
+    synth.add_argument("name", help="Fixture directory name under benchmarks/fixtures")
+    synth.add_argument("--facilities", type=int, default=5)
+    synth.add_argument("--months", type=int, default=24)
+    synth.add_argument("--seed", type=int, default=0)
+    synth.add_argument("--error-rate", type=float, default=0.05, help="Share of fields the simulated LLM gets wrong")
+    synth.add_argument("--root", type=Path, default=FIXTURES_DIR)
+    args = parser.parse_args()
+
+    if args.command == "synthesize":
+        synthesize(args.root / args.name, args.facilities, args.months, args.seed, args.error_rate)
+        print(f"Wrote {args.root / args.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Record a benchmark fixture from a real SLIK PDF against the real LLMSherpa and Model Studio services.
+
+    python -m benchmarks.record path/to/slik.pdf --name bank-a-2024 [--keep-pdf]
+
+The recorded extraction is also written as `expected.json`; review and correct it
+by hand so it can serve as ground truth. SLIK reports contain personal data:
+anonymize fixtures (or use synthetic ones) before committing them.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from .fixtures import FIXTURES_DIR, write_fixture
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Record a benchmark fixture from a SLIK PDF")
+    parser.add_argument("pdf", type=Path)
+    parser.add_argument("--name", required=True, help="Fixture directory name under benchmarks/fixtures")
+    parser.add_argument("--keep-pdf", action="store_true", help="Store the original PDF in the fixture")
+    parser.add_argument("--root", type=Path, default=FIXTURES_DIR)
+    args = parser.parse_args()
+
+    from langchain_community.document_loaders.llmsherpa import LLMSherpaFileLoader
+    from llmsherpa.readers.layout_reader import Document
+
+    from src.analyzer import SLIKAnalyzer
+    from src.clients import get_llmsherpa_reader
+    from src.metrics import tracing
+    from src.processor import SLIKProcessor
+
+    processor, analyzer = SLIKProcessor(chunked=False, rule_based=False), SLIKAnalyzer()
+    api_url = LLMSherpaFileLoader._validate_llmsherpa_url(
+        url=processor.llmsherpa_api_url,
+        new_indent_parser=processor.loader_options["new_indent_parser"],
+        apply_ocr=processor.loader_options["apply_ocr"],
+    )
+    started = time.perf_counter()
+    blocks = get_llmsherpa_reader(api_url).read_pdf(str(args.pdf)).json
+    ocr_seconds = time.perf_counter() - started
+
+    with tracing() as extraction_trace:
+        report = processor.extract(Document(blocks).to_text())
+    with tracing() as analysis_trace:
+        analysis = analyzer.analyze(report)
+    extraction = extraction_trace.summary().get("llm", {})
+    analysis_stage = analysis_trace.summary().get("analysis", {})
+
+    meta = {
+        "source": args.pdf.name,
+        "ocr_seconds": round(ocr_seconds, 3),
+        "extraction_seconds": round(extraction.get("ms", 0) / 1000, 3),
+        "analysis_seconds": round(analysis_stage.get("ms", 0) / 1000, 3),
+        "extraction_tokens": {key: extraction.get(key, 0) for key in ("prompt_tokens", "completion_tokens")},
+        "analysis_tokens": {key: analysis_stage.get(key, 0) for key in ("prompt_tokens", "completion_tokens")},
+    }
+    extracted = report.model_dump(mode="json")
+    write_fixture(
+        args.root / args.name,
+        blocks=blocks,
+        extraction=extracted,
+        analysis=analysis.model_dump(mode="json"),
+        expected=extracted,
+        meta=meta,
+        pdf=args.pdf.read_bytes() if args.keep_pdf else None,
+    )
+    print(f"Wrote {args.root / args.name}; review expected.json before using it as ground truth")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Run the offline benchmark suite and write machine-readable results.
+
+    python -m benchmarks.run [--fixtures NAME ...] [--concurrency 1,4,16] [--output results.json]
+
+The LLMSherpa parser and the Model Studio API are replaced by local stub servers
+replaying recorded fixtures (see benchmarks/fixtures.py). Measured:
+
+- per-stage latency percentiles (upload, ocr, extract, llm, analysis) from the pipeline traces
+- request throughput and latency of the FastAPI app at several concurrency levels
+- peak Python memory allocated while processing one report
+- field-level extraction accuracy against the ground-truth SLIKReport of each fixture
+
+Results are compared between commits with `python -m benchmarks.compare`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .fixtures import Fixture, ensure_generated, load_fixtures
+from .stubs import StubServers
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Count, mean and p50/p90/p95/p99 of a list of durations in milliseconds"""
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values, dtype=float)
+    return {
+        "count": len(values),
+        "mean": round(float(array.mean()), 3),
+        **{f"p{q}": round(float(np.percentile(array, q)), 3) for q in (50, 90, 95, 99)},
+    }
+
+
+def _flatten(value: Any, prefix: str = "") -> Dict[str, Any]:
+    if isinstance(value, dict):
+        items: Dict[str, Any] = {}
+        for key, child in value.items():
+            items.update(_flatten(child, f"{prefix}.{key}" if prefix else key))
+        return items
+    if isinstance(value, list):
+        items = {f"{prefix}.length": len(value)}
+        for index, child in enumerate(value):
+            items.update(_flatten(child, f"{prefix}[{index}]"))
+        return items
+    return {prefix: value}
+
+
+def _same(expected: Any, actual: Any) -> bool:
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return abs(expected - actual) <= 1e-6 * max(abs(expected), 1)
+    if isinstance(expected, str) and isinstance(actual, str):
+        return expected.strip().casefold() == actual.strip().casefold()
+    return expected == actual
+
+
+def field_accuracy(expected: Dict[str, Any], actual: Dict[str, Any]) -> Dict[str, Any]:
+    """Share of non-null ground-truth fields that were extracted with the same value"""
+    truth = {path: value for path, value in _flatten(expected).items() if value is not None}
+    extracted = _flatten(actual)
+    mismatches = [path for path, value in truth.items() if not _same(value, extracted.get(path))]
+    return {
+        "fields": len(truth),
+        "correct": len(truth) - len(mismatches),
+        "accuracy": round((len(truth) - len(mismatches)) / len(truth), 4) if truth else 1.0,
+        "mismatches": mismatches[:20],
+    }
+
+
+def _git_commit() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "src"], capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def _write_pdf(fixture: Fixture, directory: Path) -> Path:
+    path = directory / f"{fixture.name}-{uuid.uuid4().hex}.pdf"
+    path.write_bytes(fixture.pdf_bytes(nonce=uuid.uuid4().hex))
+    return path
+
+
+def run_pipeline(processor, analyzer, fixtures: List[Fixture], repeat: int, analyze: bool, workdir: Path) -> Dict[str, Any]:
+    """Process every fixture `repeat` times (always a cache miss) and collect stage timings and accuracy"""
+    from src.metrics import tracing
+
+    # One untimed run so imports and client construction are not measured
+    path = _write_pdf(fixtures[0], workdir)
+    try:
+        processor.process_file(str(path))
+    finally:
+        path.unlink(missing_ok=True)
+
+    stages: Dict[str, List[float]] = {}
+    accuracy: Dict[str, Any] = {}
+    for fixture in fixtures:
+        for iteration in range(repeat):
+            path = _write_pdf(fixture, workdir)
+            try:
+                with tracing() as trace:
+                    report = processor.process_file(str(path))
+                    if analyze:
+                        analyzer.analyze(report)
+            finally:
+                path.unlink(missing_ok=True)
+            for span in trace.spans:
+                stages.setdefault(span.name, []).append(span.duration * 1000)
+            stages.setdefault("total", []).append((time.perf_counter() - trace.started) * 1000)
+            if iteration == 0:
+                accuracy[fixture.name] = field_accuracy(
+                    fixture.expected.model_dump(mode="json"), report.model_dump(mode="json")
+                )
+
+    fields = sum(item["fields"] for item in accuracy.values())
+    correct = sum(item["correct"] for item in accuracy.values())
+    accuracy["overall"] = {"fields": fields, "correct": correct, "accuracy": round(correct / fields, 4) if fields else 1.0}
+    return {"stages": {name: percentiles(values) for name, values in stages.items()}, "accuracy": accuracy}
+
+
+def measure_memory(processor, fixtures: List[Fixture], workdir: Path) -> Dict[str, int]:
+    """Peak bytes allocated by Python while processing one report of each fixture"""
+    peaks = {}
+    for fixture in fixtures:
+        path = _write_pdf(fixture, workdir)
+        tracemalloc.start()
+        try:
+            processor.process_file(str(path))
+            peaks[fixture.name] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            path.unlink(missing_ok=True)
+    return peaks
+
+
+async def _throughput_level(app, fixtures: List[Fixture], endpoint: str, concurrency: int, requests: int) -> Dict[str, Any]:
+    import httpx
+
+    payloads = [fixtures[index % len(fixtures)] for index in range(requests)]
+    bodies = [fixture.pdf_bytes(nonce=uuid.uuid4().hex) for fixture in payloads]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def one(client, body: bytes) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(endpoint, files={"file": ("report.pdf", body, "application/pdf")})
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, body) for body in bodies))
+        elapsed = time.perf_counter() - started
+
+    errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 3),
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def run_throughput(fixtures: List[Fixture], endpoint: str, levels: List[int], requests: int) -> List[Dict[str, Any]]:
+    """Requests per second and latency of the FastAPI app, in process, at each concurrency level"""
+    from src.api import app
+
+    async def run_levels() -> List[Dict[str, Any]]:
+        # One event loop for all levels: the shared async HTTP client and the stage
+        # semaphores are bound to the loop they were first used on
+        return [await _throughput_level(app, fixtures, endpoint, level, requests) for level in levels]
+
+    return asyncio.run(run_levels())
+
+
+def failed_requests(results: Dict[str, Any]) -> int:
+    """Throughput requests that did not succeed; results with failures are not a valid baseline"""
+    return sum(level["errors"] for level in results.get("throughput", []))
+
+
+def default_output() -> Path:
+    commit = _git_commit()["commit"] or "unknown"
+    return RESULTS_DIR / f"{commit[:12]}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Offline SLIK processor/analyzer benchmark")
+    parser.add_argument("--fixtures", nargs="*", help="Fixture names (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Pipeline runs per fixture for stage latencies")
+    parser.add_argument("--analyze", action="store_true", help="Include the analysis stage in the pipeline runs")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels for the API")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--endpoint", default="/process-slik", help="API endpoint used for throughput")
+    parser.add_argument("--ocr-latency", type=float, help="Override the recorded OCR latency (seconds)")
+    parser.add_argument("--llm-latency", type=float, help="Override the recorded LLM latency (seconds)")
+    parser.add_argument("--text-layer", action="store_true", help="Read embedded PDF text locally (SLIK_LOCAL_TEXT_LAYER)")
+    parser.add_argument("--skip-throughput", action="store_true")
+    parser.add_argument("--skip-memory", action="store_true")
+    parser.add_argument("--output", type=Path, help="Results file (default: benchmarks/results/<commit>-<time>.json)")
+    args = parser.parse_args(argv)
+
+    ensure_generated()
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        sys.exit("No fixtures found; record some with `python -m benchmarks.record` or `python -m benchmarks.fixtures synthesize`")
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+
+    with tempfile.TemporaryDirectory(prefix="slik-bench-") as tmp, StubServers(fixtures, args.ocr_latency, args.llm_latency) as stubs:
+        workdir = Path(tmp)
+        # Point the app at the stubs and at throwaway caches before any src module reads its settings
+        os.environ.update({
+            "LLMSHERPA_API_URL": stubs.llmsherpa_url,
+            "MODEL_STUDIO_BASE_URL": stubs.llm_base_url,
+            "MODEL_STUDIO_API_KEY": "benchmark",
+            "SLIK_CACHE_PATH": str(workdir / "cache.sqlite3"),
+            "SLIK_JOBS_DB": str(workdir / "jobs.sqlite3"),
+            "SLIK_JOBS_DIR": str(workdir / "jobs"),
+            "SLIK_HISTORY_DB": str(workdir / "history.sqlite3"),
+            "SLIK_PORTFOLIO_DIR": str(workdir / "portfolio"),
+            "SLIK_SINGLEFLIGHT_DB": str(workdir / "singleflight.sqlite3"),
+            "SLIK_LOCAL_TEXT_LAYER": "true" if args.text_layer else "false",
+        })
+        from src.analyzer import SLIKAnalyzer
+        from src.processor import SLIKProcessor
+
+        processor, analyzer = SLIKProcessor(), SLIKAnalyzer()
+        started = time.perf_counter()
+        results: Dict[str, Any] = {
+            "meta": {
+                **_git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "fixtures": [fixture.name for fixture in fixtures],
+                "args": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+            },
+        }
+        results.update(run_pipeline(processor, analyzer, fixtures, args.repeat, args.analyze, workdir))
+        if not args.skip_memory:
+            results["peak_memory_bytes"] = measure_memory(processor, fixtures, workdir)
+        if not args.skip_throughput:
+            results["throughput"] = run_throughput(fixtures, args.endpoint, levels, args.requests)
+        results["backend_calls"] = dict(stubs.calls)
+        results["meta"]["seconds"] = round(time.perf_counter() - started, 3)
+
+    output = args.output or default_output()
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+    for name, stats in results["stages"].items():
+        print(f"{name:>10}: p50 {stats.get('p50', 0):9.1f} ms  p95 {stats.get('p95', 0):9.1f} ms  (n={stats['count']})")
+    for level in results.get("throughput", []):
+        print(f"concurrency {level['concurrency']:>3}: {level['requests_per_second']:7.2f} req/s, "
+              f"p95 {level['latency_ms'].get('p95', 0):.0f} ms, {level['errors']} errors")
+    print(f"accuracy: {results['accuracy']['overall']['accuracy']:.2%}")
+    print(f"Results written to {output}")
+    failed = failed_requests(results)
+    if failed:
+        sys.exit(f"{failed} request(s) failed: fix them before using these results as a baseline")
+
+
+if __name__ == "__main__":
+    main()
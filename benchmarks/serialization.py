@@ -0,0 +1,162 @@
+"""Per-request CPU time and allocations of report (de)serialization.
+
+    python -m benchmarks.serialization [--facilities 300] [--months 24] [--iterations 30] [--output results.json]
+
+Each case compares the previous way the API, analyzer and Streamlit app turned a
+report into JSON (or back) with the current one, on a synthetic report of
+`--facilities` facilities with `--months` payment months each.
+
+`trusted_load` compares loading a report the service stored earlier (the result
+cache, the debtor history) with pydantic-core against a recursive
+`model_construct` that skips validation: building thousands of nested models
+in Python costs more than validating them in pydantic-core, so stored reports
+keep going through `model_validate_json`.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from src.analyzer import CreditAnalysis
+from src.api import AnalyzeRequest
+from src.features import estimate_tokens
+from src.models import CreditFacility, PaymentHistory, SLIKReport
+from src.serialization import adapter, dumps
+
+from .fixtures import synthetic_report
+from .run import RESULTS_DIR, _git_commit
+
+
+class _DictAnalyzeRequest(BaseModel):
+    """The request model of /analyze-json before slik_data was typed"""
+    slik_data: Dict[str, Any]
+    mode: Optional[str] = None
+    narrative: bool = True
+
+
+def _construct(data: Dict[str, Any]) -> SLIKReport:
+    """Build a report from trusted data with model_construct (dates are left as strings)"""
+    facilities = [
+        CreditFacility.model_construct(**{
+            **facility,
+            "payment_history": [PaymentHistory.model_construct(**entry) for entry in facility["payment_history"]],
+        })
+        for facility in data["facilities"]
+    ]
+    return SLIKReport.model_construct(**{**data, "facilities": facilities})
+
+
+def measure(function: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    """CPU and wall milliseconds per call, and the peak Python allocation of one call"""
+    function()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return {
+        "cpu_ms": round((time.process_time() - cpu) / iterations * 1000, 3),
+        "wall_ms": round((time.perf_counter() - wall) / iterations * 1000, 3),
+        "peak_bytes": peak,
+    }
+
+
+def cases(report: SLIKReport, analysis: CreditAnalysis) -> Dict[str, Dict[str, Callable[[], Any]]]:
+    body = json.dumps({"slik_data": report.model_dump(mode="json"), "narrative": False}).encode("utf-8")
+    stored = report.model_dump_json()
+
+    def legacy_request():
+        request = _DictAnalyzeRequest.model_validate(json.loads(body))
+        return SLIKReport.model_validate(request.slik_data)
+
+    def legacy_prompt():
+        data = report.model_dump()
+        estimate_tokens(data)
+        return str(data)
+
+    def prompt():
+        data = report.model_dump_json()
+        estimate_tokens(data)
+        return data
+
+    return {
+        "process_response": {
+            "baseline": lambda: json.dumps(report.model_dump(mode="json")).encode("utf-8"),
+            "fast": lambda: dumps(report),
+        },
+        "analyze_response": {
+            "baseline": lambda: json.dumps({
+                "slik_data": report.model_dump(mode="json"), "analysis": analysis.model_dump(mode="json"),
+            }).encode("utf-8"),
+            "fast": lambda: dumps({"slik_data": report, "analysis": analysis}),
+        },
+        "analyze_json_request": {
+            "baseline": legacy_request,
+            # What FastAPI does with the typed request model: one validation pass of the parsed body
+            "fast": lambda: adapter(AnalyzeRequest).validate_python(json.loads(body)).slik_data,
+        },
+        "analyzer_prompt_input": {
+            "baseline": legacy_prompt,
+            "fast": prompt,
+        },
+        "streamlit_raw_json": {
+            "baseline": lambda: json.dumps(json.loads(report.model_dump_json()), indent=2),
+            "fast": lambda: report.model_dump_json(indent=2),
+        },
+        "trusted_load": {
+            "baseline": lambda: SLIKReport.model_validate_json(stored),
+            "construct": lambda: _construct(json.loads(stored)),
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Report serialization benchmark")
+    parser.add_argument("--facilities", type=int, default=300)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--output", type=Path, help="Results file (default: benchmarks/results/<commit>-serialization-<time>.json)")
+    args = parser.parse_args(argv)
+
+    report = synthetic_report(args.facilities, args.months)
+    analysis = CreditAnalysis.model_validate(
+        json.loads((Path(__file__).parent / "fixtures" / "synthetic-small" / "analysis.json").read_text(encoding="utf-8"))
+    )
+    results: Dict[str, Any] = {
+        "meta": {
+            **_git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "facilities": args.facilities,
+            "months": args.months,
+            "report_bytes": len(report.model_dump_json()),
+            "iterations": args.iterations,
+        },
+        "serialization": {},
+    }
+    for name, variants in cases(report, analysis).items():
+        results["serialization"][name] = {variant: measure(function, args.iterations) for variant, function in variants.items()}
+
+    commit = (results["meta"]["commit"] or "unknown")[:12]
+    output = args.output or RESULTS_DIR / f"{commit}-serialization-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+    for name, variants in results["serialization"].items():
+        baseline = variants["baseline"]
+        for variant, stats in variants.items():
+            ratio = baseline["cpu_ms"] / stats["cpu_ms"] if stats["cpu_ms"] else 0.0
+            print(f"{name:>22} {variant:>13}: {stats['cpu_ms']:8.2f} ms CPU  {stats['peak_bytes'] / 1024:9.0f} KiB peak  ({ratio:4.1f}x)")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
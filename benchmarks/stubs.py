@@ -0,0 +1,176 @@
+"""Local stand-ins for the LLMSherpa parser and the OpenAI-compatible Model Studio API.
+
+Both servers replay fixture responses after sleeping for the recorded latency of
+the call (or a fixed override), so benchmarks need no network access and are
+repeatable between commits.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from .fixtures import FIXTURE_KEY, Fixture
+
+_FIXTURE_ID = re.compile(re.escape(FIXTURE_KEY).encode() + rb"\s*\(([^)]*)\)")
+_OCTAL_ESCAPE = re.compile(rb"\\([0-7]{3})")
+
+
+def fixture_id(pdf: bytes) -> Optional[str]:
+    """Fixture name from the metadata of a benchmark PDF (pypdf writes some characters as octal escapes)"""
+    match = _FIXTURE_ID.search(pdf)
+    if match is None:
+        return None
+    return _OCTAL_ESCAPE.sub(lambda escape: bytes([int(escape.group(1), 8)]), match.group(1)).decode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stubs: "StubServers"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _LLMSherpaHandler(_Handler):
+    def do_POST(self) -> None:
+        body = self._read_body()
+        fixture = self.stubs.fixtures.get(fixture_id(body))
+        if fixture is None:
+            self._send_json(404, {"error": "No fixture for this PDF (page ranges lose the fixture metadata)"})
+            return
+        self.stubs.count("llmsherpa")
+        time.sleep(self.stubs.latency("ocr", fixture))
+        self._send_json(200, {"return_dict": {"result": {"blocks": fixture.blocks}}})
+
+
+class _LLMHandler(_Handler):
+    def do_POST(self) -> None:
+        request = json.loads(self._read_body())
+        if request.get("stream"):
+            self._send_json(400, {"error": {"message": "Streaming is not supported by the benchmark stub"}})
+            return
+        messages = request.get("messages", [])
+        system = " ".join(m["content"] for m in messages if m.get("role") == "system" and isinstance(m.get("content"), str))
+        human = " ".join(m["content"] for m in messages if m.get("role") != "system" and isinstance(m.get("content"), str))
+
+        is_analysis = "credit analyst" in system
+        fixture = self.stubs.find(human)
+        if fixture is None and is_analysis:
+            # The compact analyzer view carries no identifiers; any recorded analysis will do
+            fixture = next(iter(self.stubs.fixtures.values()))
+        if fixture is None:
+            self._send_json(404, {"error": {"message": "No fixture matches this prompt"}})
+            return
+        if is_analysis:
+            kind, payload = "analysis", fixture.analysis
+        elif "single credit facility section" in system:
+            kind, payload = "facility", self.stubs.facility(fixture, human) or {}
+        else:
+            kind, payload = "extraction", fixture.extraction
+
+        self.stubs.count(kind)
+        time.sleep(self.stubs.latency(kind, fixture))
+        content = json.dumps(payload)
+        prompt_tokens = (len(system) + len(human)) // 4
+        completion_tokens = len(content) // 4
+        message: Dict[str, Any] = {"role": "assistant", "content": content}
+        tools = request.get("tools") or []
+        if tools:
+            # Structured output through function calling answers with a call of the schema's tool
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex}",
+                "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": content},
+            }]}
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if tools else "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+class StubServers:
+    """LLMSherpa and LLM stub servers on ephemeral localhost ports, used as a context manager.
+
+    `ocr_latency` / `llm_latency` override the recorded latencies (in seconds) of every call.
+    """
+
+    def __init__(self, fixtures: List[Fixture], ocr_latency: Optional[float] = None, llm_latency: Optional[float] = None):
+        self.fixtures: Dict[str, Fixture] = {fixture.name: fixture for fixture in fixtures}
+        self.ocr_latency = ocr_latency
+        self.llm_latency = llm_latency
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._servers: List[ThreadingHTTPServer] = []
+
+    def _start(self, handler: type) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), type(handler.__name__, (handler,), {"stubs": self}))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def __enter__(self) -> "StubServers":
+        self.llmsherpa_url = self._start(_LLMSherpaHandler) + "/api/parseDocument?renderFormat=all"
+        self.llm_base_url = self._start(_LLMHandler) + "/v1"
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def count(self, kind: str) -> None:
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def latency(self, kind: str, fixture: Fixture) -> float:
+        if kind == "ocr":
+            override, recorded = self.ocr_latency, fixture.meta.get("ocr_seconds", 0)
+        else:
+            override, recorded = self.llm_latency, fixture.meta.get(f"{kind}_seconds", fixture.meta.get("extraction_seconds", 0))
+        return override if override is not None else recorded
+
+    def find(self, text: str) -> Optional[Fixture]:
+        """The fixture whose report appears in `text`"""
+        for fixture in self.fixtures.values():
+            if fixture.match in text:
+                return fixture
+        # Facility sections do not contain the report number; match them by agreement number
+        for fixture in self.fixtures.values():
+            if self.facility(fixture, text) is not None:
+                return fixture
+        return None
+
+    @staticmethod
+    def facility(fixture: Fixture, text: str) -> Optional[Dict[str, Any]]:
+        """The recorded facility whose agreement number appears in `text`"""
+        for facility in fixture.extraction.get("facilities", []):
+            if facility.get("agreement_number") and facility["agreement_number"] in text:
+                return facility
+        return None
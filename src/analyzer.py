@@ -1,8 +1,16 @@
 from typing import Dict, List
+from functools import cached_property
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
 from .models import SLIKReport
+from .concurrency import RateLimiter, StageLimits, llm_rate_limiter, run_in_thread, stage_limits
+from .clients import get_chat_model
+from .features import build_compact_view, estimate_tokens, TOKEN_BUDGET
+from .metrics import record, stage, track_llm_usage
+from .history import UTILIZATION_CHANGE_THRESHOLD, is_material, report_delta
+from .cache import content_hash
+from .singleflight import SingleFlight
+from typing import Any, AsyncIterator, Iterator, Optional, Union
+import json
 import os
 
 class CreditAnalysis(BaseModel):
@@ -17,20 +25,43 @@ class CreditAnalysis(BaseModel):
     summary: str = Field(..., description="Overall analysis summary")
 
 class SLIKAnalyzer:
-    def __init__(self):
-        # self.llm = ChatOpenAI(
+    def __init__(
+        self,
+        limits: Optional[StageLimits] = None,
+        mode: Optional[str] = None,
+        token_budget: int = TOKEN_BUDGET,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: Optional[int] = None,
+        flights: Optional[SingleFlight] = None,
+    ):
+        self.limits = limits or stage_limits
+        self.rate_limiter = rate_limiter or llm_rate_limiter
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("SLIK_LLM_MAX_RETRIES", "4"))
+        self.max_concurrency = int(os.getenv("SLIK_BATCH_MAX_CONCURRENCY", "8"))
+        self.expected_output_tokens = int(os.getenv("SLIK_ANALYSIS_OUTPUT_TOKENS", "800"))
+        self.model_name = "qwen-turbo"
+        # "full" sends the whole report dump, "compact" a precomputed summary within token_budget
+        self.mode = mode or os.getenv("SLIK_ANALYZER_MODE", "full")
+        self.token_budget = token_budget
+        # Identical analyses requested concurrently (here or in another worker) share one LLM call
+        self.flights = flights or SingleFlight("analysis")
+
+    # The LLM client and chain are built on first use so that creating an
+    # analyzer does not import langchain or open connections
+
+    @cached_property
+    def llm(self):
+        # return ChatOpenAI(
         #     model="gpt-4",
         #     temperature=0.1,
         # )
+        return get_chat_model(self.model_name, temperature=0.0)
 
-        self.llm = ChatOpenAI(
-            api_key=os.getenv("MODEL_STUDIO_API_KEY"),
-            model="qwen-turbo",
-            base_url=os.getenv("MODEL_STUDIO_BASE_URL"),
-            temperature=0.0,
-        )
-        
-        self.analysis_prompt = ChatPromptTemplate.from_messages([
+    @cached_property
+    def analysis_prompt(self):
+        from langchain_core.prompts import ChatPromptTemplate
+
+        return ChatPromptTemplate.from_messages([
             (
                 "system",
                 """
@@ -108,11 +139,267 @@ You are an expert credit analyst specialized in Indonesian banking and credit re
             ),
             ("human", "{report_json}")
         ])
-        
-        self.structured_llm = self.llm.with_structured_output(schema=CreditAnalysis)
-        self.analyzer = self.analysis_prompt | self.structured_llm
-
-    def analyze(self, report: SLIKReport) -> CreditAnalysis:
-        """Analyze a SLIK report and return structured insights"""
-        report_json = report.model_dump()
-        return self.analyzer.invoke({"report_json": report_json})
+
+    @cached_property
+    def structured_llm(self):
+        return self.llm.with_structured_output(schema=CreditAnalysis)
+
+    @cached_property
+    def analyzer(self):
+        return self.analysis_prompt | self.structured_llm
+
+    @cached_property
+    def delta_prompt(self):
+        from langchain_core.prompts import ChatPromptTemplate
+
+        return ChatPromptTemplate.from_messages([
+            (
+                "system",
+                """You are an expert credit analyst specialized in Indonesian banking and SLIK iDeb reports.
+                You are given your previous CreditAnalysis of a debtor and the changes in the debtor's
+                new SLIK report since then: new delinquencies, utilization change, and new, closed or
+                changed facilities. Update the analysis for the new report: keep every finding that is
+                still valid, revise the credit score, risk level and the sections the changes affect,
+                and return the complete CreditAnalysis."""
+            ),
+            ("human", "Previous analysis:\n{previous_analysis}\n\nChanges since the previous report:\n{delta}")
+        ])
+
+    @cached_property
+    def delta_analyzer(self):
+        return self.delta_prompt | self.structured_llm
+
+    def _resilient(self, chain):
+        """`chain` behind the shared rate limiter, retried with jittered backoff on 429/5xx"""
+        import openai
+        from langchain_core.runnables import RunnableLambda
+
+        throttle = RunnableLambda(self._throttle, afunc=self._athrottle)
+        return (throttle | chain).with_retry(
+            retry_if_exception_type=(
+                openai.RateLimitError,
+                openai.InternalServerError,
+                openai.APIConnectionError,
+                openai.APITimeoutError,
+            ),
+            wait_exponential_jitter=True,
+            stop_after_attempt=self.max_retries + 1,
+        )
+
+    @cached_property
+    def resilient_analyzer(self):
+        return self._resilient(self.analyzer)
+
+    @cached_property
+    def resilient_delta_analyzer(self):
+        return self._resilient(self.delta_analyzer)
+
+    @cached_property
+    def streaming_analyzer(self):
+        """Analysis chain whose output parser yields partial dicts while tokens arrive"""
+        # A JSON schema (rather than the pydantic class) lets the parser emit partial
+        # objects; the headline fields are moved first so they stream in early
+        schema = CreditAnalysis.model_json_schema()
+        first = ["credit_score", "risk_level", "summary"]
+        schema["properties"] = {
+            **{name: schema["properties"][name] for name in first},
+            **{name: value for name, value in schema["properties"].items() if name not in first},
+        }
+        return self.analysis_prompt | self.llm.with_structured_output(schema=schema)
+
+    @cached_property
+    def _prompt_tokens(self) -> int:
+        return estimate_tokens(self.analysis_prompt.pretty_repr())
+
+    def _estimate_request_tokens(self, inputs: Dict[str, Any]) -> int:
+        return self._prompt_tokens + sum(estimate_tokens(value) for value in inputs.values()) + self.expected_output_tokens
+
+    def _throttle(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        self.rate_limiter.acquire(self._estimate_request_tokens(inputs))
+        return inputs
+
+    async def _athrottle(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        await self.rate_limiter.aacquire(self._estimate_request_tokens(inputs))
+        return inputs
+
+    def _flight_key(self, report_json: str) -> str:
+        return content_hash(f"{self.model_name}\x00{report_json}".encode("utf-8"))
+
+    def build_input(self, report: SLIKReport, mode: Optional[str] = None) -> str:
+        """Prompt input for a report: the full dump or the compact analytic view"""
+        mode = mode or self.mode
+        if mode == "compact":
+            return json.dumps(build_compact_view(report, self.token_budget), default=str)
+        if mode == "full":
+            return report.model_dump_json()
+        raise ValueError(f"Unknown analyzer mode: {mode}")
+
+    def prescore(self, report: SLIKReport) -> CreditAnalysis:
+        """Deterministic preliminary analysis from vectorized metrics, without an LLM call"""
+        return self.prescore_many([report])[0]
+
+    def prescore_many(self, reports: List[SLIKReport]) -> List[CreditAnalysis]:
+        """Preliminary analyses for a batch of reports, scored together"""
+        from .scoring import score_reports, preliminary_analysis
+
+        with stage("prescore", reports=len(reports)):
+            scores = score_reports(reports)
+            return [CreditAnalysis(**preliminary_analysis(row)) for _, row in scores.iterrows()]
+
+    def analyze(self, report: SLIKReport, mode: Optional[str] = None, narrative: bool = True) -> CreditAnalysis:
+        """Analyze a SLIK report and return structured insights.
+
+        With narrative=False the rule-based preliminary analysis is returned right away.
+        """
+        if not narrative:
+            return self.prescore(report)
+        report_json = self.build_input(report, mode)
+
+        def analyze() -> CreditAnalysis:
+            with self.limits.thread_limit("llm"), stage("analysis"), track_llm_usage() as callbacks:
+                return self.resilient_analyzer.invoke({"report_json": report_json}, config={"callbacks": callbacks})
+
+        return self.flights.run(self._flight_key(report_json), analyze, CreditAnalysis.model_dump_json, CreditAnalysis.model_validate_json)
+
+    async def aanalyze(self, report: SLIKReport, mode: Optional[str] = None, narrative: bool = True) -> CreditAnalysis:
+        """Async version of analyze"""
+        if not narrative:
+            # pandas scoring, kept off the event loop
+            return await run_in_thread(self.prescore, report)
+        report_json = self.build_input(report, mode)
+
+        async def analyze() -> CreditAnalysis:
+            async with self.limits.async_limit("llm"):
+                with stage("analysis"), track_llm_usage() as callbacks:
+                    return await self.resilient_analyzer.ainvoke({"report_json": report_json}, config={"callbacks": callbacks})
+
+        return await self.flights.arun(self._flight_key(report_json), analyze, CreditAnalysis.model_dump_json, CreditAnalysis.model_validate_json)
+
+    def _delta_inputs(self, previous_analysis: CreditAnalysis, delta: Dict[str, Any]) -> Dict[str, str]:
+        return {
+            "previous_analysis": previous_analysis.model_dump_json(),
+            "delta": json.dumps(delta, default=str),
+        }
+
+    def analyze_delta(
+        self,
+        report: SLIKReport,
+        previous_report: Optional[SLIKReport],
+        previous_analysis: Optional[CreditAnalysis],
+    ) -> CreditAnalysis:
+        """Update the debtor's previous analysis from what changed since the previous report.
+
+        Runs the full analysis when there is nothing to compare with, and returns the
+        previous analysis as is when none of the changes can affect it.
+        """
+        if previous_report is None or previous_analysis is None:
+            return self.analyze(report)
+        delta = report_delta(previous_report, report)
+        if not is_material(delta):
+            record(analysis_reused=1)
+            return previous_analysis
+        inputs = self._delta_inputs(previous_analysis, delta)
+        with self.limits.thread_limit("llm"), stage("analysis"), track_llm_usage() as callbacks:
+            updated = self.resilient_delta_analyzer.invoke(inputs, config={"callbacks": callbacks})
+        return _keep_unchanged_sections(previous_analysis, updated, delta)
+
+    async def aanalyze_delta(
+        self,
+        report: SLIKReport,
+        previous_report: Optional[SLIKReport],
+        previous_analysis: Optional[CreditAnalysis],
+    ) -> CreditAnalysis:
+        """Async version of analyze_delta"""
+        if previous_report is None or previous_analysis is None:
+            return await self.aanalyze(report)
+        delta = report_delta(previous_report, report)
+        if not is_material(delta):
+            record(analysis_reused=1)
+            return previous_analysis
+        inputs = self._delta_inputs(previous_analysis, delta)
+        async with self.limits.async_limit("llm"):
+            with stage("analysis"), track_llm_usage() as callbacks:
+                updated = await self.resilient_delta_analyzer.ainvoke(inputs, config={"callbacks": callbacks})
+        return _keep_unchanged_sections(previous_analysis, updated, delta)
+
+    def stream_analysis(self, report: SLIKReport, mode: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the analysis as a growing partial dict; the last item is the complete result.
+
+        Streamed calls are rate limited but not retried, since partial output was already sent.
+        """
+        inputs = {"report_json": self.build_input(report, mode)}
+        with self.limits.thread_limit("llm"), stage("analysis"), track_llm_usage() as callbacks:
+            self._throttle(inputs)
+            yield from self.streaming_analyzer.stream(inputs, config={"callbacks": callbacks})
+
+    async def astream_analysis(self, report: SLIKReport, mode: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async version of stream_analysis"""
+        inputs = {"report_json": self.build_input(report, mode)}
+        async with self.limits.async_limit("llm"):
+            with stage("analysis"), track_llm_usage() as callbacks:
+                await self._athrottle(inputs)
+                async for partial in self.streaming_analyzer.astream(inputs, config={"callbacks": callbacks}):
+                    yield partial
+
+    def _batch_inputs(self, reports: List[SLIKReport], mode: Optional[str]) -> List[Any]:
+        inputs = []
+        for report in reports:
+            try:
+                inputs.append({"report_json": self.build_input(report, mode)})
+            except Exception as e:
+                inputs.append(e)
+        return inputs
+
+    def analyze_many(
+        self,
+        reports: List[SLIKReport],
+        mode: Optional[str] = None,
+        narrative: bool = True,
+        max_concurrency: Optional[int] = None,
+    ) -> List[Union[CreditAnalysis, Exception]]:
+        """Analyze many reports; results are in input order and a failed item is returned as its exception"""
+        if not narrative:
+            return self.prescore_many(reports)
+        inputs = self._batch_inputs(reports, mode)
+        valid = [item for item in inputs if not isinstance(item, Exception)]
+        with stage("analysis", reports=len(valid)), track_llm_usage() as callbacks:
+            results = iter(self.resilient_analyzer.batch(
+                valid,
+                config={"max_concurrency": max_concurrency or self.max_concurrency, "callbacks": callbacks},
+                return_exceptions=True,
+            ))
+        return [item if isinstance(item, Exception) else next(results) for item in inputs]
+
+    async def aanalyze_many(
+        self,
+        reports: List[SLIKReport],
+        mode: Optional[str] = None,
+        narrative: bool = True,
+        max_concurrency: Optional[int] = None,
+    ) -> List[Union[CreditAnalysis, Exception]]:
+        """Async version of analyze_many"""
+        if not narrative:
+            return await run_in_thread(self.prescore_many, reports)
+        inputs = self._batch_inputs(reports, mode)
+        valid = [item for item in inputs if not isinstance(item, Exception)]
+        with stage("analysis", reports=len(valid)), track_llm_usage() as callbacks:
+            results = iter(await self.resilient_analyzer.abatch(
+                valid,
+                config={"max_concurrency": max_concurrency or self.max_concurrency, "callbacks": callbacks},
+                return_exceptions=True,
+            ))
+        return [item if isinstance(item, Exception) else next(results) for item in inputs]
+
+
+def _keep_unchanged_sections(previous: CreditAnalysis, updated: CreditAnalysis, delta: Dict[str, Any]) -> CreditAnalysis:
+    """Reuse the previous payment behavior and utilization sections when the delta does not touch them"""
+    keep = {}
+    payment_changed = delta["new_delinquencies"] or any(
+        "quality" in item or "days_past_due" in item for item in delta["changed_facilities"]
+    )
+    if not payment_changed:
+        keep["payment_behavior"] = previous.payment_behavior
+    change = delta["utilization"]["change"]
+    if not (delta["new_facilities"] or delta["closed_facilities"]) and (change is None or abs(change) < UTILIZATION_CHANGE_THRESHOLD):
+        keep["credit_utilization"] = previous.credit_utilization
+    return updated.model_copy(update=keep)
@@ -1,66 +1,303 @@
 # src/api.py
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-from typing import Dict, Any
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from typing import Dict, Any, List, Optional
+from datetime import date
 from .processor import SLIKProcessor
-from .analyzer import SLIKAnalyzer
+from .analyzer import SLIKAnalyzer, CreditAnalysis
 from .models import SLIKReport
-import json
+from .history import report_delta
+from .portfolio import GROUP_COLUMNS, PortfolioStore, has_pyarrow
+from .jobs import JobQueue, QueueFullError
+from .concurrency import run_in_thread
+from .metrics import latest_metrics, tracing
+from .uploads import PDF_FORM, TooManyFilesError, form_body, receive_pdf, receive_uploads
+from .serialization import ModelJSONResponse, dumps
+import logging
+import os
 from pydantic import BaseModel
 
-app = FastAPI(title="SLIK Processor API")
+# Ingestion is skipped without pyarrow, like the text layer reader without pypdf
+PORTFOLIO_INGEST = os.getenv("SLIK_PORTFOLIO_INGEST", "true").lower() in ("1", "true", "yes") and has_pyarrow()
+
+logger = logging.getLogger(__name__)
 
 # Initialize processors
 processor = SLIKProcessor()
 analyzer = SLIKAnalyzer()
+portfolio = PortfolioStore()
+job_queue = JobQueue(processor, analyzer, portfolio=portfolio if PORTFOLIO_INGEST else None)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+
+app = FastAPI(title="SLIK Processor API", lifespan=lifespan, default_response_class=ModelJSONResponse)
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Trace the stages of each request and report them in a Server-Timing header"""
+    with tracing() as trace:
+        response = await call_next(request)
+    response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+def remember(background_tasks: BackgroundTasks, report: SLIKReport) -> None:
+    """Add a processed report to the portfolio store once the response has been sent"""
+    if PORTFOLIO_INGEST:
+        background_tasks.add_task(ingest, report)
+
+async def ingest(report: SLIKReport) -> None:
+    """Add a report to the portfolio store; a failure there is only logged"""
+    try:
+        await run_in_thread(portfolio.add, [report])
+    except Exception as e:
+        logger.warning("Could not add report %s to the portfolio: %s", report.report_number, e)
 
 class AnalyzeRequest(BaseModel):
     """Request model for analysis endpoint when sending processed SLIK data"""
-    slik_data: Dict[str, Any]
+    slik_data: SLIKReport
+    mode: Optional[str] = None  # "full" or "compact"; defaults to SLIK_ANALYZER_MODE
+    narrative: bool = True  # False returns the rule-based preliminary score without an LLM call
+
+class BatchAnalyzeRequest(BaseModel):
+    """Request model for bulk analysis of already processed SLIK data"""
+    items: List[Dict[str, Any]]
+    mode: Optional[str] = None
+    narrative: bool = True
+    max_concurrency: Optional[int] = None
+
+class PortfolioReportsRequest(BaseModel):
+    """Request model for adding already processed SLIK data to the portfolio store"""
+    items: List[SLIKReport]
 
-@app.post("/process-slik")
-async def process_slik(file: UploadFile = File(...)):
+@app.post("/process-slik", openapi_extra=PDF_FORM)
+async def process_slik(request: Request, background_tasks: BackgroundTasks):
     """Process a SLIK PDF file and return structured data"""
+    upload = await receive_pdf(request)
+    path, file_hash = upload.path, upload.file_hash
     try:
-        content = await file.read()
-        result = processor.process_uploaded_file(content)
-        return JSONResponse(content=result.model_dump())
+        result = await processor.aprocess_file(str(path), file_hash)
+        remember(background_tasks, result)
+        return ModelJSONResponse(content=result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        path.unlink(missing_ok=True)
 
-@app.post("/analyze-slik")
-async def analyze_slik(file: UploadFile = File(...)):
+@app.post("/analyze-slik", openapi_extra=PDF_FORM)
+async def analyze_slik(request: Request, background_tasks: BackgroundTasks, mode: Optional[str] = None, narrative: bool = True):
     """Process a SLIK PDF file and return both structured data and analysis"""
+    upload = await receive_pdf(request)
+    path, file_hash = upload.path, upload.file_hash
     try:
         # Process the file
-        content = await file.read()
-        processed_result = processor.process_uploaded_file(content)
+        processed_result = await processor.aprocess_file(str(path), file_hash)
+        remember(background_tasks, processed_result)
         
         # Analyze the processed data
-        analysis_result = analyzer.analyze(processed_result)
+        analysis_result = await analyzer.aanalyze(processed_result, mode, narrative)
         
         # Return both processing and analysis results
-        return JSONResponse(content={
-            "slik_data": processed_result.model_dump(),
-            "analysis": analysis_result.model_dump()
+        return ModelJSONResponse(content={
+            "slik_data": processed_result,
+            "analysis": analysis_result
         })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        path.unlink(missing_ok=True)
+
+@app.post("/analyze-slik/incremental", openapi_extra=PDF_FORM)
+async def analyze_slik_incremental(request: Request, background_tasks: BackgroundTasks):
+    """Process a new SLIK pull of a debtor, re-extracting and re-analyzing only what changed since the previous one"""
+    upload = await receive_pdf(request)
+    path, file_hash = upload.path, upload.file_hash
+    try:
+        report, previous = await processor.aprocess_incremental(str(path), file_hash)
+        remember(background_tasks, report)
+        previous_analysis = None
+        if previous is not None:
+            stored = await run_in_thread(processor.history.analysis, previous.debtor_id, previous.report_number)
+            previous_analysis = CreditAnalysis.model_validate_json(stored) if stored else None
+        analysis = await analyzer.aanalyze_delta(report, previous, previous_analysis)
+        await run_in_thread(processor.history.save_analysis, report, analysis.model_dump_json())
+        return ModelJSONResponse(content={
+            "slik_data": report,
+            "analysis": analysis,
+            "previous_report_number": previous.report_number if previous is not None else None,
+            "delta": report_delta(previous, report) if previous is not None else None,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        path.unlink(missing_ok=True)
+
+async def stream_events(report: SLIKReport, mode: Optional[str], include_report: bool):
+    """NDJSON events: the report (optionally), partial analyses as they grow, then the final analysis"""
+    if include_report:
+        yield dumps({"event": "slik_data", "data": report}) + b"\n"
+    partial: Dict[str, Any] = {}
+    try:
+        async for partial in analyzer.astream_analysis(report, mode):
+            yield dumps({"event": "partial", "data": partial}) + b"\n"
+        analysis = CreditAnalysis.model_validate(partial)
+        yield dumps({"event": "analysis", "data": analysis}) + b"\n"
+    except Exception as e:
+        yield dumps({"event": "error", "detail": str(e)}) + b"\n"
+
+@app.post("/analyze-slik/stream", openapi_extra=PDF_FORM)
+async def analyze_slik_stream(request: Request, background_tasks: BackgroundTasks, mode: Optional[str] = None):
+    """Process a SLIK PDF file, then stream the analysis as NDJSON while it is generated"""
+    upload = await receive_pdf(request)
+    path, file_hash = upload.path, upload.file_hash
+    try:
+        processed_result = await processor.aprocess_file(str(path), file_hash)
+        remember(background_tasks, processed_result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        path.unlink(missing_ok=True)
+    return StreamingResponse(stream_events(processed_result, mode, include_report=True), media_type="application/x-ndjson")
+
+@app.post("/analyze-json/stream")
+async def analyze_json_stream(request: AnalyzeRequest):
+    """Stream the analysis of already processed SLIK data as NDJSON while it is generated"""
+    return StreamingResponse(stream_events(request.slik_data, request.mode, include_report=False), media_type="application/x-ndjson")
 
 @app.post("/analyze-json")
 async def analyze_json(request: AnalyzeRequest):
     """Analyze already processed SLIK data"""
     try:
-        # Convert JSON data to SLIKReport
-        slik_report = SLIKReport.model_validate(request.slik_data)
-        
-        # Analyze the data
-        analysis_result = analyzer.analyze(slik_report)
+        # slik_data was validated into a SLIKReport straight from the request body
+        analysis_result = await analyzer.aanalyze(request.slik_data, request.mode, request.narrative)
         
-        return JSONResponse(content=analysis_result.model_dump())
+        return ModelJSONResponse(content=analysis_result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze-json/batch")
+async def analyze_json_batch(request: BatchAnalyzeRequest):
+    """Analyze a list of already processed SLIK data; each item succeeds or fails on its own"""
+    reports: List[Any] = []
+    for item in request.items:
+        try:
+            reports.append(SLIKReport.model_validate(item))
+        except Exception as e:
+            reports.append(e)
+
+    valid = [report for report in reports if not isinstance(report, Exception)]
+    try:
+        analyses = iter(await analyzer.aanalyze_many(valid, request.mode, request.narrative, request.max_concurrency))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    results = []
+    for report in reports:
+        outcome = report if isinstance(report, Exception) else next(analyses)
+        if isinstance(outcome, Exception):
+            results.append({"analysis": None, "error": str(outcome)})
+        else:
+            results.append({"analysis": outcome, "error": None})
+    return ModelJSONResponse(content={"results": results})
+
+JOBS_FORM = form_body({
+    "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+    "analyze": {"type": "boolean", "default": False},
+    "callback_url": {"type": "string"},
+}, ["files"])
+
+@app.post("/jobs", openapi_extra=JOBS_FORM)
+async def create_jobs(request: Request):
+    """Queue one or more SLIK PDF files for background processing"""
+    queue_full = HTTPException(status_code=503, detail="Job queue is full, retry later", headers={"Retry-After": "30"})
+    free_slots = job_queue.free_slots()
+    if free_slots == 0:
+        raise queue_full
+    try:
+        fields, uploads = await receive_uploads(request, job_queue.new_pdf_path, max_files=free_slots)
+    except TooManyFilesError:
+        raise queue_full
+    if not uploads:
+        raise HTTPException(status_code=422, detail="At least one PDF file is required in the `files` form field")
+    analyze = fields.get("analyze", "false").lower() in ("1", "true", "yes", "on")
+    callback_url = fields.get("callback_url") or None
+
+    jobs = []
+    for i, upload in enumerate(uploads):
+        try:
+            job_id = await job_queue.submit(upload.path, upload.filename, analyze, callback_url)
+        except QueueFullError as e:
+            for unqueued in uploads[i:]:
+                unqueued.path.unlink(missing_ok=True)
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+        jobs.append({"job_id": job_id, "filename": upload.filename, "status": "queued"})
+    return {"jobs": jobs}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Return the status of a job, and its result once completed"""
+    job = await job_queue.describe(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return ModelJSONResponse(content=job)
+
+@app.post("/portfolio/reports")
+async def add_portfolio_reports(request: PortfolioReportsRequest):
+    """Add already processed SLIK data to the portfolio store; reports already stored are skipped"""
+    try:
+        return await run_in_thread(portfolio.add, request.items)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/portfolio/outstanding")
+async def portfolio_outstanding(
+    group_by: str = "reporter",
+    as_of: Optional[date] = None,
+    reporter: Optional[str] = None,
+    facility_type: Optional[str] = None,
+    debtor_id: Optional[str] = None,
+    limit: Optional[int] = None,
+):
+    """Outstanding and plafond of the latest report of every debtor, grouped by a facility column"""
+    if group_by not in GROUP_COLUMNS:
+        raise HTTPException(status_code=422, detail=f"group_by must be one of {', '.join(GROUP_COLUMNS)}")
+    try:
+        result = await run_in_thread(portfolio.outstanding_by, group_by, as_of, reporter, facility_type, debtor_id, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return ModelJSONResponse(content=result)
+
+@app.get("/portfolio/quality-worsened")
+async def portfolio_quality_worsened(
+    months: int = 3,
+    as_of: Optional[date] = None,
+    reporter: Optional[str] = None,
+    limit: Optional[int] = 100,
+):
+    """Debtors with a facility whose quality grade worsened over the last `months` months"""
+    if months < 1:
+        raise HTTPException(status_code=422, detail="months must be at least 1")
+    try:
+        result = await run_in_thread(portfolio.quality_worsened, months, as_of, reporter, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return ModelJSONResponse(content=result)
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Return hit/miss counters of the processing result cache"""
+    return processor.cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latencies, bytes, pages, LLM tokens and cache lookups"""
+    content, content_type = latest_metrics()
+    return Response(content=content, media_type=content_type)
+
 # If you want to add API documentation
 @app.get("/")
 async def root():
@@ -69,6 +306,17 @@ async def root():
         "endpoints": {
             "/process-slik": "Process SLIK PDF and return structured data",
             "/analyze-slik": "Process SLIK PDF and return both data and analysis",
-            "/analyze-json": "Analyze already processed SLIK data"
+            "/analyze-json": "Analyze already processed SLIK data",
+            "/analyze-json/batch": "Analyze a list of already processed SLIK data",
+            "/analyze-slik/incremental": "Process a monthly SLIK pull, reusing the debtor's previous report and analysis",
+            "/analyze-slik/stream": "Process SLIK PDF and stream the analysis as NDJSON",
+            "/analyze-json/stream": "Stream the analysis of already processed SLIK data as NDJSON",
+            "/jobs": "Queue SLIK PDFs for background processing (optionally with analysis and a callback URL)",
+            "/jobs/{job_id}": "Status and result of a queued job",
+            "/portfolio/reports": "Add already processed SLIK data to the portfolio store",
+            "/portfolio/outstanding": "Portfolio outstanding grouped by reporter, facility type, quality...",
+            "/portfolio/quality-worsened": "Debtors whose quality worsened over the last months",
+            "/cache-stats": "Hit/miss counters of the processing result cache",
+            "/metrics": "Prometheus metrics of the processing stages"
         }
     }
\ No newline at end of file
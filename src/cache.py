@@ -0,0 +1,143 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from .metrics import record_cache
+
+
+def content_hash(data: bytes) -> str:
+    """Return the SHA-256 hex digest of raw file content"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def fingerprint(*parts: str) -> str:
+    """Combine configuration strings (prompt, model, schema...) into a short stable digest"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    """Two-level cache: an in-process LRU in front of a SQLite store on disk.
+
+    Values are strings (usually model JSON). Entries expire after `ttl` seconds
+    and the disk store is trimmed, least recently used first, once it grows
+    beyond `max_disk_bytes`.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "default",
+        path: Optional[str] = None,
+        max_memory_items: Optional[int] = None,
+        max_disk_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.namespace = namespace
+        self.path = path or os.getenv("SLIK_CACHE_PATH", ".cache/slik_cache.sqlite3")
+        self.max_memory_items = max_memory_items or int(os.getenv("SLIK_CACHE_MEMORY_ITEMS", "128"))
+        self.max_disk_bytes = max_disk_bytes or int(os.getenv("SLIK_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.ttl = ttl or float(os.getenv("SLIK_CACHE_TTL", str(30 * 24 * 3600)))
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for `key`, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                record_cache(self.namespace, "memory")
+                return entry[0]
+
+            row = self._conn.execute(
+                "SELECT value, created_at FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                self._memory.pop(key, None)
+                self._counters["misses"] += 1
+                record_cache(self.namespace, "miss")
+                return None
+
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            self._remember(key, row[0], row[1])
+            self._counters["disk_hits"] += 1
+            record_cache(self.namespace, "disk")
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        """Store `value` under `key` in memory and on disk"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters for this cache"""
+        with self._lock:
+            stats = dict(self._counters)
+        stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+        stats["memory_items"] = len(self._memory)
+        return stats
+
+    def _remember(self, key: str, value: str, created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        expired = self._conn.execute(
+            "DELETE FROM entries WHERE created_at < ?", (now - self.ttl,)
+        ).rowcount
+        self._counters["evictions"] += max(expired, 0)
+
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        while total > self.max_disk_bytes:
+            row = self._conn.execute(
+                "SELECT namespace, key, size FROM entries ORDER BY accessed_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (row[0], row[1]))
+            if row[0] == self.namespace:
+                self._memory.pop(row[1], None)
+            self._counters["evictions"] += 1
+            total -= row[2]
@@ -0,0 +1,45 @@
+import os
+import re
+from typing import List, Optional, Tuple
+
+from .models import CreditFacility, SLIKReport, quality_grade
+
+# Each facility block of an iDeb report starts with the reporting institution ("Pelapor")
+FACILITY_BOUNDARY = re.compile(
+    os.getenv("SLIK_FACILITY_BOUNDARY", r"^\s*(?:\d+\.\s*)?Pelapor\b"),
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def split_report(slik_text: str) -> Tuple[str, List[str]]:
+    """Split report text into the header section and one text block per credit facility"""
+    starts = [match.start() for match in FACILITY_BOUNDARY.finditer(slik_text)]
+    if not starts:
+        return slik_text, []
+    header = slik_text[:starts[0]]
+    facilities = [
+        slik_text[start:end]
+        for start, end in zip(starts, starts[1:] + [len(slik_text)])
+    ]
+    return header, facilities
+
+
+def merge_report(header: SLIKReport, facilities: List[CreditFacility]) -> SLIKReport:
+    """Combine a header-only report with separately extracted facilities and recompute the totals"""
+    report = header.model_copy(update={"facilities": facilities})
+
+    plafonds = [f.plafond for f in facilities if f.plafond is not None]
+    if plafonds:
+        report.total_plafond = sum(plafonds)
+    outstandings = [f.outstanding for f in facilities if f.outstanding is not None]
+    if outstandings:
+        report.total_outstanding = sum(outstandings)
+
+    worst: Optional[CreditFacility] = None
+    for facility in facilities:
+        grade = quality_grade(facility.quality)
+        if grade is not None and (worst is None or grade > quality_grade(worst.quality)):
+            worst = facility
+    if worst is not None:
+        report.worst_quality = worst.quality
+    return report
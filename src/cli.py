@@ -0,0 +1,257 @@
+"""Batch processing of SLIK PDF files from the command line.
+
+Example:
+    python -m src.cli reports/ -o results.jsonl --analyze --workers 8
+"""
+import argparse
+import glob
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from .cache import content_hash
+from .concurrency import StageLimits
+
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(ocr_concurrency: int, llm_concurrency: int, analyze: bool) -> None:
+    """Create the processor (and analyzer) used by this worker process"""
+    from .processor import SLIKProcessor
+    from .analyzer import SLIKAnalyzer
+
+    limits = StageLimits(ocr=ocr_concurrency, llm=llm_concurrency)
+    _worker["processor"] = SLIKProcessor(limits=limits)
+    _worker["analyzer"] = SLIKAnalyzer(limits=limits) if analyze else None
+
+
+def _process_one(path: str, file_hash: str) -> Dict[str, Any]:
+    record: Dict[str, Any] = {"file": path, "sha256": file_hash, "status": "ok", "error": None}
+    started = time.perf_counter()
+    try:
+        report = _worker["processor"].process_file(path, file_hash)
+        record["slik_data"] = report.model_dump(mode="json")
+        if _worker["analyzer"] is not None:
+            record["analysis"] = _worker["analyzer"].analyze(report).model_dump(mode="json")
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+    record["elapsed"] = time.perf_counter() - started
+    return record
+
+
+def find_pdfs(inputs: Iterable[str]) -> List[Path]:
+    """Expand directories (recursively) and glob patterns into a sorted list of PDF files"""
+    paths: Set[Path] = set()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            paths.update(p for p in path.rglob("*") if p.suffix.lower() == ".pdf")
+        else:
+            paths.update(Path(p) for p in glob.glob(item, recursive=True) if Path(p).is_file())
+    return sorted(paths)
+
+
+class JsonlWriter:
+    """Append records to a JSON Lines file"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def done_hashes(self) -> Set[str]:
+        if not self.path.exists():
+            return set()
+        hashes = set()
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partially written last line of an interrupted run
+                if record.get("status") == "ok":
+                    hashes.add(record["sha256"])
+        return hashes
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("a", encoding="utf-8")
+        return self
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetWriter:
+    """Write records as a directory of Parquet part files, flushed every `batch_size` records"""
+
+    columns = ["file", "sha256", "status", "error", "elapsed", "slik_data", "analysis"]
+
+    @staticmethod
+    def schema():
+        """Fixed schema of every part, so a batch of errors only does not get null-typed columns"""
+        import pyarrow as pa
+
+        return pa.schema([
+            ("file", pa.string()),
+            ("sha256", pa.string()),
+            ("status", pa.string()),
+            ("error", pa.string()),
+            ("elapsed", pa.float64()),
+            ("slik_data", pa.string()),  # JSON
+            ("analysis", pa.string()),  # JSON
+        ])
+
+    def __init__(self, path: str, batch_size: int = 100):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow, please install it with `pip install pyarrow`")
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self._rows: List[Dict[str, Any]] = []
+
+    def done_hashes(self) -> Set[str]:
+        import pyarrow.parquet as pq
+
+        hashes = set()
+        for part in sorted(self.path.glob("part-*.parquet")):
+            table = pq.read_table(part, columns=["sha256", "status"]).to_pydict()
+            hashes.update(h for h, s in zip(table["sha256"], table["status"]) if s == "ok")
+        return hashes
+
+    def __enter__(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._part = len(list(self.path.glob("part-*.parquet")))
+        return self
+
+    def write(self, record: Dict[str, Any]) -> None:
+        row = dict(record)
+        for column in ("slik_data", "analysis"):
+            row[column] = json.dumps(row[column], ensure_ascii=False) if row.get(column) is not None else None
+        self._rows.append({column: row.get(column) for column in self.columns})
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._rows:
+            return
+        table = pa.Table.from_pylist(self._rows, schema=self.schema())
+        # Written under a temporary name, so an interrupted write never leaves a truncated part
+        part = self.path / f"part-{self._part:05d}.parquet"
+        tmp = part.with_name(f".{part.name}.tmp")
+        pq.write_table(table, tmp)
+        tmp.replace(part)
+        self._part += 1
+        self._rows = []
+
+    def close(self) -> None:
+        """Write the records still buffered"""
+        self._flush()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def run(args: argparse.Namespace) -> int:
+    files = find_pdfs(args.inputs)
+    if args.format == "parquet":
+        writer = ParquetWriter(args.output, batch_size=args.batch_size)
+    else:
+        writer = JsonlWriter(args.output)
+
+    done = writer.done_hashes()
+    pending = []
+    skipped = 0
+    for path in files:
+        file_hash = content_hash(path.read_bytes())
+        if file_hash in done:
+            skipped += 1
+            continue
+        done.add(file_hash)  # also skips duplicate files within this run
+        pending.append((str(path), file_hash))
+
+    print(f"Found {len(files)} PDF files, {skipped} already processed, {len(pending)} to process", file=sys.stderr)
+
+    init_args = (args.ocr_concurrency, args.llm_concurrency, args.analyze)
+    if args.executor == "process":
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=init_args)
+    else:
+        _init_worker(*init_args)
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    with executor, writer:
+        queue = iter(pending)
+        in_flight = set()
+        # Keep a bounded number of files in flight so huge directories are not submitted at once
+        for path, file_hash in queue:
+            in_flight.add(executor.submit(_process_one, path, file_hash))
+            if len(in_flight) >= args.workers * 2:
+                break
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                writer.write(record)
+                latencies.append(record["elapsed"])
+                if record["status"] != "ok":
+                    errors += 1
+                    print(f"Failed {record['file']}: {record['error']}", file=sys.stderr)
+                next_item = next(queue, None)
+                if next_item is not None:
+                    in_flight.add(executor.submit(_process_one, *next_item))
+    wall = time.perf_counter() - started
+
+    print(f"Processed {len(latencies)} files ({errors} failed, {skipped} skipped) in {wall:.1f}s", file=sys.stderr)
+    if latencies:
+        print(
+            f"Throughput: {len(latencies) / wall:.2f} files/s | "
+            f"latency p50 {_percentile(latencies, 0.5):.2f}s, "
+            f"p95 {_percentile(latencies, 0.95):.2f}s, "
+            f"mean {statistics.mean(latencies):.2f}s, "
+            f"max {max(latencies):.2f}s",
+            file=sys.stderr,
+        )
+    return 1 if errors else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Process a directory of SLIK PDF reports")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="Output JSONL file or Parquet directory")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--analyze", action="store_true", help="Also run the credit analysis")
+    parser.add_argument("--workers", type=int, default=8, help="Number of files processed in parallel")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--ocr-concurrency", type=int, default=8,
+                        help="Maximum concurrent LLMSherpa calls (per process with --executor process)")
+    parser.add_argument("--llm-concurrency", type=int, default=8,
+                        help="Maximum concurrent LLM calls (per process with --executor process)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Records per Parquet part file")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
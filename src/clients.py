@@ -0,0 +1,70 @@
+"""Process-wide registry of network clients.
+
+Clients are created on first use and shared by every SLIKProcessor and
+SLIKAnalyzer in the process, so connections (and TLS sessions) to Model Studio
+and the LLMSherpa server are kept alive and reused across requests.
+"""
+import os
+from functools import lru_cache
+from typing import Any
+
+MAX_CONNECTIONS = int(os.getenv("SLIK_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE = int(os.getenv("SLIK_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_TIMEOUT = float(os.getenv("SLIK_HTTP_TIMEOUT", "300"))
+
+
+@lru_cache(maxsize=None)
+def get_http_client() -> Any:
+    """Shared synchronous httpx client with keep-alive connection pooling"""
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE),
+        timeout=HTTP_TIMEOUT,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_async_http_client() -> Any:
+    """Shared asynchronous httpx client; use it from a single event loop"""
+    import httpx
+
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE),
+        timeout=HTTP_TIMEOUT,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_chat_model(model: str = "qwen-turbo", temperature: float = 0.0, max_retries: int = 0) -> Any:
+    """Shared Model Studio chat model, built once per (model, temperature, max_retries).
+
+    The client does not retry by default: callers that retry (the analyzer's rate-limited
+    backoff) must be the only place that does, or attempts and waits multiply.
+    """
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        api_key=os.getenv("MODEL_STUDIO_API_KEY"),
+        model=model,
+        base_url=os.getenv("MODEL_STUDIO_BASE_URL"),
+        temperature=temperature,
+        max_retries=max_retries,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_llmsherpa_reader(api_url: str) -> Any:
+    """Shared LLMSherpa reader for a fully built parse URL, with a pooled urllib3 connection manager"""
+    import urllib3
+    from llmsherpa.readers import LayoutPDFReader
+
+    reader = LayoutPDFReader(api_url)
+    reader.api_connection = urllib3.PoolManager(
+        maxsize=MAX_KEEPALIVE,
+        block=False,
+        timeout=urllib3.Timeout(total=HTTP_TIMEOUT),
+    )
+    return reader
@@ -0,0 +1,143 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Tells this process apart from an earlier one that had the same pid (e.g. after a container restart)
+PROCESS_TOKEN = uuid.uuid4().hex
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the shared bounded thread pool used for blocking work"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("SLIK_WORKER_THREADS", "32")),
+                thread_name_prefix="slik-worker",
+            )
+        return _executor
+
+
+async def run_in_thread(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking callable in the shared thread pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    # Like asyncio.to_thread, carry context variables (request tracing) into the worker
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+def pid_alive(pid: int) -> bool:
+    """Whether a process with this pid exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def owner_alive(pid: Optional[int], token: Optional[str]) -> bool:
+    """Whether the process that recorded (pid, token) is still running.
+
+    A row with our own pid but another token was left by an earlier process that had the same pid.
+    """
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return token == PROCESS_TOKEN
+    return pid_alive(pid)
+
+
+class StageLimits:
+    """Concurrency limits per pipeline stage (e.g. "ocr", "llm").
+
+    The same limits apply to the sync entry points (thread semaphores) and the
+    async entry points (asyncio semaphores, created lazily inside the running loop).
+    """
+
+    def __init__(self, **limits: int):
+        self.limits = limits
+        self._thread_semaphores = {
+            stage: threading.BoundedSemaphore(limit) for stage, limit in limits.items()
+        }
+        self._async_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def thread_limit(self, stage: str) -> threading.BoundedSemaphore:
+        """Semaphore to hold while running `stage` from a regular thread"""
+        return self._thread_semaphores[stage]
+
+    def async_limit(self, stage: str) -> asyncio.Semaphore:
+        """Semaphore to hold while running `stage` from a coroutine"""
+        if stage not in self._async_semaphores:
+            self._async_semaphores[stage] = asyncio.Semaphore(self.limits[stage])
+        return self._async_semaphores[stage]
+
+
+stage_limits = StageLimits(
+    ocr=int(os.getenv("SLIK_OCR_CONCURRENCY", "8")),
+    llm=int(os.getenv("SLIK_LLM_CONCURRENCY", "32")),
+)
+
+
+class RateLimiter:
+    """Token-bucket limiter for provider quotas in requests and tokens per minute.
+
+    A limit of 0 disables that bucket. Callers pass the estimated number of
+    tokens of the request they are about to send.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """Take capacity for one request; return how long to wait before sending it"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            wait = 0.0
+            if self.requests_per_minute:
+                self._requests = min(self._requests + elapsed * self.requests_per_minute / 60, self.requests_per_minute)
+                self._requests -= 1
+                if self._requests < 0:
+                    wait = max(wait, -self._requests * 60 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                tokens = min(tokens, self.tokens_per_minute)
+                self._tokens = min(self._tokens + elapsed * self.tokens_per_minute / 60, self.tokens_per_minute)
+                self._tokens -= tokens
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens * 60 / self.tokens_per_minute)
+            return wait
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block the calling thread until a request of `tokens` tokens may be sent"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """Async version of acquire"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+llm_rate_limiter = RateLimiter(
+    requests_per_minute=float(os.getenv("SLIK_LLM_RPM", "0")),
+    tokens_per_minute=float(os.getenv("SLIK_LLM_TPM", "0")),
+)
@@ -0,0 +1,152 @@
+"""Compact analytic view of a SLIK report for the analyzer prompt.
+
+Instead of the full report dump (every facility and every payment month), the
+analyzer can receive precomputed figures: utilization, DPD statistics, quality
+transitions, facility age and the secured/unsecured mix, with per-facility rows
+kept only as long as they fit in a token budget.
+"""
+import json
+import os
+import re
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+
+from .models import CreditFacility, SLIKReport, quality_grade
+from .rule_parser import MONTHS
+
+TOKEN_BUDGET = int(os.getenv("SLIK_COMPACT_TOKEN_BUDGET", "1500"))
+
+# Facility types that are normally backed by collateral
+_SECURED_TYPES = re.compile(r"rumah|kpr|properti|kendaraan|kkb|(?<!tanpa )agunan|modal kerja|investasi|sewa guna", re.IGNORECASE)
+
+
+def month_key(month: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse "2024-09", "09/2024", "Sep 2024" or "September-24" into (year, month)"""
+    if not month:
+        return None
+    match = re.search(r"(\d{4})[-/](\d{1,2})\b", month)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    match = re.search(r"\b(\d{1,2})[-/](\d{4})", month)
+    if match:
+        return int(match.group(2)), int(match.group(1))
+    match = re.search(r"([A-Za-z]{3})[a-z]*[\s\-/]*(\d{4}|\d{2})\b", month)
+    if match and match.group(1).lower() in MONTHS:
+        year = int(match.group(2))
+        return (year + 2000 if year < 100 else year), MONTHS[match.group(1).lower()]
+    return None
+
+
+def estimate_tokens(payload: Any) -> int:
+    """Rough token count of a JSON payload (about 4 characters per token)"""
+    return len(json.dumps(payload, default=str)) // 4 + 1
+
+
+def _ratio(numerator: Optional[float], denominator: Optional[float]) -> Optional[float]:
+    if numerator is None or not denominator:
+        return None
+    return round(numerator / denominator, 4)
+
+
+def _months_between(start: Optional[date], end: Optional[date]) -> Optional[int]:
+    if start is None or end is None:
+        return None
+    return (end.year - start.year) * 12 + end.month - start.month
+
+
+def is_secured(facility: CreditFacility) -> bool:
+    return bool(facility.facility_type and _SECURED_TYPES.search(facility.facility_type))
+
+
+def facility_features(facility: CreditFacility, report_date: Optional[date]) -> Dict[str, Any]:
+    """Precomputed figures for one facility"""
+    history = sorted(
+        (entry for entry in facility.payment_history if month_key(entry.month) is not None),
+        key=lambda entry: month_key(entry.month),
+    )
+    grades = [quality_grade(entry.quality) for entry in history]
+    dpds = [entry.days_past_due or 0 for entry in history]
+
+    transitions = []
+    for previous, current, entry in zip(grades, grades[1:], history[1:]):
+        if previous is not None and current is not None and previous != current:
+            transitions.append(f"{entry.month}: {previous}->{current}")
+
+    return {
+        "reporter": facility.reporter,
+        "facility_type": facility.facility_type,
+        "secured": is_secured(facility),
+        "plafond": facility.plafond,
+        "outstanding": facility.outstanding,
+        "utilization": _ratio(facility.outstanding, facility.plafond),
+        "quality": quality_grade(facility.quality),
+        "days_past_due": facility.days_past_due,
+        "age_months": _months_between(facility.start_date, report_date or date.today()),
+        "months_to_maturity": _months_between(report_date or date.today(), facility.due_date),
+        "history_months": len(history),
+        "worst_quality_in_history": max((g for g in grades if g is not None), default=None),
+        "months_late": sum(1 for dpd in dpds if dpd > 0),
+        "months_late_last_6": sum(1 for dpd in dpds[-6:] if dpd > 0),
+        "max_days_past_due": max(dpds, default=None),
+        "quality_transitions": transitions,
+    }
+
+
+def _importance(features: Dict[str, Any]) -> Tuple:
+    # Problem facilities first, then the largest exposures
+    return (
+        -(features["worst_quality_in_history"] or features["quality"] or 0),
+        -(features["max_days_past_due"] or 0),
+        -(features["outstanding"] or 0),
+    )
+
+
+def build_compact_view(report: SLIKReport, token_budget: int = TOKEN_BUDGET) -> Dict[str, Any]:
+    """Summarize a report into a compact dict for the analyzer prompt"""
+    facilities = [facility_features(f, report.report_date) for f in report.facilities]
+    total_plafond = report.total_plafond
+    if total_plafond is None:
+        total_plafond = sum(f.plafond or 0 for f in report.facilities) or None
+    total_outstanding = report.total_outstanding
+    if total_outstanding is None:
+        total_outstanding = sum(f.outstanding or 0 for f in report.facilities) or None
+
+    secured_outstanding = sum(f.outstanding or 0 for f in report.facilities if is_secured(f))
+    view: Dict[str, Any] = {
+        "note": "Compact analytic view of a SLIK iDeb report; figures are precomputed from the full report",
+        "report_date": report.report_date,
+        "debtor": {"occupation": report.occupation, "workplace": report.workplace, "birth_date": report.birth_date},
+        "portfolio": {
+            "facility_count": len(facilities),
+            "active_facilities": sum(1 for f in report.facilities if (f.outstanding or 0) > 0),
+            "total_plafond": total_plafond,
+            "total_outstanding": total_outstanding,
+            "utilization": _ratio(total_outstanding, total_plafond),
+            "worst_quality": quality_grade(report.worst_quality),
+            "secured_share_of_outstanding": _ratio(secured_outstanding, total_outstanding),
+            "facilities_with_late_months": sum(1 for f in facilities if f["months_late"]),
+            "max_days_past_due": max((f["max_days_past_due"] or 0 for f in facilities), default=None),
+            "oldest_facility_months": max((f["age_months"] for f in facilities if f["age_months"] is not None), default=None),
+            "newest_facility_months": min((f["age_months"] for f in facilities if f["age_months"] is not None), default=None),
+            "quality_transitions": sum(len(f["quality_transitions"]) for f in facilities),
+        },
+        "facilities": [],
+    }
+
+    # Keep the most important facility rows that fit in the token budget
+    used = estimate_tokens(view)
+    omitted = []
+    for features in sorted(facilities, key=_importance):
+        cost = estimate_tokens(features)
+        if used + cost <= token_budget:
+            view["facilities"].append(features)
+            used += cost
+        else:
+            omitted.append(features)
+    if omitted:
+        view["omitted_facilities"] = {
+            "count": len(omitted),
+            "outstanding": sum(f["outstanding"] or 0 for f in omitted),
+            "worst_quality": max((f["quality"] or 0 for f in omitted), default=None),
+        }
+    return view
@@ -0,0 +1,204 @@
+"""Debtor history: the previous report of each debtor and what changed since.
+
+Monthly iDeb pulls for the same debtor mostly repeat the previous report. The
+store keeps the reports and analyses of each `debtor_id` and the last text
+section of every facility per (`debtor_id`, `agreement_number`), so unchanged
+facility sections can be reused instead of re-extracted, and the analyzer can
+be given a delta instead of the whole report.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from .cache import content_hash
+from .features import month_key
+from .models import CreditFacility, PaymentHistory, SLIKReport, quality_grade
+
+# Change in overall utilization, in percentage points of the plafond (0.05 = 5 points), that counts as material
+UTILIZATION_CHANGE_THRESHOLD = float(os.getenv("SLIK_DELTA_UTILIZATION_THRESHOLD", "0.05"))
+
+
+def section_hash(text: str) -> str:
+    """Hash of a report section, insensitive to whitespace and line wrapping"""
+    return content_hash(" ".join(text.split()).encode("utf-8"))
+
+
+def _month(entry: PaymentHistory) -> Optional[Tuple[int, int]]:
+    """Calendar month of a history entry, whether it reads "2024-08", "08/2024" or "Aug 2024" """
+    return month_key(entry.month)
+
+
+class DebtorHistory:
+    """SQLite store of the reports and analyses of each debtor, plus the latest section of every facility"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("SLIK_HISTORY_DB", ".cache/history.sqlite3")
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reports (
+                debtor_id TEXT NOT NULL,
+                report_number TEXT NOT NULL,
+                report_date TEXT,
+                report TEXT NOT NULL,
+                analysis TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (debtor_id, report_number)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS facilities (
+                debtor_id TEXT NOT NULL,
+                agreement_number TEXT NOT NULL,
+                section_hash TEXT NOT NULL,
+                facility TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (debtor_id, agreement_number)
+            )
+            """
+        )
+
+    def latest(self, debtor_id: str) -> Optional[SLIKReport]:
+        """The most recent stored report of a debtor"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT report FROM reports WHERE debtor_id = ? ORDER BY report_date DESC, updated_at DESC LIMIT 1",
+                (debtor_id,),
+            ).fetchone()
+        return SLIKReport.model_validate_json(row[0]) if row is not None else None
+
+    def analysis(self, debtor_id: str, report_number: Optional[str]) -> Optional[str]:
+        """Stored analysis JSON of one report"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT analysis FROM reports WHERE debtor_id = ? AND report_number = ?",
+                (debtor_id, report_number or ""),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def facility_sections(self, debtor_id: str) -> Dict[str, Tuple[str, CreditFacility]]:
+        """Last section hash and facility per agreement number of a debtor"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT agreement_number, section_hash, facility FROM facilities WHERE debtor_id = ?", (debtor_id,)
+            ).fetchall()
+        return {row[0]: (row[1], CreditFacility.model_validate_json(row[2])) for row in rows}
+
+    def save_report(self, report: SLIKReport, section_hashes: Optional[Dict[str, str]] = None) -> None:
+        """Store a report, with the section hash of each facility by agreement number"""
+        if not report.debtor_id:
+            return
+        now = time.time()
+        section_hashes = section_hashes or {}
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                # Storing the same report again keeps its analysis
+                self._conn.execute(
+                    "INSERT INTO reports VALUES (?, ?, ?, ?, NULL, ?) "
+                    "ON CONFLICT (debtor_id, report_number) DO UPDATE SET "
+                    "report_date = excluded.report_date, report = excluded.report, updated_at = excluded.updated_at",
+                    (report.debtor_id, report.report_number or "",
+                     report.report_date.isoformat() if report.report_date else None,
+                     report.model_dump_json(), now),
+                )
+                for facility in report.facilities:
+                    if facility.agreement_number and facility.agreement_number in section_hashes:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO facilities VALUES (?, ?, ?, ?, ?)",
+                            (report.debtor_id, facility.agreement_number,
+                             section_hashes[facility.agreement_number], facility.model_dump_json(), now),
+                        )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def save_analysis(self, report: SLIKReport, analysis_json: str) -> None:
+        """Attach an analysis to a stored report"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE reports SET analysis = ? WHERE debtor_id = ? AND report_number = ?",
+                (analysis_json, report.debtor_id, report.report_number or ""),
+            )
+
+
+def _utilization(report: SLIKReport) -> Optional[float]:
+    plafond = sum(f.plafond or 0 for f in report.facilities)
+    outstanding = sum(f.outstanding or 0 for f in report.facilities)
+    return round(outstanding / plafond, 4) if plafond else None
+
+
+def _delinquent(entry: PaymentHistory) -> bool:
+    return (entry.days_past_due or 0) > 0 or (quality_grade(entry.quality) or 1) > 1
+
+
+def report_delta(previous: SLIKReport, current: SLIKReport) -> Dict[str, Any]:
+    """What changed between two reports of the same debtor, in a compact form for the analyzer"""
+    before = {f.agreement_number: f for f in previous.facilities if f.agreement_number}
+    after = {f.agreement_number: f for f in current.facilities if f.agreement_number}
+
+    changed = []
+    new_delinquencies = []
+    for agreement, facility in after.items():
+        old = before.get(agreement)
+        if old is None:
+            continue
+        known_months = {_month(entry) for entry in old.payment_history}
+        for entry in facility.payment_history:
+            if _month(entry) not in known_months and _delinquent(entry):
+                new_delinquencies.append({
+                    "agreement_number": agreement,
+                    "reporter": facility.reporter,
+                    "month": entry.month,
+                    "quality": entry.quality,
+                    "days_past_due": entry.days_past_due,
+                })
+        changes = {
+            field: {"previous": getattr(old, field), "current": getattr(facility, field)}
+            for field in ("plafond", "outstanding", "days_past_due")
+            if getattr(old, field) != getattr(facility, field)
+        }
+        # "1 - Lancar" and "1" are the same quality
+        if quality_grade(old.quality) != quality_grade(facility.quality):
+            changes["quality"] = {"previous": old.quality, "current": facility.quality}
+        if changes:
+            changed.append({"agreement_number": agreement, "reporter": facility.reporter, **changes})
+
+    utilization_before, utilization_after = _utilization(previous), _utilization(current)
+    utilization_change = (
+        round(utilization_after - utilization_before, 4)
+        if utilization_before is not None and utilization_after is not None else None
+    )
+    return {
+        "previous_report_date": previous.report_date,
+        "report_date": current.report_date,
+        "new_facilities": [json.loads(after[a].model_dump_json(exclude={"payment_history"})) for a in after.keys() - before.keys()],
+        "closed_facilities": [{"agreement_number": a, "reporter": before[a].reporter} for a in before.keys() - after.keys()],
+        "changed_facilities": changed,
+        "new_delinquencies": new_delinquencies,
+        "utilization": {"previous": utilization_before, "current": utilization_after, "change": utilization_change},
+        "worst_quality": {"previous": previous.worst_quality, "current": current.worst_quality},
+    }
+
+
+def is_material(delta: Dict[str, Any]) -> bool:
+    """Whether a delta can change the credit analysis at all"""
+    change = delta["utilization"]["change"]
+    return bool(
+        delta["new_facilities"]
+        or delta["closed_facilities"]
+        or delta["new_delinquencies"]
+        or quality_grade(delta["worst_quality"]["previous"]) != quality_grade(delta["worst_quality"]["current"])
+        or any("quality" in item or "days_past_due" in item for item in delta["changed_facilities"])
+        or (change is not None and abs(change) >= UTILIZATION_CHANGE_THRESHOLD)
+    )
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .processor import SLIKProcessor
+from .analyzer import SLIKAnalyzer
+from .clients import get_async_http_client
+from .concurrency import PROCESS_TOKEN, owner_alive, run_in_thread
+from .portfolio import PortfolioStore
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept more work"""
+
+
+class JobStore:
+    """SQLite-backed job table, so queued and running jobs survive a restart.
+
+    Several uvicorn workers share the table: a worker claims a queued job atomically
+    and records itself (pid) as its owner with a lease, and a running job is only
+    recovered when its owner process is gone or its lease expired.
+    """
+
+    def __init__(self, path: Optional[str] = None, lease_ttl: Optional[float] = None):
+        self.path = path or os.getenv("SLIK_JOBS_DB", ".jobs/jobs.sqlite3")
+        self.lease_ttl = lease_ttl or float(os.getenv("SLIK_JOB_LEASE_TTL", "3600"))
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                filename TEXT,
+                pdf_path TEXT NOT NULL,
+                analyze INTEGER NOT NULL,
+                callback_url TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner INTEGER,
+                owner_token TEXT,
+                lease_expires REAL
+            )
+            """
+        )
+        # Tables created before jobs had owners
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "INTEGER"), ("owner_token", "TEXT"), ("lease_expires", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def create(self, pdf_path: str, filename: Optional[str], analyze: bool, callback_url: Optional[str]) -> str:
+        """Insert a queued job and return its id"""
+        job_id = Path(pdf_path).stem
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, filename, pdf_path, analyze, callback_url, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, pdf_path, int(analyze), callback_url, now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job as a dict, or None if it does not exist"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        """Update the given columns of a job"""
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Mark a queued job as running, owned by this process; None if another worker got it first"""
+        now = time.time()
+        with self._lock:
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, owner_token = ?, lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (os.getpid(), PROCESS_TOKEN, now + self.lease_ttl, now, job_id),
+            ).rowcount
+        return self.get(job_id) if claimed else None
+
+    def recover(self) -> List[str]:
+        """Requeue running jobs whose owner process is gone or whose lease expired.
+
+        Returns the ids of all queued jobs, oldest first.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = self._conn.execute(
+                    "SELECT id, owner, owner_token, lease_expires FROM jobs WHERE status = 'running'"
+                ).fetchall()
+                for row in running:
+                    if not owner_alive(row["owner"], row["owner_token"]) or (row["lease_expires"] or 0) <= now:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = 'queued', owner = NULL, owner_token = NULL, lease_expires = NULL, "
+                            "updated_at = ? "
+                            "WHERE id = ? AND status = 'running'",
+                            (now, row["id"]),
+                        )
+                rows = self._conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [row["id"] for row in rows]
+
+
+class JobQueue:
+    """Bounded queue of SLIK jobs driven by a pool of async workers"""
+
+    def __init__(
+        self,
+        processor: SLIKProcessor,
+        analyzer: SLIKAnalyzer,
+        store: Optional[JobStore] = None,
+        workers: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        jobs_dir: Optional[str] = None,
+        portfolio: Optional[PortfolioStore] = None,
+    ):
+        self.processor = processor
+        self.analyzer = analyzer
+        self.portfolio = portfolio
+        self.store = store or JobStore()
+        self.workers = workers or int(os.getenv("SLIK_JOB_WORKERS", "16"))
+        self.max_queued = max_queued or int(os.getenv("SLIK_JOB_MAX_QUEUED", "1000"))
+        self.jobs_dir = Path(jobs_dir or os.getenv("SLIK_JOBS_DIR", ".jobs/files"))
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """Start the workers and enqueue queued jobs, and jobs left running by a dead worker.
+
+        Queued jobs may also sit in a sibling worker's queue; whichever claims one first runs it.
+        """
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        for job_id in await run_in_thread(self.store.recover):
+            self._queue.put_nowait(job_id)
+
+    async def stop(self) -> None:
+        """Stop the workers; unfinished jobs stay in the store for the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def free_slots(self) -> int:
+        """Number of jobs that can still be accepted before the queue is full"""
+        return max(self.max_queued - self._queue.qsize(), 0)
+
+    def new_pdf_path(self) -> Path:
+        """Location where the PDF of a new job should be written"""
+        return self.jobs_dir / f"{uuid.uuid4().hex}.pdf"
+
+    async def submit(
+        self,
+        pdf_path: Path,
+        filename: Optional[str] = None,
+        analyze: bool = False,
+        callback_url: Optional[str] = None,
+    ) -> str:
+        """Enqueue a PDF that was already written to `pdf_path` and return the job id"""
+        if self.free_slots() == 0:
+            raise QueueFullError("Job queue is full, retry later")
+        job_id = await run_in_thread(self.store.create, str(pdf_path), filename, analyze, callback_url)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("Job %s crashed", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        job = await run_in_thread(self.store.claim, job_id)
+        if job is None:
+            return
+        try:
+            report = await self.processor.aprocess_file(job["pdf_path"])
+            result = {"slik_data": report}
+            if self.portfolio is not None:
+                try:
+                    await run_in_thread(self.portfolio.add, [report])
+                except Exception as e:
+                    logger.warning("Could not add the report of job %s to the portfolio: %s", job_id, e)
+            if job["analyze"]:
+                analysis = await self.analyzer.aanalyze(report)
+                result["analysis"] = analysis
+            await run_in_thread(self.store.update, job_id, status="completed", result=dumps(result).decode("utf-8"))
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job_id, e)
+            await run_in_thread(self.store.update, job_id, status="failed", error=str(e))
+        Path(job["pdf_path"]).unlink(missing_ok=True)
+
+        if job["callback_url"]:
+            await self._notify(job["callback_url"], await self.describe(job_id))
+
+    async def _notify(self, callback_url: str, payload: Dict[str, Any]) -> None:
+        try:
+            response = await get_async_http_client().post(callback_url, json=payload, timeout=10)
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning("Callback to %s for job %s failed: %s", callback_url, payload["job_id"], e)
+
+    async def describe(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Public view of a job: status plus result or error once finished"""
+        job = await run_in_thread(self.store.get, job_id)
+        if job is None:
+            return None
+        return {
+            "job_id": job["id"],
+            "filename": job["filename"],
+            "status": job["status"],
+            "result": json.loads(job["result"]) if job["result"] else None,
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
@@ -0,0 +1,112 @@
+import contextvars
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from .metrics import record
+
+MIN_PAGE_CHARS = int(os.getenv("SLIK_TEXT_LAYER_MIN_CHARS", "50"))
+# Scanned page ranges sent to the OCR server at the same time
+OCR_WORKERS = int(os.getenv("SLIK_TEXT_LAYER_WORKERS", "4"))
+
+
+def has_pypdf() -> bool:
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def is_usable_text(text: Optional[str], min_chars: int = MIN_PAGE_CHARS) -> bool:
+    """A page has a usable text layer if it has enough characters and is not mostly garbage glyphs"""
+    if not text:
+        return False
+    stripped = "".join(text.split())
+    if len(stripped) < min_chars:
+        return False
+    readable = sum(1 for char in stripped if char.isprintable() and char != "�")
+    return readable / len(stripped) >= 0.9 and "(cid:" not in text
+
+
+def extract_text_layer(reader) -> List[str]:
+    """Extract the embedded text of every page of an open PdfReader.
+
+    Pages are read one after the other: pypdf text extraction is pure Python and
+    holds the GIL, so threads would not make it faster.
+    """
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def scanned_ranges(texts: List[str]) -> List[Tuple[int, int]]:
+    """Group consecutive pages without a usable text layer into (start, end) ranges, end exclusive"""
+    ranges = []
+    start = None
+    for number, text in enumerate(texts):
+        if not is_usable_text(text):
+            if start is None:
+                start = number
+        elif start is not None:
+            ranges.append((start, number))
+            start = None
+    if start is not None:
+        ranges.append((start, len(texts)))
+    return ranges
+
+
+def write_page_range(reader, start: int, end: int) -> str:
+    """Write pages [start, end) of an open PdfReader to a temporary file and return its path"""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for number in range(start, end):
+        writer.add_page(reader.pages[number])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        tmp_file.write(buffer.getvalue())
+        return tmp_file.name
+
+
+def load_with_text_layer(file_path: str, ocr: Callable[[str], str], workers: int = OCR_WORKERS) -> str:
+    """Return the report text, using the embedded text layer where possible.
+
+    `ocr` is called with the path of a PDF and must return its text. It is used for
+    the whole file when no page has a text layer, otherwise only for ranges of
+    scanned pages, which are sent to the OCR server in parallel. The PDF is parsed once.
+    """
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+
+    try:
+        reader = PdfReader(file_path)
+        texts = extract_text_layer(reader)
+    except PyPdfError:
+        # Let the OCR server deal with files pypdf cannot read
+        return ocr(file_path)
+    ranges = scanned_ranges(texts)
+    record(pages=len(texts) - sum(end - start for start, end in ranges))
+    if not ranges:
+        return "\n".join(texts)
+    if ranges == [(0, len(texts))]:
+        return ocr(file_path)
+
+    # The range files are written here, from the one reader; only the OCR calls run in parallel
+    range_paths = [write_page_range(reader, start, end) for start, end in ranges]
+    try:
+        # Each OCR call runs in a copy of the caller's context so it is traced with the request
+        contexts = [contextvars.copy_context() for _ in ranges]
+        with ThreadPoolExecutor(max_workers=max(min(workers, len(ranges)), 1)) as pool:
+            ocr_texts = list(pool.map(lambda context, path: context.run(ocr, path), contexts, range_paths))
+    finally:
+        for path in range_paths:
+            Path(path).unlink(missing_ok=True)
+
+    for (start, end), text in zip(ranges, ocr_texts):
+        texts[start] = text
+        for number in range(start + 1, end):
+            texts[number] = ""
+    return "\n".join(text for text in texts if text)
@@ -0,0 +1,215 @@
+"""Per-stage latency tracing and Prometheus metrics for the processing pipeline.
+
+Stages ("upload", "ocr", "extract", "llm", "analysis") are timed with `stage()`.
+Every stage is recorded in the process-wide Prometheus metrics and, when a
+`Trace` is active for the current request (see `tracing()`), in that trace as
+well. The API turns traces into Server-Timing headers and the Streamlit app
+turns their events into progress updates.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+
+STAGE_SECONDS = Histogram(
+    "slik_stage_seconds",
+    "Wall time of a pipeline stage",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+STAGE_ERRORS = Counter("slik_stage_errors_total", "Pipeline stages that raised an exception", ["stage"])
+BYTES_IN = Counter("slik_bytes_in_total", "Bytes received by a pipeline stage", ["stage"])
+PAGES = Counter("slik_pages_total", "PDF pages loaded, by text source", ["source"])
+LLM_TOKENS = Counter("slik_llm_tokens_total", "LLM tokens used, by stage and kind", ["stage", "kind"])
+CACHE_LOOKUPS = Counter("slik_cache_lookups_total", "Result cache lookups", ["cache", "result"])
+COALESCED = Counter(
+    "slik_coalesced_calls_total", "Calls served by an identical in-flight call", ["flight", "source"]
+)
+
+# Numeric span attributes that also feed a Prometheus counter
+_COUNTED = {
+    "bytes": lambda span, value: BYTES_IN.labels(span).inc(value),
+    "pages": lambda span, value: PAGES.labels("text_layer").inc(value),
+    "ocr_pages": lambda span, value: PAGES.labels("ocr").inc(value),
+    "prompt_tokens": lambda span, value: LLM_TOKENS.labels(span, "prompt").inc(value),
+    "completion_tokens": lambda span, value: LLM_TOKENS.labels(span, "completion").inc(value),
+}
+
+
+class Span:
+    """One timed stage with numeric attributes (bytes, pages, tokens, cache hits...)"""
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error = False
+
+
+class Trace:
+    """Spans of one request, with an optional listener called as listener(event, span).
+
+    `event` is "start" or "end". Spans can be recorded from several threads.
+    Attributes recorded outside any stage (e.g. cache lookups) go to `attrs`.
+    """
+
+    def __init__(self, listener: Optional[Callable[[str, Span], None]] = None):
+        self.listener = listener
+        self.started = time.perf_counter()
+        self.spans: List[Span] = []
+        self.attrs: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _emit(self, event: str, span: Span) -> None:
+        if event == "end":
+            with self._lock:
+                self.spans.append(span)
+        if self.listener is not None:
+            self.listener(event, span)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Total duration (ms), count and summed attributes per stage name, in first-seen order"""
+        stages: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            totals = stages.setdefault(span.name, {"ms": 0.0, "count": 0})
+            totals["ms"] += span.duration * 1000
+            totals["count"] += 1
+            for key, value in span.attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[key] = totals.get(key, 0) + value
+        return stages
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one entry per stage plus the total"""
+        entries = []
+        for name, totals in self.summary().items():
+            details = _describe({key: value for key, value in totals.items() if key not in ("ms", "count")})
+            entry = f"{name};dur={totals['ms']:.1f}"
+            entries.append(f'{entry};desc="{details}"' if details else entry)
+        if self.attrs:
+            entries.append(f'request;desc="{_describe(self.attrs)}"')
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def _describe(attrs: Dict[str, float]) -> str:
+    return " ".join(f"{key}={value:g}" for key, value in attrs.items())
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("slik_trace", default=None)
+_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("slik_span", default=None)
+
+
+@contextmanager
+def tracing(listener: Optional[Callable[[str, Span], None]] = None) -> Iterator[Trace]:
+    """Collect the spans of everything run inside the block (and threads it hands work to)"""
+    trace = Trace(listener)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def stage(name: str, **attrs: Any) -> Iterator[Span]:
+    """Time a pipeline stage; attributes passed here or later via `record` are attached to it"""
+    span = Span(name, {})
+    trace = _trace.get()
+    token = _span.set(span)
+    if trace is not None:
+        trace._emit("start", span)
+    record(**attrs)
+    try:
+        yield span
+    except BaseException:
+        span.error = True
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        _span.reset(token)
+        span.duration = time.perf_counter() - span.started
+        STAGE_SECONDS.labels(name).observe(span.duration)
+        if trace is not None:
+            trace._emit("end", span)
+
+
+def record(**attrs: Any) -> None:
+    """Add numeric attributes to the current stage and the matching Prometheus counters"""
+    span = _span.get()
+    trace = _trace.get()
+    name = span.name if span is not None else "none"
+    for key, value in attrs.items():
+        if value is None:
+            continue
+        if key in _COUNTED:
+            _COUNTED[key](name, value)
+        if span is not None:
+            span.attrs[key] = span.attrs.get(key, 0) + value
+        elif trace is not None:
+            with trace._lock:
+                trace.attrs[key] = trace.attrs.get(key, 0) + value
+
+
+def record_cache(cache: str, result: str) -> None:
+    """Count a cache lookup; `result` is "memory", "disk" or "miss" """
+    CACHE_LOOKUPS.labels(cache, result).inc()
+    record(**{f"{cache}_cache_{'miss' if result == 'miss' else 'hit'}": 1})
+
+
+@lru_cache(maxsize=None)
+def _usage_handler_class() -> type:
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageHandler(BaseCallbackHandler):
+        """Sums the `usage_metadata` of the chat messages returned by each LLM call"""
+
+        def __init__(self):
+            self.input_tokens = 0
+            self.output_tokens = 0
+            self._lock = threading.Lock()
+
+        def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if usage:
+                        with self._lock:
+                            self.input_tokens += usage.get("input_tokens", 0)
+                            self.output_tokens += usage.get("output_tokens", 0)
+
+    return UsageHandler
+
+
+@contextmanager
+def track_llm_usage() -> Iterator[List[Any]]:
+    """Callbacks for a LangChain call; its token usage is recorded on the current stage at exit"""
+    handler = _usage_handler_class()()
+    try:
+        yield [handler]
+    finally:
+        if handler.input_tokens or handler.output_tokens:
+            record(prompt_tokens=handler.input_tokens, completion_tokens=handler.output_tokens)
+
+
+def latest_metrics() -> Tuple[bytes, str]:
+    """Prometheus exposition of all metrics and its content type.
+
+    With PROMETHEUS_MULTIPROC_DIR set (several uvicorn workers), the metrics of all
+    worker processes are aggregated.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -43,3 +43,12 @@ class SLIKReport(BaseModel):
     total_outstanding: Optional[float] = Field(default=None, description="Total outstanding balance")
     worst_quality: Optional[str] = Field(default=None, description="Worst credit quality")
     facilities: List[CreditFacility] = Field(default_factory=list, description="List of credit facilities")
+
+def quality_grade(quality: Optional[str]) -> Optional[int]:
+    """Parse a kolektibilitas value such as "1", "2 - DPK" or "Kol 3" into its grade (1-5)"""
+    if quality is None:
+        return None
+    for char in str(quality):
+        if char in "12345":
+            return int(char)
+    return None
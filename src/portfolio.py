@@ -0,0 +1,486 @@
+"""Columnar portfolio store of extracted SLIK reports.
+
+Every stored `SLIKReport` is flattened into three Parquet tables under
+`SLIK_PORTFOLIO_DIR`: one row per report, per facility and per facility-month of
+payment history. All three are hive-partitioned by report month
+(`report_month=2024-05/part-*.parquet`), and each part file is sorted by
+`debtor_id` (then `reporter`), so filters on `report_date` prune whole
+directories and filters on `debtor_id` or `reporter` skip row groups through the
+Parquet statistics. Parquet has no secondary indexes; partitioning plus sorted
+row groups is what serves as one here. Small part files written per report are
+merged by `compact`, which also runs on its own once a partition collects
+`SLIK_PORTFOLIO_COMPACT_FILES` of them.
+
+Aggregate queries run on the latest report of each debtor (as of a date), with
+pyarrow compute only and no LLM calls.
+
+    python -m src.portfolio ingest results.jsonl
+    python -m src.portfolio compact
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX: writers are only serialized within this process
+    fcntl = None
+
+from .features import month_key
+from .models import SLIKReport, quality_grade
+
+TABLES = ("reports", "facilities", "history")
+COMPACT_FILES = int(os.getenv("SLIK_PORTFOLIO_COMPACT_FILES", "32"))
+ROW_GROUP_ROWS = 64 * 1024
+
+# Columns a facility aggregate can be grouped by
+GROUP_COLUMNS = ("reporter", "facility_type", "usage_type", "quality_grade", "report_month", "debtor_id")
+
+_SORT_KEYS = {
+    "reports": [("debtor_id", "ascending")],
+    "facilities": [("debtor_id", "ascending"), ("reporter", "ascending")],
+    "history": [("debtor_id", "ascending"), ("reporter", "ascending"), ("month", "ascending")],
+}
+
+
+def has_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The portfolio store requires pyarrow, please install it with `pip install pyarrow`")
+    return pyarrow
+
+
+def report_month(value: date) -> str:
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def shift_month(month: str, months: int) -> str:
+    """Add `months` (possibly negative) to a "YYYY-MM" month"""
+    year, number = int(month[:4]), int(month[5:7])
+    index = year * 12 + number - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def flatten(report: SLIKReport, ingested_at: float) -> Dict[str, List[Dict[str, Any]]]:
+    """Rows of the reports, facilities and history tables for one report"""
+    key = {
+        "debtor_id": report.debtor_id,
+        "report_number": report.report_number or "",
+        "report_date": report.report_date,
+        "report_month": report_month(report.report_date),
+    }
+    reports = [{
+        **key,
+        "debtor_name": report.debtor_name,
+        "reference_number": report.reference_number,
+        "total_plafond": report.total_plafond,
+        "total_outstanding": report.total_outstanding,
+        "worst_quality": report.worst_quality,
+        "worst_grade": quality_grade(report.worst_quality),
+        "facilities": len(report.facilities),
+        "ingested_at": ingested_at,
+    }]
+    facilities, history = [], []
+    for facility in report.facilities:
+        facilities.append({
+            **key,
+            "agreement_number": facility.agreement_number,
+            "reporter": facility.reporter,
+            "branch": facility.branch,
+            "facility_type": facility.facility_type,
+            "usage_type": facility.usage_type,
+            "plafond": facility.plafond,
+            "outstanding": facility.outstanding,
+            "start_date": facility.start_date,
+            "due_date": facility.due_date,
+            "interest_rate": facility.interest_rate,
+            "quality": facility.quality,
+            "quality_grade": quality_grade(facility.quality),
+            "days_past_due": facility.days_past_due,
+        })
+        for entry in facility.payment_history:
+            month = month_key(entry.month)
+            if month is None:
+                continue
+            history.append({
+                **key,
+                "agreement_number": facility.agreement_number,
+                "reporter": facility.reporter,
+                "month": f"{month[0]:04d}-{month[1]:02d}",
+                "quality_grade": quality_grade(entry.quality),
+                "days_past_due": entry.days_past_due,
+            })
+    return {"reports": reports, "facilities": facilities, "history": history}
+
+
+class PortfolioStore:
+    """Partitioned Parquet tables of reports, facilities and monthly payment history"""
+
+    def __init__(self, path: Optional[str] = None, compact_files: Optional[int] = None):
+        self.root = Path(path or os.getenv("SLIK_PORTFOLIO_DIR", ".cache/portfolio"))
+        self.compact_files = compact_files or COMPACT_FILES
+        self._lock = threading.Lock()
+
+    @cached_property
+    def schemas(self) -> Dict[str, Any]:
+        pa = _pyarrow()
+        key = [
+            ("debtor_id", pa.string()),
+            ("report_number", pa.string()),
+            ("report_date", pa.date32()),
+        ]
+        return {
+            "reports": pa.schema(key + [
+                ("debtor_name", pa.string()),
+                ("reference_number", pa.string()),
+                ("total_plafond", pa.float64()),
+                ("total_outstanding", pa.float64()),
+                ("worst_quality", pa.string()),
+                ("worst_grade", pa.int8()),
+                ("facilities", pa.int32()),
+                ("ingested_at", pa.float64()),
+            ]),
+            "facilities": pa.schema(key + [
+                ("agreement_number", pa.string()),
+                ("reporter", pa.string()),
+                ("branch", pa.string()),
+                ("facility_type", pa.string()),
+                ("usage_type", pa.string()),
+                ("plafond", pa.float64()),
+                ("outstanding", pa.float64()),
+                ("start_date", pa.date32()),
+                ("due_date", pa.date32()),
+                ("interest_rate", pa.float64()),
+                ("quality", pa.string()),
+                ("quality_grade", pa.int8()),
+                ("days_past_due", pa.int32()),
+            ]),
+            "history": pa.schema(key + [
+                ("agreement_number", pa.string()),
+                ("reporter", pa.string()),
+                ("month", pa.string()),
+                ("quality_grade", pa.int8()),
+                ("days_past_due", pa.int32()),
+            ]),
+        }
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across threads and, through a lock file, across processes on this host"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.root / ".lock", "a") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def _partitions(self, table: str) -> List[Path]:
+        return sorted((self.root / table).glob("report_month=*"))
+
+    def read(self, table: str, filter: Any = None, columns: Optional[List[str]] = None) -> Any:
+        """Scan one table, with partition and row group pruning for `filter`"""
+        pa = _pyarrow()
+        schema = self.schemas[table].append(pa.field("report_month", pa.string()))
+        directory = self.root / table
+        if not directory.exists():
+            return schema.empty_table().select(columns) if columns else schema.empty_table()
+        partitioning = pa.dataset.partitioning(pa.schema([("report_month", pa.string())]), flavor="hive")
+        for attempt in range(3):
+            try:
+                dataset = pa.dataset.dataset(directory, format="parquet", schema=schema, partitioning=partitioning)
+                return dataset.to_table(filter=filter, columns=columns)
+            except FileNotFoundError:
+                # A part file was merged away by a concurrent compaction between listing and reading
+                if attempt == 2:
+                    raise
+                time.sleep(0.05)
+
+    def _existing(self, reports: List[SLIKReport]) -> set:
+        field = _pyarrow().dataset.field
+        months = sorted({report_month(report.report_date) for report in reports})
+        debtors = sorted({report.debtor_id for report in reports})
+        table = self.read(
+            "reports",
+            filter=field("report_month").isin(months) & field("debtor_id").isin(debtors),
+            columns=["debtor_id", "report_number"],
+        )
+        return set(zip(table["debtor_id"].to_pylist(), table["report_number"].to_pylist()))
+
+    def _write_part(self, table: str, month: str, data: Any) -> Path:
+        pq = _pyarrow().parquet
+        directory = self.root / table / f"report_month={month}"
+        directory.mkdir(parents=True, exist_ok=True)
+        # Written under a dot name (ignored by readers) and renamed, so no reader sees a partial file
+        temp = directory / f".part-{uuid.uuid4().hex}.parquet"
+        pq.write_table(data.sort_by(_SORT_KEYS[table]), temp, row_group_size=ROW_GROUP_ROWS)
+        path = temp.with_name(temp.name[1:])
+        temp.rename(path)
+        return path
+
+    def add(self, reports: Iterable[SLIKReport]) -> Dict[str, int]:
+        """Store reports that are not in the portfolio yet; reports without debtor id or date are skipped"""
+        pa = _pyarrow()
+        reports = list(reports)
+        storable = [report for report in reports if report.debtor_id and report.report_date]
+        added = 0
+        with self._write_lock():
+            existing = self._existing(storable) if storable else set()
+            rows: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+            now = time.time()
+            for report in storable:
+                key = (report.debtor_id, report.report_number or "")
+                if key in existing:
+                    continue
+                existing.add(key)
+                added += 1
+                for table, table_rows in flatten(report, now).items():
+                    rows.setdefault((table, report_month(report.report_date)), []).extend(table_rows)
+            for (table, month), table_rows in rows.items():
+                if table_rows:
+                    self._write_part(table, month, pa.Table.from_pylist(
+                        [{k: v for k, v in row.items() if k != "report_month"} for row in table_rows],
+                        schema=self.schemas[table],
+                    ))
+            for table, month in rows:
+                directory = self.root / table / f"report_month={month}"
+                if len(list(directory.glob("part-*.parquet"))) >= self.compact_files:
+                    self._compact_partition(table, directory)
+        return {"added": added, "skipped": len(reports) - added}
+
+    def _compact_partition(self, table: str, directory: Path) -> None:
+        pa = _pyarrow()
+        parts = sorted(directory.glob("part-*.parquet"))
+        if len(parts) < 2:
+            return
+        data = pa.dataset.dataset(parts, format="parquet", schema=self.schemas[table]).to_table()
+        self._write_part(table, directory.name.split("=", 1)[1], data)
+        for part in parts:
+            part.unlink(missing_ok=True)
+
+    def compact(self) -> int:
+        """Merge the part files of every partition into one sorted file; returns the partitions merged"""
+        merged = 0
+        with self._write_lock():
+            for table in TABLES:
+                for directory in self._partitions(table):
+                    if len(list(directory.glob("part-*.parquet"))) > 1:
+                        self._compact_partition(table, directory)
+                        merged += 1
+        return merged
+
+    def latest_reports(self, as_of: Optional[date] = None, debtor_id: Optional[str] = None) -> Any:
+        """Latest report of every debtor on or before `as_of`: debtor_id, report_number, report_date, report_month, debtor_name"""
+        pa = _pyarrow()
+        field = pa.dataset.field
+        filter = None
+        if as_of is not None:
+            filter = (field("report_month") <= report_month(as_of)) & (field("report_date") <= pa.scalar(as_of, pa.date32()))
+        if debtor_id is not None:
+            condition = field("debtor_id") == debtor_id
+            filter = condition if filter is None else filter & condition
+        reports = self.read("reports", filter, ["debtor_id", "report_number", "report_date", "report_month", "debtor_name"])
+        latest = reports.group_by("debtor_id").aggregate([("report_date", "max")]).rename_columns({"report_date_max": "report_date"})
+        candidates = reports.join(latest, keys=["debtor_id", "report_date"], join_type="inner")
+        # Two reports of one debtor on the same day: keep the highest report number
+        chosen = candidates.group_by("debtor_id").aggregate([("report_number", "max")]).rename_columns({"report_number_max": "report_number"})
+        return candidates.join(chosen, keys=["debtor_id", "report_number"], join_type="inner")
+
+    def _snapshot(self, table: str, latest: Any, filter: Any = None, columns: Optional[List[str]] = None) -> Any:
+        """Rows of `table` belonging to the given latest reports"""
+        pa = _pyarrow()
+        months = pa.compute.unique(latest["report_month"]).cast(pa.string())
+        condition = pa.dataset.field("report_month").isin(months)
+        rows = self.read(table, condition if filter is None else condition & filter, columns)
+        keys = latest.select(["debtor_id", "report_number"])
+        return rows.join(keys, keys=["debtor_id", "report_number"], join_type="inner")
+
+    def outstanding_by(
+        self,
+        group_by: str = "reporter",
+        as_of: Optional[date] = None,
+        reporter: Optional[str] = None,
+        facility_type: Optional[str] = None,
+        debtor_id: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Outstanding, plafond, facility and debtor counts of the portfolio grouped by one facility column"""
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_COLUMNS)}")
+        pa = _pyarrow()
+        pc, field = pa.compute, pa.dataset.field
+        filter = None
+        for column, value in (("reporter", reporter), ("facility_type", facility_type)):
+            if value is not None:
+                condition = field(column) == value
+                filter = condition if filter is None else filter & condition
+
+        latest = self.latest_reports(as_of, debtor_id)
+        facilities = self._snapshot(
+            "facilities", latest, filter,
+            ["debtor_id", "report_number", "report_month", "reporter", "facility_type", "usage_type",
+             "quality_grade", "plafond", "outstanding"],
+        )
+        grouped = facilities.group_by(group_by).aggregate([
+            ("outstanding", "sum"),
+            ("plafond", "sum"),
+            ("report_number", "count", pc.CountOptions(mode="all")),
+            ("debtor_id", "count_distinct"),
+        ])
+        grouped = grouped.rename_columns({
+            "outstanding_sum": "outstanding",
+            "plafond_sum": "plafond",
+            "report_number_count": "facilities",
+            "debtor_id_count_distinct": "debtors",
+        }).sort_by([("outstanding", "descending")])
+        if limit is not None:
+            grouped = grouped.slice(0, limit)
+
+        rows = grouped.to_pylist()
+        for row in rows:
+            row["utilization"] = round(row["outstanding"] / row["plafond"], 4) if row["outstanding"] is not None and row["plafond"] else None
+        return {
+            "as_of": as_of,
+            "group_by": group_by,
+            "debtors": pc.count_distinct(facilities["debtor_id"]).as_py(),
+            "facilities": facilities.num_rows,
+            "outstanding": pc.sum(facilities["outstanding"]).as_py(),
+            "groups": rows,
+        }
+
+    def quality_worsened(
+        self,
+        months: int = 3,
+        as_of: Optional[date] = None,
+        reporter: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Debtors with a facility whose quality grade is worse now than `months` months ago.
+
+        The window is the `months` months up to the as-of month (by default the month
+        of the latest report in the portfolio). A facility worsened when its grade in its latest month
+        of the window is higher than its grade in the month just before the window.
+        """
+        pa = _pyarrow()
+        pc, field = pa.compute, pa.dataset.field
+        latest = self.latest_reports(as_of)
+        end = report_month(as_of) if as_of is not None else pc.max(latest["report_month"]).as_py()
+        result: Dict[str, Any] = {"as_of": as_of, "months": months, "window_start": None, "window_end": end, "debtors": []}
+        if end is None:
+            return result
+        start = shift_month(end, -months)
+        result["window_start"] = shift_month(start, 1)
+
+        filter = (field("month") >= start) & (field("month") <= end)
+        if reporter is not None:
+            filter = filter & (field("reporter") == reporter)
+        history = self._snapshot(
+            "history", latest, filter,
+            ["debtor_id", "report_number", "agreement_number", "reporter", "month", "quality_grade", "days_past_due"],
+        )
+
+        facility = ["debtor_id", "report_number", "agreement_number"]
+        before = history.filter(pc.equal(history["month"], start)).select(facility + ["quality_grade"])
+        before = before.rename_columns(facility + ["grade_before"])
+        window = history.filter(pc.greater(history["month"], start))
+        last = window.group_by(facility).aggregate([("month", "max"), ("days_past_due", "max")])
+        last = last.rename_columns({"month_max": "month", "days_past_due_max": "max_days_past_due"})
+        after = window.select(facility + ["month", "quality_grade", "reporter"]).join(last, keys=facility + ["month"], join_type="inner")
+        after = after.rename_columns({"quality_grade": "grade_after"})
+
+        changes = after.join(before, keys=facility, join_type="inner")
+        worsened = changes.filter(pc.greater(changes["grade_after"], changes["grade_before"])).join(
+            latest.select(["debtor_id", "report_number", "report_date", "debtor_name"]),
+            keys=["debtor_id", "report_number"], join_type="inner",
+        )
+        debtors = worsened.group_by(["debtor_id", "report_number", "report_date", "debtor_name"]).aggregate([
+            ("agreement_number", "count", pc.CountOptions(mode="all")),
+            ("grade_before", "max"),
+            ("grade_after", "max"),
+            ("max_days_past_due", "max"),
+            ("reporter", "distinct"),
+        ])
+        debtors = debtors.rename_columns({
+            "agreement_number_count": "facilities_worsened",
+            "grade_before_max": "grade_before",
+            "grade_after_max": "grade_after",
+            "max_days_past_due_max": "max_days_past_due",
+            "reporter_distinct": "reporters",
+        })
+        debtors = debtors.sort_by([("grade_after", "descending"), ("max_days_past_due", "descending"), ("debtor_id", "ascending")])
+        if limit is not None:
+            debtors = debtors.slice(0, limit)
+        result["debtors"] = debtors.to_pylist()
+        return result
+
+
+def _read_reports(path: Path) -> Iterable[SLIKReport]:
+    """Reports from a JSON Lines file (CLI results or one `slik_data` object per line) or a CLI Parquet directory"""
+    if path.is_dir():
+        pq = _pyarrow().parquet
+        for part in sorted(path.glob("part-*.parquet")):
+            for value in pq.read_table(part, columns=["slik_data"])["slik_data"].to_pylist():
+                if value:
+                    yield SLIKReport.model_validate_json(value)
+        return
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            data = record.get("slik_data", record) if isinstance(record, dict) else None
+            if data:
+                yield SLIKReport.model_validate(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the SLIK portfolio store")
+    parser.add_argument("--path", help="Store directory (default: SLIK_PORTFOLIO_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="Add reports from src.cli results (JSON Lines or Parquet)")
+    ingest.add_argument("inputs", nargs="+", type=Path)
+    ingest.add_argument("--batch-size", type=int, default=500)
+    commands.add_parser("compact", help="Merge the part files of every partition")
+    args = parser.parse_args()
+
+    store = PortfolioStore(args.path)
+    if args.command == "compact":
+        print(f"Compacted {store.compact()} partitions")
+        return
+
+    totals = {"added": 0, "skipped": 0}
+    batch: List[SLIKReport] = []
+    for path in args.inputs:
+        for report in _read_reports(path):
+            batch.append(report)
+            if len(batch) >= args.batch_size:
+                for key, value in store.add(batch).items():
+                    totals[key] += value
+                batch = []
+    if batch:
+        for key, value in store.add(batch).items():
+            totals[key] += value
+    store.compact()
+    print(f"Added {totals['added']} reports, skipped {totals['skipped']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,88 @@
 import os
+import json
 from pathlib import Path
+import asyncio
+import contextvars
 import tempfile
-from langchain_community.document_loaders.llmsherpa import LLMSherpaFileLoader
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from .models import SLIKReport
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Any, Dict, List, Optional, Tuple
+from .models import SLIKReport, CreditFacility
+from .chunking import split_report, merge_report
+from .rule_parser import PARSER_VERSION, parse_header, parse_facility, fill_missing
+from .cache import ResultCache, content_hash, fingerprint
+from .concurrency import StageLimits, run_in_thread, stage_limits
+from .loaders import has_pypdf, load_with_text_layer, MIN_PAGE_CHARS
+from .clients import get_chat_model, get_llmsherpa_reader
+from .metrics import record, stage, track_llm_usage
+from .singleflight import SingleFlight
+from .history import DebtorHistory, section_hash
 
 class SLIKProcessor:
-    def __init__(self):
+    def __init__(
+        self,
+        cache: Optional[ResultCache] = None,
+        text_cache: Optional[ResultCache] = None,
+        limits: Optional[StageLimits] = None,
+        chunked: Optional[bool] = None,
+        rule_based: Optional[bool] = None,
+        history: Optional[DebtorHistory] = None,
+        flights: Optional[SingleFlight] = None,
+    ):
         self.llmsherpa_api_url = os.getenv("LLMSHERPA_API_URL")
-        # self.llm = ChatOpenAI(
+        self.model_name = "qwen-turbo"
+
+        # Chunked mode extracts the header and every facility block in parallel calls
+        if chunked is None:
+            chunked = os.getenv("SLIK_CHUNKED_EXTRACTION", "false").lower() in ("1", "true", "yes")
+        self.chunked = chunked
+
+        # Rule-based mode parses the standard iDeb layout directly and only
+        # calls the LLM for sections with missing or invalid required fields
+        if rule_based is None:
+            rule_based = os.getenv("SLIK_RULE_PARSER", "false").lower() in ("1", "true", "yes")
+        self.rule_based = rule_based
+
+        # Loader options are part of the OCR text cache key, so changing them re-runs OCR
+        self.loader_options = {
+            "new_indent_parser": True,
+            "apply_ocr": True,
+            "strategy": "text",
+        }
+        # Digital PDFs are read from their embedded text layer; only scanned pages go to LLMSherpa
+        self.local_text_layer = (
+            os.getenv("SLIK_LOCAL_TEXT_LAYER", "true").lower() in ("1", "true", "yes") and has_pypdf()
+        )
+        self.text_cache = text_cache or ResultCache(namespace="text")
+        self.text_cache_version = fingerprint(
+            json.dumps(self.loader_options, sort_keys=True),
+            f"text-layer-{MIN_PAGE_CHARS}" if self.local_text_layer else "",
+        )
+
+        self.limits = limits or stage_limits
+        self.cache = cache or ResultCache(namespace="report")
+        self.history = history or DebtorHistory()
+        # Identical files processed concurrently (here or in another worker) share one OCR and extraction
+        self.flights = flights or SingleFlight("report")
+
+    # The LLM client, prompts and chains are built on first use so that
+    # creating a processor does not import langchain or open connections
+
+    @cached_property
+    def llm(self):
+        # return ChatOpenAI(
         #     api_key=os.getenv("OPENAI_API_KEY"),
         #     model="gpt-4o-mini",
         #     temperature=0.1,
         # )
+        # Extraction has no retry wrapper of its own, so it keeps the OpenAI client's default retries
+        return get_chat_model(self.model_name, temperature=0.0, max_retries=2)
 
-        self.llm = ChatOpenAI(
-            api_key=os.getenv("MODEL_STUDIO_API_KEY"),
-            model="qwen-turbo",
-            base_url=os.getenv("MODEL_STUDIO_BASE_URL"),
-            temperature=0.0,
-        )
-        
-        self.prompt = ChatPromptTemplate.from_messages([
+    @cached_property
+    def prompt(self):
+        from langchain_core.prompts import ChatPromptTemplate
+
+        return ChatPromptTemplate.from_messages([
             (
                 "system",
                 """You are an expert financial data extraction algorithm specialized in Indonesian SLIK reports.
@@ -37,32 +97,337 @@ class SLIKProcessor:
             ),
             ("human", "{text}")
         ])
-        
-        self.structured_llm = self.llm.with_structured_output(schema=SLIKReport)
-        self.extractor = self.prompt | self.structured_llm
 
-    def process_file(self, file_path: str) -> SLIKReport:
-        """Process a SLIK PDF file and return structured data"""
-        loader = LLMSherpaFileLoader(
-            file_path=file_path,
-            new_indent_parser=True,
-            apply_ocr=True,
-            strategy="text",
-            llmsherpa_api_url=self.llmsherpa_api_url,
+    @cached_property
+    def facility_prompt(self):
+        from langchain_core.prompts import ChatPromptTemplate
+
+        return ChatPromptTemplate.from_messages([
+            (
+                "system",
+                """You are an expert financial data extraction algorithm specialized in Indonesian SLIK reports.
+                The text below is a single credit facility section of a SLIK report.
+                Extract that one facility, including its monthly payment history, into structured data.
+                Follow these guidelines:
+                - Convert all monetary values to numbers (remove 'Rp' and ',' separators)
+                - Convert percentage values to decimal numbers
+                - Format dates as YYYY-MM-DD
+                - If a value is not present in the text, return null
+                Be precise and accurate in extracting financial data."""
+            ),
+            ("human", "{text}")
+        ])
+
+    @cached_property
+    def extractor(self):
+        return self.prompt | self.llm.with_structured_output(schema=SLIKReport)
+
+    @cached_property
+    def facility_extractor(self):
+        return self.facility_prompt | self.llm.with_structured_output(schema=CreditFacility)
+
+    @cached_property
+    def cache_version(self) -> str:
+        # Cached results are only valid for the prompt, model and schema they were produced with
+        return fingerprint(
+            self.prompt.pretty_repr(),
+            self.facility_prompt.pretty_repr() if self.chunked or self.rule_based else "",
+            f"rules-{PARSER_VERSION}" if self.rule_based else "",
+            self.model_name,
+            json.dumps(SLIKReport.model_json_schema(), sort_keys=True),
         )
-        docs = loader.load()
-        slik_text = docs[0].page_content
-        return self.extractor.invoke({"text": slik_text})
+
+    def _run_loader(self, file_path: str) -> str:
+        if self.local_text_layer:
+            return load_with_text_layer(file_path, self._run_llmsherpa)
+        return self._run_llmsherpa(file_path)
+
+    def _run_llmsherpa(self, file_path: str) -> str:
+        from langchain_community.document_loaders.llmsherpa import LLMSherpaFileLoader
+
+        # Same URL handling as LLMSherpaFileLoader, but through a shared pooled reader
+        api_url = LLMSherpaFileLoader._validate_llmsherpa_url(
+            url=self.llmsherpa_api_url,
+            new_indent_parser=self.loader_options["new_indent_parser"],
+            apply_ocr=self.loader_options["apply_ocr"],
+        )
+        document = get_llmsherpa_reader(api_url).read_pdf(file_path)
+        record(ocr_pages=len({block.get("page_idx") for block in document.json}))
+        return document.to_text()
+
+    def load_text(self, file_path: str, file_hash: Optional[str] = None) -> str:
+        """Run the LLMSherpa loader on a PDF file and return the report text"""
+        file_hash = file_hash or content_hash(Path(file_path).read_bytes())
+        cache_key = f"{file_hash}:{self.text_cache_version}"
+        cached = self.text_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        with self.limits.thread_limit("ocr"), stage("ocr", bytes=Path(file_path).stat().st_size):
+            slik_text = self._run_loader(file_path)
+        self.text_cache.set(cache_key, slik_text)
+        return slik_text
+
+    async def aload_text(self, file_path: str, file_hash: Optional[str] = None) -> str:
+        """Async version of load_text; the loader runs in the shared thread pool"""
+        file_hash = file_hash or content_hash(await run_in_thread(Path(file_path).read_bytes))
+        cache_key = f"{file_hash}:{self.text_cache_version}"
+        cached = await run_in_thread(self.text_cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+        async with self.limits.async_limit("ocr"):
+            with stage("ocr", bytes=Path(file_path).stat().st_size):
+                slik_text = await run_in_thread(self._run_loader, file_path)
+        await run_in_thread(self.text_cache.set, cache_key, slik_text)
+        return slik_text
+
+    def _invoke(self, runnable: Any, text: str) -> Any:
+        with self.limits.thread_limit("llm"), stage("llm"), track_llm_usage() as callbacks:
+            return runnable.invoke({"text": text}, config={"callbacks": callbacks})
+
+    async def _ainvoke(self, runnable: Any, text: str) -> Any:
+        async with self.limits.async_limit("llm"):
+            with stage("llm"), track_llm_usage() as callbacks:
+                return await runnable.ainvoke({"text": text}, config={"callbacks": callbacks})
+
+    def _plan(self, slik_text: str) -> Tuple[Optional[SLIKReport], List[Optional[CreditFacility]], List[Tuple]]:
+        """Split the text and decide which sections still need an LLM call.
+
+        Returns the rule-parsed header and facilities (None where nothing was parsed)
+        and a list of (section index, extractor, text, fields) calls; index None is the header
+        and `fields` are the parsed fields the LLM result must replace (missing or invalid).
+        """
+        if not (self.chunked or self.rule_based):
+            return None, [], [(None, self.extractor, slik_text, [])]
+
+        header_text, facility_texts = split_report(slik_text)
+        if not facility_texts:
+            header, missing = parse_header(slik_text) if self.rule_based else (None, [])
+            return header, [], [(None, self.extractor, slik_text, missing)]
+
+        header, facilities, calls = None, [None] * len(facility_texts), []
+        if self.rule_based:
+            header, missing = parse_header(header_text)
+            if missing:
+                calls.append((None, self.extractor, header_text, missing))
+            for index, text in enumerate(facility_texts):
+                facilities[index], missing = parse_facility(text)
+                if missing:
+                    calls.append((index, self.facility_extractor, text, missing))
+        else:
+            calls.append((None, self.extractor, header_text, []))
+            calls.extend((index, self.facility_extractor, text, []) for index, text in enumerate(facility_texts))
+        return header, facilities, calls
+
+    def _complete(self, header, facilities, calls, results) -> SLIKReport:
+        for (index, _, _, fields), result in zip(calls, results):
+            if index is None:
+                header = fill_missing(header, result, fields) if header is not None else result
+            else:
+                facilities[index] = fill_missing(facilities[index], result, fields) if facilities[index] is not None else result
+        if not facilities:
+            # Single-call extraction: the LLM result already contains the facilities
+            return header
+        return merge_report(header, facilities)
+
+    def _run_calls(self, calls: List[Tuple]) -> List[Any]:
+        record(llm_calls=len(calls))
+        if len(calls) <= 1:
+            return [self._invoke(runnable, text) for _, runnable, text, _ in calls]
+        # Each call runs in a copy of the caller's context so it is traced with the request
+        contexts = [contextvars.copy_context() for _ in calls]
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            return list(pool.map(lambda context, call: context.run(self._invoke, call[1], call[2]), contexts, calls))
+
+    async def _arun_calls(self, calls: List[Tuple]) -> List[Any]:
+        record(llm_calls=len(calls))
+        return await asyncio.gather(*(self._ainvoke(runnable, text) for _, runnable, text, _ in calls))
+
+    def extract(self, slik_text: str) -> SLIKReport:
+        """Extract structured data from SLIK report text"""
+        with stage("extract"):
+            header, facilities, calls = self._plan(slik_text)
+            return self._complete(header, facilities, calls, self._run_calls(calls))
+
+    async def aextract(self, slik_text: str) -> SLIKReport:
+        """Async version of extract"""
+        with stage("extract"):
+            header, facilities, calls = self._plan(slik_text)
+            return self._complete(header, facilities, calls, await self._arun_calls(calls))
+
+    def _plan_incremental(self, header_text: str, facility_texts: List[str]) -> Optional[Tuple]:
+        """Like _plan, but reuse the facilities of the debtor's previous report whose section text is unchanged.
+
+        The header and the changed or new sections are extracted as _plan would: by the
+        rule parser with an LLM fallback when `rule_based` is set, by the LLM otherwise.
+        Nothing else is copied from the previous report. Returns None when the debtor
+        has no previous report, otherwise (header, facilities, calls, previous).
+        """
+        # The parsed debtor ID and agreement numbers are only lookup keys: a reused
+        # facility must have a byte-identical (up to whitespace) section
+        parsed_header, missing = parse_header(header_text)
+        previous = self.history.latest(parsed_header.debtor_id) if parsed_header.debtor_id else None
+        if previous is None:
+            return None
+        known = self.history.facility_sections(parsed_header.debtor_id)
+
+        header, calls = None, []
+        if self.rule_based:
+            header = parsed_header
+            if missing:
+                calls.append((None, self.extractor, header_text, missing))
+        else:
+            calls.append((None, self.extractor, header_text, []))
+
+        facilities: List[Optional[CreditFacility]] = [None] * len(facility_texts)
+        reused = 0
+        for index, text in enumerate(facility_texts):
+            parsed, missing = parse_facility(text)
+            prior = known.get(parsed.agreement_number) if parsed.agreement_number else None
+            if prior is not None and prior[0] == section_hash(text):
+                facilities[index] = prior[1]
+                reused += 1
+                continue
+            if self.rule_based:
+                facilities[index] = parsed
+                if missing:
+                    calls.append((index, self.facility_extractor, text, missing))
+            else:
+                calls.append((index, self.facility_extractor, text, []))
+        record(facilities_reused=reused, facilities_updated=len(facility_texts) - reused)
+        return header, facilities, calls, previous
+
+    def _section_hashes(self, report: SLIKReport, facility_texts: List[str]) -> Dict[str, str]:
+        # Sections and extracted facilities line up when their counts match
+        if len(report.facilities) != len(facility_texts):
+            return {}
+        return {
+            facility.agreement_number: section_hash(text)
+            for facility, text in zip(report.facilities, facility_texts)
+            if facility.agreement_number
+        }
+
+    def _matching_previous(self, report: SLIKReport, previous: Optional[SLIKReport]) -> Optional[SLIKReport]:
+        """The previous report, or None when the extracted debtor ID does not match it.
+
+        The extracted report itself is never changed: it holds exactly what the PDF shows, and
+        earlier months only come into play when the two reports are compared.
+        """
+        if previous is not None and report.debtor_id != previous.debtor_id:
+            return None
+        return previous
+
+    def extract_incremental(self, slik_text: str) -> Tuple[SLIKReport, Optional[SLIKReport]]:
+        """Extract a report against the debtor's previous one and store it in the history.
+
+        Returns the report and the previous report it was compared with (None for a new debtor).
+        """
+        header_text, facility_texts = split_report(slik_text)
+        with stage("extract"):
+            plan = self._plan_incremental(header_text, facility_texts) if facility_texts else None
+            if plan is None:
+                plan = (*self._plan(slik_text), None)
+            header, facilities, calls, previous = plan
+            report = self._complete(header, facilities, calls, self._run_calls(calls))
+            previous = self._matching_previous(report, previous)
+        self.history.save_report(report, self._section_hashes(report, facility_texts))
+        return report, previous
+
+    async def aextract_incremental(self, slik_text: str) -> Tuple[SLIKReport, Optional[SLIKReport]]:
+        """Async version of extract_incremental"""
+        header_text, facility_texts = split_report(slik_text)
+        with stage("extract"):
+            # Reads the debtor history (SQLite), so it runs in the thread pool
+            plan = await run_in_thread(self._plan_incremental, header_text, facility_texts) if facility_texts else None
+            if plan is None:
+                plan = (*self._plan(slik_text), None)
+            header, facilities, calls, previous = plan
+            report = self._complete(header, facilities, calls, await self._arun_calls(calls))
+            previous = self._matching_previous(report, previous)
+        await run_in_thread(self.history.save_report, report, self._section_hashes(report, facility_texts))
+        return report, previous
+
+    def process_file(self, file_path: str, file_hash: Optional[str] = None) -> SLIKReport:
+        """Process a SLIK PDF file and return structured data"""
+        file_hash = file_hash or content_hash(Path(file_path).read_bytes())
+        cache_key = f"{file_hash}:{self.cache_version}"
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return SLIKReport.model_validate_json(cached)
+
+        def process() -> SLIKReport:
+            result = self.extract(self.load_text(file_path, file_hash))
+            self.cache.set(cache_key, result.model_dump_json())
+            return result
+
+        return self.flights.run(cache_key, process, SLIKReport.model_dump_json, SLIKReport.model_validate_json)
+
+    async def aprocess_file(self, file_path: str, file_hash: Optional[str] = None) -> SLIKReport:
+        """Async version of process_file"""
+        file_hash = file_hash or content_hash(await run_in_thread(Path(file_path).read_bytes))
+        cache_key = f"{file_hash}:{self.cache_version}"
+        cached = await run_in_thread(self.cache.get, cache_key)
+        if cached is not None:
+            return SLIKReport.model_validate_json(cached)
+
+        async def process() -> SLIKReport:
+            result = await self.aextract(await self.aload_text(file_path, file_hash))
+            await run_in_thread(self.cache.set, cache_key, result.model_dump_json())
+            return result
+
+        return await self.flights.arun(cache_key, process, SLIKReport.model_dump_json, SLIKReport.model_validate_json)
+
+    def process_incremental(self, file_path: str, file_hash: Optional[str] = None) -> Tuple[SLIKReport, Optional[SLIKReport]]:
+        """Process a new pull for a possibly known debtor, re-extracting only what changed since the previous report"""
+        return self.extract_incremental(self.load_text(file_path, file_hash))
+
+    async def aprocess_incremental(self, file_path: str, file_hash: Optional[str] = None) -> Tuple[SLIKReport, Optional[SLIKReport]]:
+        """Async version of process_incremental"""
+        return await self.aextract_incremental(await self.aload_text(file_path, file_hash))
 
     def process_uploaded_file(self, file_content: bytes) -> SLIKReport:
         """Process an uploaded file's content and return structured data"""
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file_content)
-            tmp_path = tmp_file.name
-            
-        try:
-            result = self.process_file(tmp_path)
-        finally:
-            Path(tmp_path).unlink()
-            
-        return result
+        file_hash = content_hash(file_content)
+        cache_key = f"{file_hash}:{self.cache_version}"
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return SLIKReport.model_validate_json(cached)
+
+        def process() -> SLIKReport:
+            tmp_path = _write_temp_pdf(file_content)
+            try:
+                slik_text = self.load_text(tmp_path, file_hash)
+            finally:
+                Path(tmp_path).unlink()
+            result = self.extract(slik_text)
+            self.cache.set(cache_key, result.model_dump_json())
+            return result
+
+        return self.flights.run(cache_key, process, SLIKReport.model_dump_json, SLIKReport.model_validate_json)
+
+    async def aprocess_uploaded_file(self, file_content: bytes) -> SLIKReport:
+        """Async version of process_uploaded_file"""
+        file_hash = content_hash(file_content)
+        cache_key = f"{file_hash}:{self.cache_version}"
+        cached = await run_in_thread(self.cache.get, cache_key)
+        if cached is not None:
+            return SLIKReport.model_validate_json(cached)
+
+        async def process() -> SLIKReport:
+            tmp_path = await run_in_thread(_write_temp_pdf, file_content)
+            try:
+                slik_text = await self.aload_text(tmp_path, file_hash)
+            finally:
+                Path(tmp_path).unlink()
+            result = await self.aextract(slik_text)
+            await run_in_thread(self.cache.set, cache_key, result.model_dump_json())
+            return result
+
+        return await self.flights.arun(cache_key, process, SLIKReport.model_dump_json, SLIKReport.model_validate_json)
+
+
+def _write_temp_pdf(file_content: bytes) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        tmp_file.write(file_content)
+        return tmp_file.name
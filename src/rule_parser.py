@@ -0,0 +1,202 @@
+import re
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from .models import CreditFacility, PaymentHistory, SLIKReport, quality_grade
+
+# Bump when the parsing rules change, so cached results produced by older rules are invalidated
+PARSER_VERSION = "2"
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "mei": 5, "may": 5, "jun": 6, "jul": 7,
+    "agu": 8, "agt": 8, "aug": 8, "sep": 9, "okt": 10, "oct": 10, "nov": 11, "des": 12, "dec": 12,
+}
+
+# A label must be followed by ":" / "|" or a wide gap, so "Plafon" does not match "Plafon Awal"
+_SEPARATOR = r"(?:[ \t]*[:|][ \t]*|[ \t]{2,})"
+
+HEADER_LABELS = {
+    "report_number": r"Nomor Laporan",
+    "report_date": r"Tanggal Laporan",
+    "reference_number": r"Nomor Referensi(?: Pengguna)?",
+    "operator": r"Operator",
+    "debtor_name": r"Nama(?: Sesuai Identitas| Debitur)?",
+    "debtor_id": r"(?:NIK|Nomor Identitas|No\.? Identitas)",
+    "gender": r"Jenis Kelamin",
+    "birth_place": r"Tempat Lahir",
+    "birth_date": r"Tanggal Lahir",
+    "address": r"Alamat",
+    "occupation": r"Pekerjaan",
+    "workplace": r"Tempat Bekerja",
+    "total_plafond": r"Total Plafon(?: Efektif)?",
+    "total_outstanding": r"Total Baki Debet",
+    "worst_quality": r"Kualitas Terburuk",
+}
+
+FACILITY_LABELS = {
+    "reporter": r"(?:\d+\.\s*)?Pelapor",
+    "branch": r"Cabang",
+    "agreement_number": r"(?:No(?:mor)?\.? Rekening|No(?:mor)?\.? Akad(?: Awal)?)",
+    "facility_type": r"Jenis Kredit(?:/Pembiayaan)?",
+    "plafond": r"Plafon",
+    "outstanding": r"Baki Debet",
+    "start_date": r"Tanggal (?:Mulai|Akad Awal)",
+    "due_date": r"Tanggal Jatuh Tempo",
+    "interest_rate": r"Suku Bunga(?:/Imbalan)?",
+    "interest_type": r"Jenis Suku Bunga(?:/Imbalan)?",
+    "usage_type": r"Jenis Penggunaan",
+    "quality": r"Kualitas",
+    "days_past_due": r"Jumlah Hari Tunggakan",
+}
+
+# Fields that must be filled and valid for a section to skip the LLM
+REQUIRED_HEADER_FIELDS = ["report_number", "report_date", "debtor_name", "debtor_id"]
+REQUIRED_FACILITY_FIELDS = ["reporter", "plafond", "outstanding", "quality"]
+
+# A history entry starts a line or a grid column (after "|", a tab or a wide gap), so
+# dates such as "17 Oktober 2024" in label rows are not read as history months
+_HISTORY_ENTRY = re.compile(
+    r"(?:^|(?<=\|)|(?<=\t)|(?<=  ))[ \t]*(?P<month>[A-Za-z]{3})[a-z]*[ \t]*[-/ ]?[ \t]*(?P<year>\d{4}|\d{2})[ \t]*[:|]?[ \t]*"
+    r"(?P<quality>[1-5])\b(?:[ \t]*[/|]?[ \t]*(?P<dpd>\d{1,4})\b)?",
+    re.MULTILINE,
+)
+
+
+def parse_amount(value: str) -> Optional[float]:
+    """Parse "Rp 1.250.000,50" (or "1,250,000.50") into a float"""
+    cleaned = re.sub(r"(?i)rp\.?|\s", "", value)
+    match = re.match(r"-?[\d.,]+", cleaned)
+    if not match:
+        return None
+    number = match.group(0)
+    if "," in number and "." in number:
+        decimal = "," if number.rfind(",") > number.rfind(".") else "."
+    elif number.count(",") == 1 and len(number.split(",")[1]) != 3:
+        decimal = ","
+    elif number.count(".") == 1 and len(number.split(".")[1]) != 3:
+        decimal = "."
+    else:
+        decimal = None
+    thousands = {",": ".", ".": ","}.get(decimal, ".,")
+    for sep in thousands:
+        number = number.replace(sep, "")
+    if decimal == ",":
+        number = number.replace(",", ".")
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def parse_percentage(value: str) -> Optional[float]:
+    """Parse "12,50 %" into 12.5"""
+    return parse_amount(value.replace("%", ""))
+
+
+def parse_date(value: str) -> Optional[date]:
+    """Parse dd/mm/yyyy, dd-mm-yyyy, yyyy-mm-dd and "17 Oktober 2024" style dates"""
+    value = value.strip()
+    try:
+        match = re.match(r"(\d{4})-(\d{1,2})-(\d{1,2})", value)
+        if match:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        match = re.match(r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})", value)
+        if match:
+            return date(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+        match = re.match(r"(\d{1,2})\s+([A-Za-z]{3})[a-z]*\s+(\d{4})", value)
+        if match and match.group(2).lower() in MONTHS:
+            return date(int(match.group(3)), MONTHS[match.group(2).lower()], int(match.group(1)))
+    except ValueError:
+        return None
+    return None
+
+
+def parse_int(value: str) -> Optional[int]:
+    match = re.match(r"\s*(\d+)", value)
+    return int(match.group(1)) if match else None
+
+
+def parse_quality(value: str) -> Optional[str]:
+    grade = quality_grade(value)
+    return str(grade) if grade is not None else None
+
+
+def parse_text(value: str) -> Optional[str]:
+    value = value.strip(" :|-\t")
+    return value or None
+
+
+FIELD_PARSERS: Dict[str, Callable[[str], Any]] = {
+    "report_date": parse_date,
+    "birth_date": parse_date,
+    "start_date": parse_date,
+    "due_date": parse_date,
+    "total_plafond": parse_amount,
+    "total_outstanding": parse_amount,
+    "plafond": parse_amount,
+    "outstanding": parse_amount,
+    "interest_rate": parse_percentage,
+    "days_past_due": parse_int,
+    "worst_quality": parse_quality,
+    "quality": parse_quality,
+}
+
+
+def _parse_labels(text: str, labels: Dict[str, str]) -> Dict[str, Any]:
+    values = {}
+    for field, label in labels.items():
+        match = re.search(rf"^[ \t]*{label}{_SEPARATOR}(?P<value>[^\n|]+)", text, re.IGNORECASE | re.MULTILINE)
+        if not match:
+            continue
+        value = FIELD_PARSERS.get(field, parse_text)(match.group("value"))
+        if value is not None:
+            values[field] = value
+    return values
+
+
+def parse_payment_history(text: str) -> List[PaymentHistory]:
+    """Parse the monthly kolektibilitas grid ("Jan 2024 1 0", "Feb-24 | 2 | 15", ...)"""
+    history = []
+    for match in _HISTORY_ENTRY.finditer(text):
+        month = MONTHS.get(match.group("month").lower())
+        if month is None:
+            continue
+        year = int(match.group("year"))
+        year = year + 2000 if year < 100 else year
+        history.append(PaymentHistory(
+            month=f"{year:04d}-{month:02d}",
+            quality=match.group("quality"),
+            days_past_due=int(match.group("dpd")) if match.group("dpd") else None,
+        ))
+    return history
+
+
+def parse_header(text: str) -> Tuple[SLIKReport, List[str]]:
+    """Parse the report header; returns the report and the required fields that are still missing"""
+    report = SLIKReport(**_parse_labels(text, HEADER_LABELS))
+    missing = [field for field in REQUIRED_HEADER_FIELDS if getattr(report, field) is None]
+    return report, missing
+
+
+def parse_facility(text: str) -> Tuple[CreditFacility, List[str]]:
+    """Parse one facility section; returns the facility and the required fields that are still missing"""
+    values = _parse_labels(text, FACILITY_LABELS)
+    facility = CreditFacility(payment_history=parse_payment_history(text), **values)
+    missing = [field for field in REQUIRED_FACILITY_FIELDS if getattr(facility, field) is None]
+    if facility.plafond is not None and facility.plafond < 0:
+        missing.append("plafond")
+    if facility.outstanding is not None and facility.outstanding < 0:
+        missing.append("outstanding")
+    return facility, missing
+
+
+def fill_missing(parsed: BaseModel, extracted: BaseModel, invalid: Sequence[str] = ()) -> BaseModel:
+    """Keep the rule-parsed values and take every field the parser left empty, or that is
+    listed in `invalid`, from the LLM result"""
+    updates = {}
+    for field in type(parsed).model_fields:
+        if field in invalid or getattr(parsed, field) in (None, []):
+            updates[field] = getattr(extracted, field)
+    return parsed.model_copy(update=updates)
@@ -0,0 +1,277 @@
+"""Deterministic, vectorized credit metrics for one or many SLIK reports.
+
+Reports are converted into columnar arrays (one row per facility, one column per
+calendar month of the window ending at the report month) and every metric is computed for the whole
+batch at once. The metrics feed a rule-based preliminary score that does not need
+an LLM call.
+"""
+import warnings
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .features import month_key
+from .models import SLIKReport, quality_grade
+
+HISTORY_MONTHS = 24
+
+# Score penalties, on the 300-850 scale used by CreditAnalysis
+QUALITY_PENALTY = np.array([0, 0, 80, 200, 300, 400], dtype=float)  # indexed by grade, 0 = unknown
+DPD_BUCKETS = [0, 30, 60, 90]
+DPD_PENALTY = np.array([0, 25, 60, 100, 150], dtype=float)  # 0, 1-30, 31-60, 61-90, 90+
+LATE_MONTH_PENALTY = 15.0
+LATE_MONTH_PENALTY_CAP = 150.0
+TREND_PENALTY_PER_GRADE_YEAR = 60.0
+THIN_FILE_MONTHS = 6
+THIN_FILE_PENALTY = 50.0
+# Without a single history month payment behaviour is unknown, not clean: at best Medium risk
+NO_HISTORY_MAX_SCORE = 650
+
+
+@lru_cache(maxsize=4096)
+def _cached_month_key(month: str):
+    return month_key(month)
+
+
+@lru_cache(maxsize=256)
+def _cached_grade(quality: str) -> float:
+    grade = quality_grade(quality)
+    return float(grade) if grade is not None else np.nan
+
+
+def _grade(quality: Optional[str]) -> float:
+    return _cached_grade(quality) if quality is not None else np.nan
+
+
+class ReportArrays:
+    """Columnar view of a batch of reports.
+
+    `quality` and `dpd` are (facilities x months) float matrices, NaN where unknown.
+    Columns are calendar months counted back from the report month (the last
+    column), so a facility that stopped reporting years ago has no recent cells.
+    Reports without a report date are anchored at their latest history month.
+    `report_index` maps each facility row to its report.
+    """
+
+    def __init__(self, report_index, plafond, outstanding, current_quality, quality, dpd, n_reports):
+        self.report_index = report_index
+        self.plafond = plafond
+        self.outstanding = outstanding
+        self.current_quality = current_quality
+        self.quality = quality
+        self.dpd = dpd
+        self.n_reports = n_reports
+
+    @classmethod
+    def from_reports(cls, reports: Sequence[SLIKReport], months: int = HISTORY_MONTHS) -> "ReportArrays":
+        n_facilities = sum(len(report.facilities) for report in reports)
+        report_index = np.empty(n_facilities, dtype=np.int64)
+        plafond = np.full(n_facilities, np.nan)
+        outstanding = np.full(n_facilities, np.nan)
+        current_quality = np.full(n_facilities, np.nan)
+        quality = np.full((n_facilities, months), np.nan)
+        dpd = np.full((n_facilities, months), np.nan)
+
+        row = 0
+        for position, report in enumerate(reports):
+            histories = [
+                [
+                    (key[0] * 12 + key[1] - 1, entry) for entry in facility.payment_history
+                    if entry.month and (key := _cached_month_key(entry.month)) is not None
+                ]
+                for facility in report.facilities
+            ]
+            if report.report_date is not None:
+                last = report.report_date.year * 12 + report.report_date.month - 1
+            else:
+                last = max((index for history in histories for index, _ in history), default=0)
+
+            for facility, history in zip(report.facilities, histories):
+                report_index[row] = position
+                if facility.plafond is not None:
+                    plafond[row] = facility.plafond
+                if facility.outstanding is not None:
+                    outstanding[row] = facility.outstanding
+                current_quality[row] = _grade(facility.quality)
+
+                for index, entry in history:
+                    column = months - 1 - (last - index)
+                    if not 0 <= column < months:
+                        continue
+                    quality[row, column] = _grade(entry.quality)
+                    if entry.days_past_due is not None:
+                        dpd[row, column] = entry.days_past_due
+                row += 1
+
+        return cls(report_index, plafond, outstanding, current_quality, quality, dpd, len(reports))
+
+
+def _per_report(values: np.ndarray, report_index: np.ndarray, n_reports: int, how: str) -> np.ndarray:
+    """Aggregate a per-facility vector or matrix to one row per report"""
+    grouped = getattr(pd.DataFrame(values).groupby(report_index), how)()
+    result = grouped.reindex(range(n_reports)).to_numpy(dtype=float)
+    return result[:, 0] if values.ndim == 1 else result
+
+
+def _row_slopes(matrix: np.ndarray) -> np.ndarray:
+    """Least-squares slope per row (units per month), ignoring NaN cells"""
+    x = np.broadcast_to(np.arange(matrix.shape[1], dtype=float), matrix.shape)
+    mask = ~np.isnan(matrix)
+    count = mask.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(mask, x, 0).sum(axis=1) / count
+        y_mean = np.where(mask, matrix, 0).sum(axis=1) / count
+        dx = np.where(mask, x - x_mean[:, None], 0)
+        dy = np.where(mask, matrix - y_mean[:, None], 0)
+        slope = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+    slope[count < 2] = np.nan
+    return slope
+
+
+def compute_metrics(arrays: ReportArrays) -> pd.DataFrame:
+    """Per-report credit metrics for a batch of reports"""
+    n = arrays.n_reports
+    index = arrays.report_index
+
+    total_plafond = np.bincount(index, weights=np.nan_to_num(arrays.plafond), minlength=n)
+    total_outstanding = np.bincount(index, weights=np.nan_to_num(arrays.outstanding), minlength=n)
+    facility_count = np.bincount(index, minlength=n)
+
+    # Worst grade per report per month, then summary statistics over the window
+    monthly_quality = _per_report(arrays.quality, index, n, "max")
+    monthly_dpd = _per_report(arrays.dpd, index, n, "max")
+    with warnings.catch_warnings():
+        # All-NaN rows (reports without history) are expected and stay NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        worst_history = np.nanmax(monthly_quality, axis=1)
+        average_quality = np.nanmean(_per_report(arrays.quality, index, n, "mean"), axis=1)
+        max_dpd = np.nanmax(monthly_dpd, axis=1)
+    worst_current = _per_report(arrays.current_quality, index, n, "max")
+    worst_quality = np.fmax(worst_history, worst_current)
+
+    late = np.nan_to_num(monthly_dpd) > 0
+    bucket = np.digitize(np.nan_to_num(max_dpd), DPD_BUCKETS, right=True)
+    all_dpd = np.nan_to_num(arrays.dpd)
+    bucket_counts = {
+        f"facility_months_{label}": np.bincount(index, weights=((all_dpd > low) & (all_dpd <= high)).sum(axis=1), minlength=n)
+        for label, low, high in [("dpd_1_30", 0, 30), ("dpd_31_60", 30, 60), ("dpd_61_90", 60, 90), ("dpd_90_plus", 90, np.inf)]
+    }
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        utilization = np.where(total_plafond > 0, total_outstanding / total_plafond, np.nan)
+
+    metrics = pd.DataFrame({
+        "facility_count": facility_count,
+        "total_plafond": total_plafond,
+        "total_outstanding": total_outstanding,
+        "utilization": utilization,
+        "worst_quality": worst_quality,
+        "average_quality": average_quality,
+        "max_days_past_due": max_dpd,
+        "dpd_bucket": bucket,
+        "late_months_3": late[:, -3:].sum(axis=1),
+        "late_months_6": late[:, -6:].sum(axis=1),
+        "late_months_12": late[:, -12:].sum(axis=1),
+        "quality_trend_per_year": _row_slopes(monthly_quality) * 12,
+        "dpd_trend_per_year": _row_slopes(monthly_dpd) * 12,
+        "history_months": (~np.isnan(monthly_quality)).sum(axis=1),
+        **bucket_counts,
+    })
+    return metrics
+
+
+def preliminary_score(metrics: pd.DataFrame) -> pd.DataFrame:
+    """Rule-based score (300-850) and risk level from `compute_metrics` output"""
+    grade = metrics["worst_quality"].fillna(0).clip(0, 5).astype(int).to_numpy()
+    penalty = QUALITY_PENALTY[grade]
+    penalty = penalty + DPD_PENALTY[metrics["dpd_bucket"].to_numpy()]
+    penalty = penalty + np.minimum(metrics["late_months_6"].to_numpy() * LATE_MONTH_PENALTY, LATE_MONTH_PENALTY_CAP)
+
+    utilization = metrics["utilization"].fillna(0).to_numpy()
+    penalty = penalty + np.select([utilization > 0.9, utilization > 0.7, utilization > 0.5], [80, 50, 20], 0)
+
+    # Only a worsening (rising) quality trend is penalised
+    trend = metrics["quality_trend_per_year"].fillna(0).clip(lower=0).to_numpy()
+    penalty = penalty + np.minimum(trend * TREND_PENALTY_PER_GRADE_YEAR, 120)
+
+    # Thin files get a small penalty for the lack of history
+    penalty = penalty + np.where(metrics["history_months"].to_numpy() < THIN_FILE_MONTHS, THIN_FILE_PENALTY, 0)
+
+    score = np.clip(np.round(850 - penalty), 300, 850).astype(int)
+    score = np.where(metrics["history_months"].to_numpy() == 0, np.minimum(score, NO_HISTORY_MAX_SCORE), score)
+    risk = np.select([score >= 700, score >= 580], ["Low", "Medium"], "High")
+    return metrics.assign(preliminary_score=score, risk_level=risk)
+
+
+def score_reports(reports: Sequence[SLIKReport], months: int = HISTORY_MONTHS) -> pd.DataFrame:
+    """Metrics plus preliminary score for each report, in input order"""
+    return preliminary_score(compute_metrics(ReportArrays.from_reports(reports, months)))
+
+
+def preliminary_analysis(row: pd.Series) -> Dict[str, Any]:
+    """CreditAnalysis fields for one row of `score_reports` output, without any LLM call"""
+    strengths, concerns, recommendations = [], [], []
+    worst = row["worst_quality"]
+    if worst == 1 and row["history_months"] > 0:
+        strengths.append({"factor": "Credit Quality", "detail": "All facilities Lancar (quality 1) over the history window"})
+    elif not np.isnan(worst):
+        concerns.append({"factor": "Credit Quality", "detail": f"Worst kolektibilitas {int(worst)} in the history window"})
+
+    if row["late_months_6"] == 0 and row["history_months"] >= THIN_FILE_MONTHS:
+        strengths.append({"factor": "Payment History", "detail": "No days past due in the last 6 months"})
+    elif row["late_months_6"] > 0:
+        concerns.append({
+            "factor": "Payment History",
+            "detail": f"{int(row['late_months_6'])} late months in the last 6 months, max {row['max_days_past_due']:.0f} days past due",
+        })
+        recommendations.append({"action": "Clear Arrears", "suggestion": "Settle overdue installments and keep all facilities current"})
+
+    utilization = row["utilization"]
+    if not np.isnan(utilization):
+        detail = f"Overall utilization {utilization:.0%}"
+        if utilization > 0.7:
+            concerns.append({"factor": "Credit Utilization", "detail": detail})
+            recommendations.append({"action": "Reduce Utilization", "suggestion": "Bring outstanding balances below 70% of plafond"})
+        else:
+            strengths.append({"factor": "Credit Utilization", "detail": detail})
+
+    trend = row["quality_trend_per_year"]
+    if trend > 0:
+        concerns.append({"factor": "Quality Trend", "detail": f"Quality worsening by {trend:.2f} grades per year"})
+    if row["history_months"] == 0:
+        concerns.append({"factor": "Credit History", "detail": "No payment history in the report window"})
+    elif row["history_months"] < THIN_FILE_MONTHS:
+        concerns.append({"factor": "Credit History", "detail": f"Only {int(row['history_months'])} months of payment history"})
+    if not recommendations:
+        recommendations.append({"action": "Maintain Behaviour", "suggestion": "Keep payments on time and utilization at current levels"})
+
+    def fmt(value: float, spec: str) -> str:
+        return "n/a" if np.isnan(value) else format(value, spec)
+
+    score = int(row["preliminary_score"])
+    return {
+        "credit_score": score,
+        "risk_level": row["risk_level"],
+        "key_strengths": strengths,
+        "key_concerns": concerns,
+        "payment_behavior": {
+            "late_months_last_3": str(int(row["late_months_3"])),
+            "late_months_last_6": str(int(row["late_months_6"])),
+            "late_months_last_12": str(int(row["late_months_12"])),
+            "max_days_past_due": fmt(row["max_days_past_due"], ".0f"),
+            "average_quality": fmt(row["average_quality"], ".2f"),
+            "quality_trend_per_year": fmt(trend, "+.2f"),
+        },
+        "credit_utilization": {
+            "current_utilization": fmt(utilization, ".0%"),
+            "total_plafond": f"Rp {row['total_plafond']:,.0f}",
+            "total_outstanding": f"Rp {row['total_outstanding']:,.0f}",
+        },
+        "recommendations": recommendations,
+        "summary": (
+            f"Preliminary rule-based score {score} ({row['risk_level']} risk) from {int(row['facility_count'])} facilities "
+            f"and {int(row['history_months'])} months of history. No LLM narrative was generated."
+        ),
+    }
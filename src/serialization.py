@@ -0,0 +1,29 @@
+"""Lean JSON serialization of reports and analyses.
+
+Responses are rendered by pydantic-core straight to bytes, instead of
+`model_dump()` to a dict that `json.dumps` then walks again (and that fails on
+dates). Models, dates and any nesting of dicts and lists of them are accepted.
+"""
+from functools import lru_cache
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def adapter(tp: Any) -> TypeAdapter:
+    """TypeAdapter of a type, built (and its validator and serializer compiled) only once"""
+    return TypeAdapter(tp)
+
+
+def dumps(content: Any) -> bytes:
+    """Compact JSON bytes of models, dates and nested dicts and lists of them"""
+    return adapter(Any).dump_json(content)
+
+
+class ModelJSONResponse(JSONResponse):
+    """JSON response rendered with `dumps`, without an intermediate dict or `json.dumps` pass"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,207 @@
+"""Single-flight coalescing of identical work, within a process and across workers on one host.
+
+Concurrent calls with the same key (the content hash of a PDF, of an analyzer
+input) share one execution. Within a process, followers wait on the leader's
+future. Across uvicorn workers, a lease row in a shared SQLite file elects one
+leader per key; the other workers poll until the leader stores its result and
+releases the lease. Results are kept for `result_ttl` seconds, so duplicates
+arriving just after the leader finished are served too. A lease whose owner
+process died, or that outlived `lease_ttl`, is taken over. Leases carry a
+per-process token besides the pid, so a lease left by an earlier process with
+our pid (a restarted container's PID 1) is not mistaken for our own.
+
+In-process followers receive the leader's object itself: treat it as read-only.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .concurrency import PROCESS_TOKEN, owner_alive, run_in_thread
+from .metrics import COALESCED, record
+
+
+class SingleFlight:
+    """Run at most one call per key at a time on this host and share its result with concurrent callers"""
+
+    def __init__(
+        self,
+        name: str,
+        path: Optional[str] = None,
+        lease_ttl: Optional[float] = None,
+        result_ttl: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        self.name = name
+        self.path = path or os.getenv("SLIK_SINGLEFLIGHT_DB", ".cache/singleflight.sqlite3")
+        self.lease_ttl = lease_ttl or float(os.getenv("SLIK_SINGLEFLIGHT_LEASE_TTL", "600"))
+        self.result_ttl = result_ttl if result_ttl is not None else float(os.getenv("SLIK_SINGLEFLIGHT_RESULT_TTL", "60"))
+        self.poll_interval = poll_interval or float(os.getenv("SLIK_SINGLEFLIGHT_POLL_INTERVAL", "0.2"))
+
+        self._flights: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                token TEXT,
+                PRIMARY KEY (name, key)
+            )
+            """
+        )
+        # Tables created before leases carried a process token
+        if "token" not in {row[1] for row in self._conn.execute("PRAGMA table_info(leases)")}:
+            self._conn.execute("ALTER TABLE leases ADD COLUMN token TEXT")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (name, key)
+            )
+            """
+        )
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """The in-flight future of `key` in this process, and whether the caller is its leader"""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def _finish(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._flights.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _claim(self, key: str) -> Tuple[Optional[str], bool]:
+        """A stored result of `key`, or whether this process now holds its lease"""
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM results WHERE name = ? AND key = ? AND expires_at > ?", (self.name, key, now)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("COMMIT")
+                    return row[0], False
+                lease = self._conn.execute(
+                    "SELECT pid, token, expires_at FROM leases WHERE name = ? AND key = ?", (self.name, key)
+                ).fetchone()
+                leader = lease is None or lease[2] <= now or not owner_alive(lease[0], lease[1])
+                if leader:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO leases (name, key, pid, expires_at, token) VALUES (?, ?, ?, ?, ?)",
+                        (self.name, key, os.getpid(), now + self.lease_ttl, PROCESS_TOKEN),
+                    )
+                self._conn.execute("COMMIT")
+                return None, leader
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _release(self, key: str, value: Optional[str]) -> None:
+        """Store the leader's result (None when it failed) and drop its lease"""
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if value is not None and self.result_ttl > 0:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (self.name, key, value, now + self.result_ttl)
+                    )
+                self._conn.execute(
+                    "DELETE FROM leases WHERE name = ? AND key = ? AND pid = ? AND token = ?",
+                    (self.name, key, os.getpid(), PROCESS_TOKEN),
+                )
+                self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _coalesced(self, source: str) -> None:
+        COALESCED.labels(self.name, source).inc()
+        record(coalesced=1)
+
+    def run(self, key: str, fn: Callable[[], Any], dump: Callable[[Any], str], load: Callable[[str], Any]) -> Any:
+        """Return fn(), or the result of an identical call already running here or in another worker.
+
+        `dump` and `load` turn the result into a string and back for other workers.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            self._coalesced("in_process")
+            return future.result()
+        try:
+            while True:
+                value, leader = self._claim(key)
+                if value is not None:
+                    self._coalesced("other_worker")
+                    result = load(value)
+                    break
+                if leader:
+                    value = None
+                    try:
+                        result = fn()
+                        value = dump(result)
+                    finally:
+                        self._release(key, value)
+                    break
+                time.sleep(self.poll_interval)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def arun(
+        self, key: str, fn: Callable[[], Awaitable[Any]], dump: Callable[[Any], str], load: Callable[[str], Any]
+    ) -> Any:
+        """Async version of run; `fn` returns an awaitable"""
+        future, leader = self._join(key)
+        if not leader:
+            self._coalesced("in_process")
+            # Shielded so that a cancelled follower does not cancel the shared future
+            return await asyncio.shield(asyncio.wrap_future(future))
+        try:
+            while True:
+                value, leader = await run_in_thread(self._claim, key)
+                if value is not None:
+                    self._coalesced("other_worker")
+                    result = load(value)
+                    break
+                if leader:
+                    value = None
+                    try:
+                        result = await fn()
+                        value = dump(result)
+                    finally:
+                        await run_in_thread(self._release, key, value)
+                    break
+                await asyncio.sleep(self.poll_interval)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
@@ -2,11 +2,18 @@
 import streamlit as st
 from .processor import SLIKProcessor
 from .analyzer import SLIKAnalyzer, CreditAnalysis  # Added analyzer imports
+from .cache import content_hash
+from .features import month_key
+from .metrics import tracing
+from .models import quality_grade
 import pandas as pd
 import plotly.express as px
-import json
-import time
-from typing import Dict, List  # For type hints
+import threading
+from typing import Dict, List, Tuple  # For type hints
+
+PAGE_SIZES = [25, 50, 100, 250]
+# Processed reports kept per browser session
+MAX_SESSION_REPORTS = 8
 
 def display_analysis(analysis):
     st.header("Credit Analysis")
@@ -69,15 +76,131 @@ def display_analysis(analysis):
         else:
             st.write(rec)  # Just display the recommendation as is if not in expected format
 
+def display_analysis_stream(partials):
+    """Render credit score, risk level and summary as soon as they are generated, then the full analysis"""
+    placeholder = st.empty()
+    partial = {}
+    for partial in partials:
+        with placeholder.container():
+            st.header("Credit Analysis")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Credit Score", partial.get("credit_score", "..."))
+            with col2:
+                st.metric("Risk Level", partial.get("risk_level", "..."))
+            if partial.get("summary"):
+                st.subheader("Analysis Summary")
+                st.write(partial["summary"])
+    placeholder.empty()
+    display_analysis(CreditAnalysis.model_validate(partial))
+
+@st.cache_resource
+def get_processor():
+    """One SLIKProcessor per Streamlit server process, reused across reruns"""
+    return SLIKProcessor()
+
+@st.cache_resource
+def get_analyzer():
+    """One SLIKAnalyzer per Streamlit server process, reused across reruns"""
+    return SLIKAnalyzer()
+
 @st.fragment
 def fragment_generate_analysis(report):
     if st.button("Generate Credit Analysis"):
-        with st.spinner("Analyzing credit profile..."):
-            analyzer = SLIKAnalyzer()
-            analysis = analyzer.analyze(report)
-            display_analysis(analysis)
+        analyzer = get_analyzer()
+        display_analysis_stream(analyzer.stream_analysis(report))
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def facility_frames(file_hash: str, _report) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Facility table and long facility x month history of a report, built once per file hash"""
+    facilities, history = [], []
+    for index, facility in enumerate(_report.facilities):
+        label = f"{index + 1}. {facility.agreement_number or facility.reporter or 'Facility'}"
+        facilities.append({
+            'Facility': label,
+            'Reporter': facility.reporter,
+            'Type': facility.facility_type,
+            'Plafond': facility.plafond,
+            'Outstanding': facility.outstanding,
+            'Quality': quality_grade(facility.quality),
+            'Days Past Due': facility.days_past_due,
+            'Start Date': facility.start_date,
+            'Due Date': facility.due_date,
+            'History Months': len(facility.payment_history),
+        })
+        for entry in facility.payment_history:
+            month = month_key(entry.month)
+            if month is not None:
+                history.append((label, f"{month[0]:04d}-{month[1]:02d}", quality_grade(entry.quality), entry.days_past_due))
+    return (
+        pd.DataFrame(facilities),
+        pd.DataFrame(history, columns=['Facility', 'Month', 'Quality', 'Days Past Due']),
+    )
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def report_json(file_hash: str, _report) -> str:
+    """Indented JSON of a report, built once per file hash"""
+    return _report.model_dump_json(indent=2)
+
+def display_facility_table(file_hash: str, facilities: pd.DataFrame):
+    """One page of the facility table at a time"""
+    col1, col2 = st.columns(2)
+    with col1:
+        page_size = st.selectbox("Facilities per page", PAGE_SIZES, key="facility_page_size")
+    pages = max(1, -(-len(facilities) // page_size))
+    with col2:
+        # Keyed by report and page size, so the page restarts at 1 when either changes
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1, key=f"facility_page_{file_hash}_{page_size}")
+    start = (page - 1) * page_size
+    st.dataframe(facilities.iloc[start:start + page_size], use_container_width=True, hide_index=True)
+    st.caption(f"{len(facilities)} facilities, page {page} of {pages}")
+
+def display_history_heatmap(facilities: pd.DataFrame, history: pd.DataFrame):
+    """Quality grade or days past due of every facility (rows) in every month (columns)"""
+    metric = st.radio("Heatmap of", ['Quality', 'Days Past Due'], horizontal=True, key="heatmap_metric")
+    grid = history.pivot_table(index='Facility', columns='Month', values=metric, aggfunc='max')
+    grid = grid.reindex([label for label in facilities['Facility'] if label in grid.index])
+    highest = history[metric].max()
+    fig = px.imshow(
+        grid,
+        aspect='auto',
+        color_continuous_scale='RdYlGn_r',
+        zmin=1 if metric == 'Quality' else 0,
+        zmax=5 if metric == 'Quality' else max(float(highest) if pd.notna(highest) else 0.0, 1.0),
+        labels={'color': metric},
+    )
+    fig.update_layout(height=min(max(300, 18 * len(grid)), 2400), xaxis_title="Month", yaxis_title="Facility")
+    st.plotly_chart(fig, use_container_width=True)
+
+def display_facility_history(history: pd.DataFrame, label: str):
+    """Payment history of one facility"""
+    history_data = history[history['Facility'] == label].sort_values('Month')
+    fig = px.bar(history_data, x='Month', y='Days Past Due', title=f'Days Past Due by Month: {label}')
+    fig.update_layout(xaxis_title="Month", yaxis_title="Days Past Due", showlegend=False)
+    st.plotly_chart(fig, use_container_width=True)
 
-def display_slik_summary(report, raw_json):
+@st.fragment
+def fragment_facilities(file_hash: str, facilities: pd.DataFrame, history: pd.DataFrame):
+    # A fragment, so paging and switching views rerun only this part of the page
+    st.subheader("Facilities")
+    display_facility_table(file_hash, facilities)
+    if history.empty:
+        return
+    st.subheader("Payment History")
+    display_history_heatmap(facilities, history)
+    label = st.selectbox("Facility", facilities['Facility'], key="history_facility")
+    display_facility_history(history, label)
+
+def load_report(processor, file_hash: str, file_content: bytes):
+    """Processed report of an upload, kept per file hash so reruns do not process it again"""
+    reports = st.session_state.setdefault("reports", {})
+    if file_hash not in reports:
+        reports[file_hash] = process_with_progress(processor, file_content)
+        while len(reports) > MAX_SESSION_REPORTS:
+            reports.pop(next(iter(reports)))
+    return reports[file_hash]
+
+def display_slik_summary(report, file_hash):
     """Display SLIK report summary in Streamlit"""
     # Basic Information
     st.header("SLIK Report Summary")
@@ -108,43 +231,17 @@ def display_slik_summary(report, raw_json):
     with col5:
         st.metric("Credit Quality", report.worst_quality)
 
-    # Payment History Visualization
+    # Facilities and payment history of every facility
     if report.facilities:
-        st.subheader("Payment History")
-        facility = report.facilities[0]  # Assuming we're showing the first facility
-        
-        # Convert payment history to DataFrame
-        history_data = pd.DataFrame([
-            {
-                'Month': ph.month,
-                'Quality': ph.quality,
-                'Days Past Due': ph.days_past_due
-            }
-            for ph in facility.payment_history
-        ])
-        
-        # Display data table
-        st.subheader("Payment History Table")
-        st.dataframe(history_data, use_container_width=True)
-        
-        # Create bar chart
-        st.subheader("Payment History Bar Chart")
-        fig = px.bar(history_data, 
-                    x='Month', 
-                    y='Days Past Due',
-                    title='Days Past Due by Month')
-        fig.update_layout(
-            xaxis_title="Month",
-            yaxis_title="Days Past Due",
-            showlegend=False
-        )
-        st.plotly_chart(fig, use_container_width=True)
-    
-    # Display Raw JSON
+        facilities, history = facility_frames(file_hash, report)
+        fragment_facilities(file_hash, facilities, history)
+
+    # Raw JSON is only built and sent on request: for large reports it stalls the browser
     st.subheader("Raw JSON Response")
-    # Format the JSON for better readability
-    formatted_json = json.dumps(raw_json, indent=2)
-    st.code(formatted_json, language='json')
+    if st.toggle("Show raw JSON"):
+        raw_json = report_json(file_hash, report)
+        st.code(raw_json, language='json')
+        st.download_button("Download JSON", raw_json, file_name=f"{report.report_number or file_hash[:12]}.json", mime="application/json")
 
     # Add Analysis Section
     st.markdown("---")
@@ -152,52 +249,55 @@ def display_slik_summary(report, raw_json):
     # Add a button to trigger analysis
     fragment_generate_analysis(report)
 
+# Progress shown when a pipeline stage starts: (fraction, message)
+STAGE_PROGRESS = {
+    "ocr": (20, "Reading the document text (text layer / OCR)..."),
+    "extract": (50, "Extracting SLIK data..."),
+}
+
 def process_with_progress(processor, file_content):
-    """Process SLIK report with progress indicators"""
+    """Process SLIK report, driving the progress bar from the real pipeline stages"""
     progress_bar = st.progress(0)
     status_text = st.empty()
-    
-    # Stage 1: Initialize Processing
     status_text.text("Initializing SLIK report processing...")
-    progress_bar.progress(10)
-    time.sleep(0.5)
-    
-    # Stage 2: OCR Processing
-    status_text.text("Performing OCR on the document...")
-    progress_bar.progress(30)
-    time.sleep(0.5)
-    
-    # Stage 3: Text Extraction
-    status_text.text("Extracting text from document...")
-    progress_bar.progress(50)
-    time.sleep(0.5)
-    
-    # Stage 4: Data Processing
-    status_text.text("Processing SLIK data...")
-    progress_bar.progress(70)
-    result = processor.process_uploaded_file(file_content)
-    
-    # Stage 5: Finalizing
-    status_text.text("Finalizing results...")
-    progress_bar.progress(90)
-    time.sleep(0.5)
-    
-    # Complete
+    script_thread = threading.current_thread()
+    llm_calls = {"done": 0}
+
+    def on_stage(event, span):
+        # Stages running in worker threads (parallel LLM calls) cannot update Streamlit elements
+        if threading.current_thread() is not script_thread:
+            return
+        if event == "start" and span.name in STAGE_PROGRESS:
+            percent, message = STAGE_PROGRESS[span.name]
+            progress_bar.progress(percent)
+            status_text.text(message)
+        elif event == "end" and span.name == "ocr":
+            status_text.text(f"Text loaded in {span.duration:.1f}s")
+        elif event == "end" and span.name == "llm":
+            llm_calls["done"] += 1
+            progress_bar.progress(min(50 + 10 * llm_calls["done"], 90))
+
+    with tracing(on_stage) as trace:
+        result = processor.process_uploaded_file(file_content)
+
     progress_bar.progress(100)
-    status_text.text("Processing complete!")
-    time.sleep(1)
-    
+    timings = ", ".join(f"{name} {totals['ms'] / 1000:.1f}s" for name, totals in trace.summary().items())
+    if trace.attrs.get("report_cache_hit"):
+        st.caption("Loaded from cache")
+    elif timings:
+        st.caption(f"Stage timings: {timings}")
+
     # Clear progress indicators
     status_text.empty()
     progress_bar.empty()
-    
+
     return result
 
 def main():
     st.set_page_config(page_title="SLIK Report Analyzer", layout="wide")
     st.title("SLIK Report Analyzer")
 
-    processor = SLIKProcessor()
+    processor = get_processor()
     
     # File uploader
     uploaded_file = st.file_uploader("Upload SLIK PDF Report", type="pdf")
@@ -206,16 +306,14 @@ def main():
         try:
             # Add a spinner while reading the file
             with st.spinner('Reading uploaded file...'):
-                file_content = uploaded_file.read()
-            
-            # Process with progress bar
-            result = process_with_progress(processor, file_content)
+                file_content = uploaded_file.getvalue()
+                file_hash = content_hash(file_content)
             
-            # Get raw JSON for display
-            raw_json = json.loads(result.model_dump_json())
+            # Process with progress bar, only the first time this file is seen
+            result = load_report(processor, file_hash, file_content)
             
-            # Display results with raw JSON
-            display_slik_summary(result, raw_json)
+            # Display results
+            display_slik_summary(result, file_hash)
             
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
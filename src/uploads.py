@@ -0,0 +1,198 @@
+"""Multipart uploads written once, straight to the file they are processed from.
+
+`UploadFile` parameters are spooled by Starlette before the endpoint runs: an oversized
+body is received in full before it can be rejected, and a PDF that has to be on disk for
+OCR ends up written twice. `receive_uploads` parses the request body itself instead, writing
+each file part to a path chosen by the caller and hashing it on the way.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+from .concurrency import run_in_thread
+from .metrics import record, stage
+
+MAX_UPLOAD_BYTES = int(os.getenv("SLIK_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+# Part headers, boundaries and form fields on top of the file contents
+FORM_OVERHEAD_BYTES = 64 * 1024
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class TooManyFilesError(Exception):
+    """Raised when a request carries more files than it may upload at once"""
+
+
+class Upload:
+    """A file part of a request, written to `path`"""
+
+    def __init__(self, field: str, filename: Optional[str], path: Path):
+        self.field = field
+        self.filename = filename
+        self.path = path
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.out: Optional[BinaryIO] = None
+
+    @property
+    def file_hash(self) -> str:
+        return self.digest.hexdigest()
+
+
+def new_temp_path() -> Path:
+    """A new, empty temporary PDF file"""
+    fd, name = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    return Path(name)
+
+
+def too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File exceeds the {MAX_UPLOAD_BYTES} byte upload limit")
+
+
+class _FormReader:
+    """python-multipart callbacks collecting the fields and the file chunks of a form"""
+
+    def __init__(self, new_path: Callable[[], Path], max_files: int):
+        self.new_path = new_path
+        self.max_files = max_files
+        self.fields: Dict[str, str] = {}
+        self.uploads: List[Upload] = []
+        # File chunks parsed from the last body chunk, written off the event loop
+        self.pending: List[Tuple[Upload, bytes]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._name = ""
+        self._data = bytearray()
+        self._upload: Optional[Upload] = None
+
+    def callbacks(self) -> Dict[str, Callable[..., None]]:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+        self._data = bytearray()
+        self._upload = None
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise HTTPException(status_code=400, detail='Every form part needs a Content-Disposition "name"')
+        self._name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" in options:
+            if len(self.uploads) >= self.max_files:
+                raise TooManyFilesError(f"At most {self.max_files} files can be uploaded at once")
+            self._upload = Upload(self._name, options[b"filename"].decode("utf-8", "replace"), self.new_path())
+            self.uploads.append(self._upload)
+            self._upload.out = self._upload.path.open("wb")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        chunk = data[start:end]
+        if self._upload is None:
+            if len(self._data) + len(chunk) > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Form field {self._name} exceeds {MAX_FIELD_BYTES} bytes")
+            self._data.extend(chunk)
+            return
+        self._upload.size += len(chunk)
+        if self._upload.size > MAX_UPLOAD_BYTES:
+            raise too_large()
+        self._upload.digest.update(chunk)
+        self.pending.append((self._upload, chunk))
+
+    def on_part_end(self) -> None:
+        if self._upload is None:
+            self.fields[self._name] = self._data.decode("utf-8", "replace")
+
+    def write_pending(self) -> None:
+        for upload, chunk in self.pending:
+            upload.out.write(chunk)
+        self.pending.clear()
+
+    def close(self) -> None:
+        for upload in self.uploads:
+            if upload.out is not None:
+                upload.out.close()
+
+
+async def receive_uploads(
+    request: Request, new_path: Callable[[], Path] = new_temp_path, max_files: int = 1,
+) -> Tuple[Dict[str, str], List[Upload]]:
+    """Read a multipart/form-data body once, writing every file part to `new_path()` as it arrives.
+
+    Returns the form fields and the uploaded files. A body whose Content-Length cannot fit
+    `max_files` files of `SLIK_MAX_UPLOAD_BYTES` is rejected with 413 before it is read, and
+    any other upload as soon as one of its files grows past the limit. Files written before
+    an error are removed.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=415, detail="Expected a multipart/form-data upload")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_files * (MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES):
+        raise too_large()
+
+    reader = _FormReader(new_path, max_files)
+    parser = MultipartParser(params[b"boundary"], reader.callbacks())
+    try:
+        with stage("upload"):
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if reader.pending:
+                    await run_in_thread(reader.write_pending)
+            parser.finalize()
+            await run_in_thread(reader.close)
+            record(bytes=sum(upload.size for upload in reader.uploads))
+    except BaseException:
+        reader.close()
+        for upload in reader.uploads:
+            upload.path.unlink(missing_ok=True)
+        raise
+    return reader.fields, reader.uploads
+
+
+async def receive_pdf(request: Request) -> Upload:
+    """The single PDF uploaded in the `file` field of a request, written to a temporary file"""
+    try:
+        _, uploads = await receive_uploads(request)
+    except TooManyFilesError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not uploads or uploads[0].field != "file":
+        for upload in uploads:
+            upload.path.unlink(missing_ok=True)
+        raise HTTPException(status_code=422, detail="A PDF file is required in the `file` form field")
+    return uploads[0]
+
+
+def form_body(fields: Dict[str, Any], required: List[str]) -> Dict[str, Any]:
+    """OpenAPI request body of a multipart form, for endpoints that read it with `receive_uploads`"""
+    schema = {"type": "object", "properties": fields, "required": required}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
+
+
+PDF_FORM = form_body({"file": {"type": "string", "format": "binary"}}, ["file"])
@@ -0,0 +1,33 @@
+import pyarrow.dataset as ds
+import pytest
+
+from src.cli import ParquetWriter
+
+
+def record(i, ok):
+    return {
+        "file": f"{i}.pdf", "sha256": f"hash-{i}", "status": "ok" if ok else "error",
+        "error": None if ok else "boom", "elapsed": 1.5,
+        "slik_data": {"report_number": str(i)} if ok else None, "analysis": None,
+    }
+
+
+def test_parts_share_one_schema(tmp_path):
+    # The first part holds errors only, so every JSON column is empty in it
+    with ParquetWriter(str(tmp_path), batch_size=2) as writer:
+        for i, ok in enumerate([False, False, True, True, True]):
+            writer.write(record(i, ok))
+
+    table = ds.dataset(tmp_path, format="parquet").to_table()
+    assert table.num_rows == 5
+    assert ParquetWriter(str(tmp_path)).done_hashes() == {"hash-2", "hash-3", "hash-4"}
+
+
+def test_buffered_rows_are_written_when_interrupted(tmp_path):
+    with pytest.raises(KeyboardInterrupt):
+        with ParquetWriter(str(tmp_path), batch_size=100) as writer:
+            writer.write(record(0, True))
+            raise KeyboardInterrupt
+
+    assert ParquetWriter(str(tmp_path)).done_hashes() == {"hash-0"}
+    assert not list(tmp_path.glob(".*.tmp"))
@@ -0,0 +1,101 @@
+from datetime import date
+
+import pytest
+
+from src.cache import ResultCache
+from src.history import DebtorHistory, is_material, report_delta, section_hash
+from src.models import CreditFacility, PaymentHistory, SLIKReport
+from src.processor import SLIKProcessor
+from src.singleflight import SingleFlight
+
+HEADER = """Nomor Laporan : {number}
+Tanggal Laporan : {date}
+Nama Sesuai Identitas : BUDI SANTOSO
+NIK : 3273012345678901
+"""
+
+FACILITY = """1. Pelapor : PT Bank Mandiri (Persero) Tbk
+No Rekening : {agreement}
+Plafon : Rp 100.000.000,00
+Baki Debet : Rp {outstanding},00
+Kualitas : 1 - Lancar
+{history}
+"""
+
+
+def report_text(number, report_date, facilities):
+    return HEADER.format(number=number, date=report_date) + "".join(
+        FACILITY.format(agreement=agreement, outstanding=outstanding, history=history)
+        for agreement, outstanding, history in facilities
+    )
+
+
+def facility(agreement, outstanding, history, quality="1"):
+    return CreditFacility(
+        reporter="Bank", agreement_number=agreement, plafond=100.0, outstanding=outstanding, quality=quality,
+        payment_history=[PaymentHistory(month=month, quality=q, days_past_due=dpd) for month, q, dpd in history],
+    )
+
+
+def test_section_hash_ignores_whitespace():
+    assert section_hash("Plafon : Rp 1\nKualitas : 1") == section_hash("Plafon :  Rp 1 Kualitas : 1 ")
+
+
+def test_store_keeps_latest_report_and_its_analysis(tmp_path):
+    history = DebtorHistory(str(tmp_path / "history.sqlite3"))
+    old = SLIKReport(debtor_id="1", report_number="A", report_date=date(2024, 8, 1), facilities=[facility("K1", 50.0, [])])
+    new = SLIKReport(debtor_id="1", report_number="B", report_date=date(2024, 9, 1))
+    history.save_report(old, {"K1": "hash"})
+    history.save_report(new)
+    history.save_analysis(old, '{"credit_score": 700}')
+    # Storing the same report again keeps its analysis
+    history.save_report(old)
+
+    assert history.latest("1").report_number == "B"
+    assert history.analysis("1", "A") == '{"credit_score": 700}'
+    assert history.facility_sections("1")["K1"][0] == "hash"
+    assert history.latest("2") is None
+
+
+def test_delta_compares_months_and_grades_not_strings():
+    previous = SLIKReport(facilities=[facility("K1", 50.0, [("2024-08", "1", 0)], quality="1 - Lancar")])
+    current = SLIKReport(facilities=[facility("K1", 50.0, [("Sep 2024", "2", 15), ("Aug 2024", "1", 0)], quality="1")])
+    delta = report_delta(previous, current)
+    assert delta["changed_facilities"] == []
+    assert [entry["month"] for entry in delta["new_delinquencies"]] == ["Sep 2024"]
+    assert is_material(delta)
+
+
+def test_delta_of_an_unchanged_report_is_not_material():
+    report = SLIKReport(worst_quality="1", facilities=[facility("K1", 50.0, [("2024-08", "1", 0)])])
+    same = report.model_copy(update={"worst_quality": "1 - Lancar"})
+    assert not is_material(report_delta(report, same))
+
+
+@pytest.mark.parametrize("outstanding, material", [(52.0, False), (60.0, True)])
+def test_utilization_change_is_in_points_of_the_plafond(outstanding, material):
+    previous = SLIKReport(facilities=[facility("K1", 50.0, [])])
+    current = SLIKReport(facilities=[facility("K1", outstanding, [])])
+    assert is_material(report_delta(previous, current)) == material
+
+
+def test_incremental_report_holds_only_what_the_new_pdf_shows(tmp_path):
+    processor = SLIKProcessor(
+        rule_based=True,
+        cache=ResultCache(path=str(tmp_path / "cache.sqlite3")),
+        text_cache=ResultCache(namespace="text", path=str(tmp_path / "cache.sqlite3")),
+        history=DebtorHistory(str(tmp_path / "history.sqlite3")),
+        flights=SingleFlight("report", path=str(tmp_path / "singleflight.sqlite3")),
+    )
+    first = report_text("A", "01/08/2024", [("K1", "60.000.000", "Agu 2024 | 1 | 0\nJul 2024 | 1 | 0")])
+    second = report_text("B", "01/09/2024", [("K1", "58.000.000", "Sep 2024 | 2 | 15\nAgu 2024 | 1 | 0")])
+
+    report, previous = processor.extract_incremental(first)
+    assert previous is None
+    report, previous = processor.extract_incremental(second)
+
+    assert previous.report_number == "A"
+    # Jul 2024 is only in the previous pull: it is not merged into the new report
+    assert [entry.month for entry in report.facilities[0].payment_history] == ["2024-09", "2024-08"]
+    assert report == processor.extract(second)
+    assert [entry["month"] for entry in report_delta(previous, report)["new_delinquencies"]] == ["2024-09"]
@@ -0,0 +1,98 @@
+from datetime import date
+
+import pytest
+
+from src.models import CreditFacility, PaymentHistory
+from src.rule_parser import fill_missing, parse_amount, parse_date, parse_facility, parse_payment_history
+
+FACILITY = """1. Pelapor : PT Bank Mandiri (Persero) Tbk
+Cabang : KC Bandung
+No Rekening : 1234567890
+Jenis Kredit/Pembiayaan : Kredit Pemilikan Rumah
+Plafon Awal : Rp 120.000.000,00
+Plafon : Rp 100.000.000,00
+Baki Debet : Rp 60.500.000,00
+Tanggal Mulai : 15 Mar 2020
+Tanggal Jatuh Tempo : 15/03/2035
+Suku Bunga/Imbalan : 8,75 %
+Kualitas : 1 - Lancar
+Jumlah Hari Tunggakan : 0
+Sep 2024 | 1 | 0
+Agu 2024 | 2 | 15
+"""
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("Rp 1.250.000,50", 1250000.5),
+    ("1,250,000.50", 1250000.5),
+    ("Rp 150.000.000,00", 150000000.0),
+    ("1.000.000", 1000000.0),
+    ("1,000,000", 1000000.0),
+    ("12,5", 12.5),
+    ("-Rp 5.000.000", -5000000.0),
+    ("n/a", None),
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("17/10/2024", date(2024, 10, 17)),
+    ("17-10-2024", date(2024, 10, 17)),
+    ("2024-10-17", date(2024, 10, 17)),
+    ("17 Oktober 2024", date(2024, 10, 17)),
+    ("1 Agu 2024", date(2024, 8, 1)),
+    ("31/02/2024", None),
+    ("sometime", None),
+])
+def test_parse_date(value, expected):
+    assert parse_date(value) == expected
+
+
+def test_parse_payment_history_rows_and_grid():
+    history = parse_payment_history("Sep 2024 | 1 | 0\nAgu-24 2 15\nJan 2024 1 0   Feb 2024 3 45\tMar 2024 | 1")
+    assert [(entry.month, entry.quality, entry.days_past_due) for entry in history] == [
+        ("2024-09", "1", 0),
+        ("2024-08", "2", 15),
+        ("2024-01", "1", 0),
+        ("2024-02", "3", 45),
+        ("2024-03", "1", None),
+    ]
+
+
+def test_parse_payment_history_ignores_dates_in_label_rows():
+    history = parse_payment_history("Tanggal Laporan : 17 Oktober 2024 | 1\nTanggal Mulai : 15 Mar 2020 | 2\nSep 2024 | 1 | 0")
+    assert [entry.month for entry in history] == ["2024-09"]
+
+
+def test_parse_facility():
+    facility, missing = parse_facility(FACILITY)
+    assert missing == []
+    assert facility.reporter == "PT Bank Mandiri (Persero) Tbk"
+    assert facility.agreement_number == "1234567890"
+    assert facility.plafond == 100000000.0  # not "Plafon Awal"
+    assert facility.outstanding == 60500000.0
+    assert facility.start_date == date(2020, 3, 15)
+    assert facility.due_date == date(2035, 3, 15)
+    assert facility.interest_rate == 8.75
+    assert facility.quality == "1"
+    assert [entry.month for entry in facility.payment_history] == ["2024-09", "2024-08"]
+
+
+def test_parse_facility_reports_missing_fields():
+    facility, missing = parse_facility("2. Pelapor : PT Bank BCA Tbk\nPlafon : Rp 50.000.000\n")
+    assert facility.reporter == "PT Bank BCA Tbk"
+    assert missing == ["outstanding", "quality"]
+
+
+def test_negative_amount_is_replaced_by_the_llm_value():
+    facility, missing = parse_facility(FACILITY.replace("Baki Debet : Rp", "Baki Debet : -Rp"))
+    assert facility.outstanding == -60500000.0
+    assert missing == ["outstanding"]
+
+    extracted = CreditFacility(outstanding=60500000.0, plafond=1.0, payment_history=[PaymentHistory(month="2024-09")])
+    filled = fill_missing(facility, extracted, missing)
+    assert filled.outstanding == 60500000.0
+    # Valid parsed values are kept
+    assert filled.plafond == 100000000.0
+    assert len(filled.payment_history) == 2
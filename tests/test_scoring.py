@@ -0,0 +1,45 @@
+from datetime import date
+
+import pytest
+
+from src.models import CreditFacility, PaymentHistory, SLIKReport
+from src.scoring import NO_HISTORY_MAX_SCORE, preliminary_analysis, score_reports
+
+
+def report(months, quality="1", facilities=1):
+    history = [PaymentHistory(month=f"2024-{month:02d}", quality=quality, days_past_due=0) for month in months]
+    return SLIKReport(
+        report_date=date(2024, 12, 1),
+        facilities=[
+            CreditFacility(plafond=100.0, outstanding=40.0, quality=quality, payment_history=history)
+            for _ in range(facilities)
+        ],
+    )
+
+
+def strengths(row):
+    return [item["detail"] for item in preliminary_analysis(row)["key_strengths"]]
+
+
+def test_clean_history_scores_low_risk():
+    row = score_reports([report(range(1, 13))]).iloc[0]
+    assert row["risk_level"] == "Low"
+    assert "All facilities Lancar (quality 1) over the history window" in strengths(row)
+
+
+@pytest.mark.parametrize("empty", [report([]), report([], facilities=0)], ids=["no history", "no facilities"])
+def test_missing_history_is_unknown_not_best_case(empty):
+    row = score_reports([empty]).iloc[0]
+    assert row["history_months"] == 0
+    assert row["preliminary_score"] <= NO_HISTORY_MAX_SCORE
+    assert row["risk_level"] == "Medium"
+    assert not any("Lancar" in detail for detail in strengths(row))
+
+
+def test_history_is_aligned_to_the_report_month():
+    # A facility whose history ended two years before the report has no recent late months
+    old = SLIKReport(report_date=date(2024, 12, 1), facilities=[CreditFacility(payment_history=[
+        PaymentHistory(month="2022-11", quality="2", days_past_due=30),
+    ])])
+    row = score_reports([old]).iloc[0]
+    assert row["late_months_12"] == 0
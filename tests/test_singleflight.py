@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import pytest
+
+from src.concurrency import PROCESS_TOKEN
+from src.singleflight import SingleFlight
+
+
+@pytest.fixture
+def flight(tmp_path):
+    return SingleFlight("test", path=str(tmp_path / "singleflight.sqlite3"), result_ttl=60, poll_interval=0.01)
+
+
+def insert_lease(flight, pid, token, expires_at):
+    flight._conn.execute(
+        "INSERT INTO leases (name, key, pid, expires_at, token) VALUES (?, ?, ?, ?, ?)",
+        (flight.name, "key", pid, expires_at, token),
+    )
+
+
+def run(flight, calls):
+    def fn():
+        calls.append(1)
+        return "computed"
+    return flight.run("key", fn, dump=str, load=lambda value: f"loaded {value}")
+
+
+def test_leader_runs_and_shares_its_result(flight):
+    calls = []
+    assert run(flight, calls) == "computed"
+    assert calls == [1]
+    assert flight._conn.execute("SELECT COUNT(*) FROM leases").fetchone()[0] == 0
+    # A duplicate arriving after the leader finished gets the stored result
+    assert run(flight, calls) == "loaded computed"
+    assert calls == [1]
+
+
+def test_follower_waits_for_the_leader_of_another_worker(flight):
+    # A live process other than ours holds the lease
+    insert_lease(flight, os.getppid(), "other-worker", time.time() + 600)
+
+    def finish():
+        time.sleep(0.1)
+        leader = SingleFlight("test", path=flight.path)
+        leader._conn.execute(
+            "INSERT INTO results VALUES (?, ?, ?, ?)", ("test", "key", "from leader", time.time() + 60)
+        )
+        leader._conn.execute("DELETE FROM leases")
+
+    thread = threading.Thread(target=finish)
+    thread.start()
+    calls = []
+    assert run(flight, calls) == "loaded from leader"
+    thread.join()
+    assert calls == []
+
+
+def test_expired_lease_is_taken_over(flight):
+    insert_lease(flight, os.getppid(), "other-worker", time.time() - 1)
+    calls = []
+    assert run(flight, calls) == "computed"
+    assert calls == [1]
+
+
+def test_lease_of_an_earlier_process_with_our_pid_is_taken_over(flight):
+    # e.g. PID 1 in a restarted container: same pid, different process token
+    insert_lease(flight, os.getpid(), "earlier-process", time.time() + 600)
+    calls = []
+    started = time.monotonic()
+    assert run(flight, calls) == "computed"
+    assert calls == [1]
+    assert time.monotonic() - started < 1
+
+
+def test_lease_of_this_process_is_respected(flight):
+    insert_lease(flight, os.getpid(), PROCESS_TOKEN, time.time() + 600)
+    assert flight._claim("key") == (None, False)